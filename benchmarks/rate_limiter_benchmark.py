@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+Rate limiter benchmark for the GenAIPot SMTP listener.
+
+Feeds synthetic source addresses to smtp.rate_limiter.RateLimiter and reports the
+time per check, the number of tracked sources and the approximate memory they use as JSON:
+
+    python benchmarks/rate_limiter_benchmark.py --ips 1M --max-tracked 100k
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from smtp.rate_limiter import RateLimiter
+from storage_benchmark import parse_count, git_revision
+
+def addresses(scenario, count, rng):
+    """
+    Generate the source addresses of a scenario.
+
+    Args:
+        scenario (str): 'distinct-v4', 'distinct-v6' or 'scanner' (a single source).
+        count (int): Number of connections.
+        rng (random.Random): Random source.
+
+    Returns:
+        list: Address strings, one per connection.
+    """
+    if scenario == 'scanner':
+        return ['192.0.2.1'] * count
+    if scenario == 'distinct-v6':
+        return ['2001:db8:' + ':'.join(f'{rng.getrandbits(16):x}' for _ in range(6)) for _ in range(count)]
+    return ['%d.%d.%d.%d' % (value >> 24, value >> 16 & 255, value >> 8 & 255, value & 255)
+            for value in rng.sample(range(1, 2 ** 32), count)]
+
+def limiter_size(limiter):
+    # The bucket table and its entries; address strings are shared with the caller
+    size = sys.getsizeof(limiter.buckets)
+    for key, bucket in limiter.buckets.items():
+        size += sys.getsizeof(bucket) + sys.getsizeof(bucket[0]) + sys.getsizeof(bucket[1])
+        if isinstance(key, tuple):
+            size += sys.getsizeof(key) + sys.getsizeof(key[1])
+    return size
+
+def run_scenario(scenario, ips, args, prefix_v4=32, prefix_v6=128):
+    """
+    Time allow_connection() over every address and estimate the memory held by the limiter.
+
+    Returns:
+        dict: The scenario results.
+    """
+    limiter = RateLimiter(args.rate_limit, max_tracked=args.max_tracked, prefix_v4=prefix_v4, prefix_v6=prefix_v6)
+    check = limiter.allow_connection
+    start = time.perf_counter()
+    for ip in ips:
+        check(ip)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'scenario': scenario,
+        'prefix_v4': prefix_v4,
+        'prefix_v6': prefix_v6,
+        'checks': len(ips),
+        'seconds': round(elapsed, 3),
+        'checks_per_second': round(len(ips) / elapsed) if elapsed else None,
+        'ns_per_check': round(elapsed / len(ips) * 1e9, 1) if ips else None,
+        'memory_bytes': limiter_size(limiter),
+    }
+    result.update(limiter.stats())
+    return result
+
+def main():
+    """
+    Parse the command line, run every scenario and write the results.
+    """
+    parser = argparse.ArgumentParser(description="GenAIPot rate limiter benchmark")
+    parser.add_argument('--ips', type=parse_count, default=1000000,
+                        help='Connections per scenario, each from a distinct source (default: 1M)')
+    parser.add_argument('--max-tracked', type=parse_count, default=100000,
+                        help='Sources tracked before the least recently seen is evicted (default: 100k)')
+    parser.add_argument('--rate-limit', type=int, default=5, help='Connections allowed per minute (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    v4 = addresses('distinct-v4', args.ips, rng)
+    v6 = addresses('distinct-v6', args.ips, rng)
+    runs = [
+        ('distinct-v4', v4, {}),
+        ('distinct-v4', v4, {'prefix_v4': 24}),
+        ('distinct-v6', v6, {}),
+        ('distinct-v6', v6, {'prefix_v6': 64}),
+        ('scanner', addresses('scanner', args.ips, rng), {}),
+    ]
+    results = {
+        'meta': {
+            'started': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': vars(args),
+        },
+        'results': [],
+    }
+    for scenario, ips, prefixes in runs:
+        print(f"Benchmarking {scenario} {prefixes or ''}...", file=sys.stderr)
+        results['results'].append(run_scenario(scenario, ips, args, **prefixes))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+Storage benchmark for the GenAIPot interaction log.
+
+Generates synthetic SMTP and POP3 sessions through the public database API and
+reports insert throughput, enqueue latency percentiles, size on disk and the
+latency of common reader queries as JSON, so storage changes can be compared
+from run to run:
+
+    python benchmarks/storage_benchmark.py --rows 10k,1M --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import database
+
+SMTP_SESSION = [
+    ('EHLO client.example.com', '250-localhost Hello\r\n250-SIZE 52428800\r\n250-8BITMIME\r\n250 HELP'),
+    ('MAIL FROM:<sender@example.com>', '250 OK'),
+    ('RCPT TO:<admin@localhost>', '250 Accepted'),
+    ('DATA', '354 End data with <CR><LF>.<CR><LF>'),
+    ('.', '250 OK: Queued'),
+    ('QUIT', '221 Bye'),
+]
+
+POP3_SESSION = [
+    ('USER admin', '+OK User accepted'),
+    ('PASS secret', '+OK Pass accepted'),
+    ('STAT', '+OK 3 4096'),
+    ('LIST', '+OK 3 messages'),
+    ('RETR 1', '+OK 1024 octets'),
+    ('QUIT', '+OK POP3 server signing off'),
+]
+
+BANNERS = {'smtp': '220 localhost ESMTP Postfix', 'pop3': '+OK localhost POP3 server ready'}
+
+SUFFIXES = {'k': 1000, 'm': 1000 ** 2}
+
+def parse_count(text):
+    """
+    Parse a row count such as '10000', '10k' or '50M'.
+
+    Args:
+        text (str): The count, with an optional k or M suffix.
+
+    Returns:
+        int: The number of rows.
+    """
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+def percentile(sorted_values, fraction):
+    """
+    Return a percentile of already sorted values.
+
+    Args:
+        sorted_values (list): Values in ascending order.
+        fraction (float): Percentile between 0 and 1.
+
+    Returns:
+        float: The value at that percentile, 0 if there are no values.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def generate(rows, ips, rng, sample_every):
+    """
+    Log synthetic sessions until the requested number of interactions is queued.
+
+    Returns:
+        dict: Elapsed seconds for the producer, sampled enqueue latencies in
+            microseconds, the timestamp after 90% of the rows and the first client IP.
+    """
+    latencies = []
+    logged = 0
+    recent_since = None
+    first_ip = None
+    mark = int(rows * 0.9)
+    started = time.perf_counter()
+    while logged < rows:
+        protocol = 'smtp' if rng.random() < 0.7 else 'pop3'
+        script = SMTP_SESSION if protocol == 'smtp' else POP3_SESSION
+        ip = rng.choice(ips)
+        first_ip = first_ip or ip
+        session = database.open_session(protocol, ip, rng.randint(1024, 65535))
+        for command, response in [(database.WELCOME, BANNERS[protocol])] + script:
+            if logged >= rows:
+                break
+            if logged % sample_every:
+                database.log_interaction(ip, command, response, session=session)
+            else:
+                t0 = time.perf_counter_ns()
+                database.log_interaction(ip, command, response, session=session)
+                latencies.append((time.perf_counter_ns() - t0) / 1000)
+            logged += 1
+            if logged == mark:
+                recent_since = datetime.now().isoformat()
+        database.close_session(session)
+    return {'seconds': time.perf_counter() - started, 'latencies': latencies, 'recent_since': recent_since,
+            'first_ip': first_ip}
+
+def time_reader(name, func, repeat):
+    timings, count = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = func()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return name, {'median_ms': round(timings[len(timings) // 2] * 1000, 3),
+                  'min_ms': round(timings[0] * 1000, 3), 'rows': count}
+
+def measure_readers(ip, recent_since, rows, args):
+    def scan(**filters):
+        return sum(len(chunk) for chunk in database.iter_interactions(chunk_size=args.chunk_size, **filters))
+
+    def session_lookup():
+        with database.attached_shards() as conn:
+            session_id = conn.execute('SELECT MAX(id) FROM sessions').fetchone()[0]
+            return len(conn.execute('SELECT seq, command, response FROM interactions WHERE session_id = ? '
+                                    'ORDER BY seq', (session_id,)).fetchall())
+
+    readers = [
+        ('full_scan', lambda: scan()),
+        ('full_scan_ip_timestamp', lambda: scan(columns=['ip', 'timestamp'])),
+        ('single_ip', lambda: scan(ip=ip)),
+        ('recent_10_percent', lambda: scan(since=recent_since)),
+        ('smtp_only', lambda: scan(protocol='smtp', columns=['ip', 'command'])),
+        ('session_lookup', session_lookup),
+    ]
+    if rows <= args.max_collect_rows:
+        readers.append(('collect_honeypot_data', lambda: len(database.collect_honeypot_data())))
+    return dict(time_reader(name, func, args.repeat) for name, func in readers)
+
+def run_size(rows, args):
+    """
+    Benchmark one table size in a fresh database.
+
+    Args:
+        rows (int): Number of interactions to log.
+        args (argparse.Namespace): Parsed command line options.
+
+    Returns:
+        dict: The measurements for this size.
+    """
+    workdir = tempfile.mkdtemp(prefix='genaipot-bench-', dir=args.workdir)
+    try:
+        if not database.config.has_section('database'):
+            database.config.add_section('database')
+        # Block instead of dropping so every generated row is stored and timed
+        database.config.set('database', 'overflow', 'block')
+        database.config.set('database', 'queue_size', str(args.queue_size))
+        database.config.set('database', 'batch_size', str(args.batch_size))
+        database.open_storage(os.path.join(workdir, 'bench.db'))
+        database.setup_database()
+        rng = random.Random(args.seed)
+        ips = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(args.ips)]
+
+        produced = generate(rows, ips, rng, max(1, rows // args.latency_samples))
+        drain_start = time.perf_counter()
+        database.get_writer().stop()
+        drain = time.perf_counter() - drain_start
+        stats = database.writer_stats()
+        database.shutdown_database()
+        database.open_storage(os.path.join(workdir, 'bench.db'))
+
+        latencies = sorted(produced['latencies'])
+        total = produced['seconds'] + drain
+        catalog = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)
+                      if name.startswith('bench.db'))
+        shards = directory_size(os.path.join(workdir, 'shards'))
+        result = {
+            'rows': rows,
+            'insert': {
+                'producer_seconds': round(produced['seconds'], 3),
+                'drain_seconds': round(drain, 3),
+                'rows_per_second': round(rows / total, 1),
+                'enqueue_p50_us': round(percentile(latencies, 0.50), 2),
+                'enqueue_p99_us': round(percentile(latencies, 0.99), 2),
+                'enqueue_max_us': round(latencies[-1] if latencies else 0.0, 2),
+                'latency_samples': len(latencies),
+            },
+            'writer': stats,
+            'size': {
+                'catalog_bytes': catalog,
+                'shard_bytes': shards,
+                'total_bytes': catalog + shards,
+                'bytes_per_row': round((catalog + shards) / rows, 1) if rows else 0,
+            },
+            'readers': measure_readers(produced['first_ip'], produced['recent_since'], rows, args),
+        }
+        database.shutdown_database()
+        return result
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    """
+    Parse the command line, run the benchmark for every requested size and write the results.
+    """
+    parser = argparse.ArgumentParser(description="GenAIPot storage benchmark")
+    parser.add_argument('--rows', default='10k,100k',
+                        help='Comma-separated interaction counts, e.g. 10k,1M,50M (default: 10k,100k)')
+    parser.add_argument('--ips', type=int, default=5000, help='Distinct client IPs (default: 5000)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Writer batch size (default: 500)')
+    parser.add_argument('--queue-size', type=int, default=10000, help='Writer queue size (default: 10000)')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Reader chunk size (default: 50000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per reader query (default: 3)')
+    parser.add_argument('--latency-samples', type=int, default=1000000,
+                        help='Maximum enqueue latencies recorded per size (default: 1000000)')
+    parser.add_argument('--max-collect-rows', type=parse_count, default=1000000,
+                        help='Largest size for which collect_honeypot_data() is timed (default: 1M)')
+    parser.add_argument('--workdir', help='Directory for the temporary databases (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated databases')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    sizes = [parse_count(size) for size in args.rows.split(',') if size.strip()]
+    results = {
+        'meta': {
+            'started': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'options': vars(args),
+        },
+        'results': [],
+    }
+    for rows in sizes:
+        print(f"Benchmarking {rows} interactions...", file=sys.stderr)
+        results['results'].append(run_size(rows, args))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
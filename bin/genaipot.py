@@ -41,7 +41,9 @@ from ai.azure_service import AzureAIService  # Adjusted for src/ai directory
 from smtp_protocol import SMTPFactory
 from pop3.pop3_protocol import POP3Factory
 from auth import check_credentials, hash_password
-from database import setup_database
+from database import setup_database, shutdown_database, export_interactions, start_retention
+from sinks import shutdown_sinks
+import tls
 from config_wizard import run_config_wizard  # Import the function from the external config_wizard.py file
 
 VERSION = "0.9.1"
@@ -203,6 +205,9 @@ def main():
     parser.add_argument('--pop3', action='store_true', help='Start POP3 honeypot')
     parser.add_argument('--all', action='store_true', help='Start all honeypots')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--export', nargs='?', const='', metavar='DIR',
+                        help='Export interactions logged since the last export to DIR and exit')
+    parser.add_argument('--export-format', choices=['parquet', 'arrow'], help='File format used by --export')
     args = parser.parse_args()
 
     # Initialize logging
@@ -227,6 +232,18 @@ def main():
     # Set up the database
     setup_database()
 
+    # Export new interactions to columnar files and exit
+    if args.export is not None:
+        try:
+            stats = export_interactions(args.export or None, fmt=args.export_format)
+            print(f"Exported {stats['rows']} interactions in {stats['files']} files (watermark {stats['watermark']})")
+        except (RuntimeError, ValueError) as e:
+            logger.error(f"Export failed: {e}")
+            sys.exit(1)
+        finally:
+            shutdown_database()
+        return
+
     # If --config or --docker is specified, run the configuration wizard
     if args.config or args.docker:
         run_config_wizard(args, config, config_file_path)
@@ -259,17 +276,36 @@ def main():
                 logger.debug(f"Domain Name: {config.get('server', 'domain', fallback='localhost')}")
                 logging.getLogger('urllib3').setLevel(logging.DEBUG)
 
+            # One TLS context for STARTTLS and the implicit TLS listeners; None if TLS is disabled
+            tls_options = tls.from_config(config)
+
             # Start SMTP service
             if args.smtp or args.all:
-                smtp_factory = SMTPFactory()
+                smtp_factory = SMTPFactory(tls=tls_options)
                 reactor.listenTCP(25, smtp_factory)
                 logger.info("SMTP honeypot started on port 25")
+                smtps_port = config.getint('tls', 'smtps_port', fallback=465)
+                if tls_options and smtps_port:
+                    reactor.listenSSL(smtps_port, smtp_factory, tls_options)
+                    logger.info(f"SMTP over TLS started on port {smtps_port}")
 
             # Start POP3 service
             if args.pop3 or args.all:
-                pop3_factory = POP3Factory(debug=args.debug)
+                pop3_factory = POP3Factory(debug=args.debug, tls=tls_options)
                 reactor.listenTCP(110, pop3_factory)
                 logger.info("POP3 honeypot started on port 110")
+                pop3s_port = config.getint('tls', 'pop3s_port', fallback=995)
+                if tls_options and pop3s_port:
+                    reactor.listenSSL(pop3s_port, pop3_factory, tls_options)
+                    logger.info(f"POP3 over TLS started on port {pop3s_port}")
+
+            # Expire old data in the background while the honeypot runs
+            start_retention()
+
+            # Flush queued interactions once the 'during' phase has closed the ports and
+            # connections, so the last sessions, credentials and parse results are written
+            reactor.addSystemEventTrigger('after', 'shutdown', shutdown_sinks)
+            reactor.addSystemEventTrigger('after', 'shutdown', shutdown_database)
 
             logger.info("Reactor is running...")
             reactor.run()
@@ -23,6 +23,7 @@ setup(
 	'matplotlib',
 	'openai',
 	'pandas',
+	'pyarrow',
 	'prophet'
     ],
     classifiers=[
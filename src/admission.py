@@ -0,0 +1,152 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module provides admission control for the GenAIPot listeners.
+
+Each factory owns an AdmissionController that caps the sessions open at once, both
+in total and per client address, and counts what it admitted, rejected and timed out,
+so a flood of idle or slow clients cannot exhaust sockets and file descriptors.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Reasons returned by AdmissionController.admit()
+TOO_MANY_SESSIONS = 'global'
+TOO_MANY_FROM_IP = 'per_ip'
+
+# Kinds of timeouts counted by AdmissionController.timed_out()
+IDLE, SESSION = 'idle', 'session'
+
+class AdmissionController:
+    """
+    Concurrent session caps with counters and gauges.
+
+    Attributes:
+        max_sessions (int): Sessions open at once across all clients, 0 for no limit.
+        max_per_ip (int): Sessions open at once from a single address, 0 for no limit.
+        idle_timeout (int): Seconds without client data before a session is closed, 0 for none.
+        session_timeout (int): Seconds after which any session is closed, 0 for none.
+    """
+
+    def __init__(self, max_sessions=1000, max_per_ip=10, idle_timeout=300, session_timeout=1800):
+        self.max_sessions = max_sessions
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.session_timeout = session_timeout
+        self.active = 0
+        self.per_ip = {}
+        self.admitted = 0
+        self.rejected = {TOO_MANY_SESSIONS: 0, TOO_MANY_FROM_IP: 0}
+        self.timeouts = {IDLE: 0, SESSION: 0}
+        self.peak_active = 0
+
+    @classmethod
+    def from_config(cls, config, section='server', idle_timeout=300, session_timeout=1800):
+        """
+        Build a controller from a configuration section.
+
+        Args:
+            config: A ConfigParser or ConfigManager.
+            section (str): Section holding the settings.
+            idle_timeout (int): Default idle timeout of the protocol.
+            session_timeout (int): Default session timeout of the protocol.
+
+        Returns:
+            AdmissionController: The configured controller.
+        """
+        return cls(
+            max_sessions=config.getint(section, 'max_sessions', fallback=1000),
+            max_per_ip=config.getint(section, 'max_sessions_per_ip', fallback=10),
+            idle_timeout=config.getint(section, 'idle_timeout', fallback=idle_timeout),
+            session_timeout=config.getint(section, 'session_timeout', fallback=session_timeout),
+        )
+
+    def admit(self, ip):
+        """
+        Admit a new session from ip unless a cap is reached.
+
+        Args:
+            ip (str): The client address.
+
+        Returns:
+            str: None if the session was admitted and must later be release()d, otherwise
+                TOO_MANY_SESSIONS or TOO_MANY_FROM_IP.
+        """
+        if self.max_sessions and self.active >= self.max_sessions:
+            self.rejected[TOO_MANY_SESSIONS] += 1
+            return TOO_MANY_SESSIONS
+        count = self.per_ip.get(ip, 0)
+        if self.max_per_ip and count >= self.max_per_ip:
+            self.rejected[TOO_MANY_FROM_IP] += 1
+            logger.debug(f"Too many sessions from {ip}")
+            return TOO_MANY_FROM_IP
+        self.per_ip[ip] = count + 1
+        self.active += 1
+        self.admitted += 1
+        self.peak_active = max(self.peak_active, self.active)
+        return None
+
+    def release(self, ip):
+        """
+        Release a session admitted by admit().
+
+        Args:
+            ip (str): The client address passed to admit().
+        """
+        count = self.per_ip.get(ip, 0)
+        if count <= 0:
+            return
+        if count == 1:
+            del self.per_ip[ip]
+        else:
+            self.per_ip[ip] = count - 1
+        self.active -= 1
+
+    def timed_out(self, kind):
+        """
+        Count a session closed by a timeout.
+
+        Args:
+            kind (str): IDLE or SESSION.
+        """
+        self.timeouts[kind] += 1
+
+    def stats(self):
+        """
+        Return the gauges and counters.
+
+        Returns:
+            dict: active and peak_active sessions, distinct ips with open sessions, and the
+                admitted, rejected and timed-out totals.
+        """
+        return {
+            'active': self.active,
+            'peak_active': self.peak_active,
+            'ips': len(self.per_ip),
+            'admitted': self.admitted,
+            'rejected_global': self.rejected[TOO_MANY_SESSIONS],
+            'rejected_per_ip': self.rejected[TOO_MANY_FROM_IP],
+            'timed_out_idle': self.timeouts[IDLE],
+            'timed_out_session': self.timeouts[SESSION],
+        }
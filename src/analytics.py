@@ -21,6 +21,10 @@
 """
 This module provides functions for analyzing command data, detecting anomalies, 
 and generating graphs for visualization in GenAIPot.
+
+Every function accepts either a DataFrame or an iterable of DataFrame chunks, such as
+the generator returned by database.iter_interactions(), and only keeps the small
+derived columns it needs in memory.
 """
 
 from datetime import datetime, timedelta
@@ -28,19 +32,51 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from prophet import Prophet
 
+def _chunks(data):
+    """
+    Return the chunks of a DataFrame-or-iterable argument.
+
+    Args:
+        data (DataFrame or iterable): A DataFrame or an iterable of DataFrame chunks.
+
+    Returns:
+        iterable: DataFrame chunks.
+    """
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+def _command_lengths(data):
+    """
+    Reduce interactions to timestamp, command length and IP, dropping every other column.
+
+    Args:
+        data (DataFrame or iterable): Chunks with 'timestamp', 'command' and 'ip' columns.
+
+    Returns:
+        DataFrame: Columns 'ds', 'y' and 'ip'.
+    """
+    parts = [
+        pd.DataFrame({
+            'ds': pd.to_datetime(chunk['timestamp']),
+            'y': chunk['command'].str.len(),
+            'ip': chunk['ip'],
+        })
+        for chunk in _chunks(data)
+    ]
+    if not parts:
+        return pd.DataFrame(columns=['ds', 'y', 'ip'])
+    return pd.concat(parts, ignore_index=True)
+
 def perform_prediction(df):
     """
     Perform predictions on the length of commands over time using Prophet.
 
     Args:
-        df (DataFrame): DataFrame containing 'timestamp' and 'command' columns.
+        df (DataFrame or iterable): DataFrame, or DataFrame chunks, containing 'timestamp' and 'command' columns.
 
     Returns:
         None
     """
-    df['y'] = df['command'].str.len()
-    df['ds'] = pd.to_datetime(df['timestamp'])
-    df = df[['ds', 'y']]
+    df = _command_lengths(df)[['ds', 'y']]
 
     model = Prophet()
     model.fit(df)
@@ -55,18 +91,17 @@ def detect_anomalies(df):
     Detect anomalies in the command lengths and IP address connection frequencies.
 
     Args:
-        df (DataFrame): DataFrame containing 'timestamp', 'command', and 'ip' columns.
+        df (DataFrame or iterable): DataFrame, or DataFrame chunks, containing 'timestamp', 'command', and 'ip' columns.
 
     Returns:
         None
     """
     # Ensure 'timestamp', 'command', and 'ip' columns are present
-    if not all(col in df.columns for col in ['timestamp', 'command', 'ip']):
+    if isinstance(df, pd.DataFrame) and not all(col in df.columns for col in ['timestamp', 'command', 'ip']):
         raise ValueError("DataFrame must contain 'timestamp', 'command', and 'ip' columns")
 
     # Prepare the DataFrame for command length anomaly detection
-    df['y'] = df['command'].str.len()
-    df['ds'] = pd.to_datetime(df['timestamp'])
+    df = _command_lengths(df)
     df_command = df[['ds', 'y']].copy()  # Use a copy to avoid SettingWithCopyWarning
 
     model_command = Prophet()
@@ -104,19 +139,30 @@ def generate_graphs(df):
     """
     Generate and save graphs for top connected IPs and connections over the last 24 hours.
 
+    Chunks are folded into per-IP and per-hour counters as they arrive.
+
     Args:
-        df (DataFrame): DataFrame containing 'ip' and 'timestamp' columns.
+        df (DataFrame or iterable): DataFrame, or DataFrame chunks, containing 'ip' and 'timestamp' columns.
 
     Returns:
         None
     """
-    top_ips = df['ip'].value_counts().head(10)
+    cutoff = datetime.now() - timedelta(days=1)
+    ip_counts = pd.Series(dtype='int64')
+    hourly_counts = pd.Series(dtype='int64')
+    for chunk in _chunks(df):
+        ip_counts = ip_counts.add(chunk['ip'].value_counts(), fill_value=0)
+        timestamps = pd.to_datetime(chunk['timestamp'])
+        recent = timestamps[timestamps > cutoff]
+        hourly_counts = hourly_counts.add(recent.dt.floor('h').value_counts(), fill_value=0)
+
+    top_ips = ip_counts.astype('int64').sort_values(ascending=False, kind='stable').head(10)
     print("Top 10 most connected IP addresses:")
     print(top_ips)
 
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    last_24_hours = df[df['timestamp'] > datetime.now() - timedelta(days=1)]
-    connections_per_hour = last_24_hours.set_index('timestamp').resample('H').size()
+    connections_per_hour = hourly_counts.astype('int64').sort_index()
+    if not connections_per_hour.empty:
+        connections_per_hour = connections_per_hour.asfreq('h', fill_value=0)
 
     plt.figure(figsize=(10, 6))
     top_ips.plot(kind='bar')
@@ -25,10 +25,13 @@ including password hashing and credential checking.
 
 import hashlib
 import logging
+import os
 import configparser
 
+# Load the config.ini file
+config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'etc', 'config.ini'))
 config = configparser.ConfigParser()
-config.read('config.ini')
+config.read(config_file_path)
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +45,8 @@ def hash_password(password):
     Returns:
         str: The hashed password.
     """
-    return hashlib.sha256(password.encode()).hexdigest()
+    # Passwords decoded with surrogateescape hash their exact bytes
+    return hashlib.sha256(password.encode('utf-8', 'surrogateescape')).hexdigest()
 
 def check_credentials(username, password):
     """
@@ -24,52 +24,564 @@ This module handles interactions with the SQLite database for the GenAIPot proje
 It includes functions for setting up the database, logging interactions, and collecting data.
 """
 
-import sqlite3
+import os
+import logging
+import itertools
+import threading
+import configparser
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 import pandas as pd
+from db.engine import StorageEngine
+from db.export import export_interactions as _export_interactions
+from db.retention import RetentionManager
+from db.reader import iter_interactions as _iter_interactions, DEFAULT_COLUMNS
+from db.schema import migrate
+from db.shards import ShardManager
+from db.writer import InteractionWriter
 
-# Establishing the database connection and cursor
-conn = sqlite3.connect('GenAIPot.db')
-c = conn.cursor()
+logger = logging.getLogger(__name__)
+
+# Load the config.ini file
+config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'etc', 'config.ini'))
+config = configparser.ConfigParser()
+config.read(config_file_path)
+
+INSERT_SESSION = 'INSERT INTO sessions (id, protocol, ip, port, start_ts) VALUES (?, ?, ?, ?, ?)'
+CLOSE_SESSION = 'UPDATE sessions SET end_ts = ?, command_count = ?, bytes_in = ?, bytes_out = ? WHERE id = ?'
+# A message seen again only bumps its counter and last timestamp
+UPSERT_MESSAGE = '''
+    INSERT INTO messages (digest, path, size, session_id, ip, first_ts, last_ts, mail_from, rcpt_to)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (digest) DO UPDATE SET seen_count = seen_count + 1, last_ts = excluded.last_ts
+'''
+UPDATE_PARSED = '''
+    UPDATE messages SET status = ?, parsed_ts = ?, subject = ?, from_header = ?, to_header = ?,
+        message_id = ?, date_header = ?, part_count = ?, error = ?
+    WHERE digest = ?
+'''
+INSERT_ATTACHMENT = '''
+    INSERT OR IGNORE INTO attachments (message_digest, part, digest, filename, content_type, size)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+# Attempts counted in memory are added to the pair's row; credentials that are not valid UTF-8 are BLOBs
+UPSERT_CREDENTIAL = '''
+    INSERT INTO credentials (username, password, mechanism, last_ip, count, first_ts, last_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (username, password) DO UPDATE SET count = count + excluded.count,
+        first_ts = MIN(first_ts, excluded.first_ts), last_ts = MAX(last_ts, excluded.last_ts),
+        mechanism = excluded.mechanism, last_ip = excluded.last_ip
+'''
+
+# Pseudo-command logged for the banner sent when a client connects
+WELCOME = 'WELCOME'
+
+# Kinds of records queued for the writer thread
+OPEN, INTERACTION, CLOSE, MESSAGE, PARSED, CREDENTIAL = 'open', 'interaction', 'close', 'message', 'parsed', 'credential'
+
+# Storage engine, shard manager and write-behind logger, all created on first use
+_engine = None
+_shards = None
+_writer = None
+_retention = None
+# Set by shutdown_database() so late events cannot start an orphan writer thread
+_closed = False
+_session_ids = None
+_session_ids_lock = threading.Lock()
+
+class Session:
+    """
+    A client connection to one of the honeypot listeners.
+
+    Attributes:
+        id (int): Session identifier, allocated in memory so opening a session never waits on the disk.
+        protocol (str): 'smtp' or 'pop3'.
+        ip (str): Peer IP address.
+        port (int): Peer source port.
+        start_ts (str): ISO timestamp of the connection.
+        seq (int): Sequence number of the last logged interaction.
+        command_count (int): Number of client commands logged.
+        bytes_in (int): Bytes of client commands logged.
+        bytes_out (int): Bytes of responses logged.
+    """
+
+    __slots__ = ('id', 'protocol', 'ip', 'port', 'start_ts', 'seq', 'command_count', 'bytes_in',
+                 'bytes_out', 'closed')
+
+    def __init__(self, session_id, protocol, ip, port, start_ts):
+        self.id = session_id
+        self.protocol = protocol
+        self.ip = ip
+        self.port = port
+        self.start_ts = start_ts
+        self.seq = 0
+        self.command_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+
+    def record(self, command, response):
+        """
+        Count an interaction of this session.
+
+        The banner logged as WELCOME is not a client command, so only its response is counted.
+
+        Args:
+            command (str): The command issued by the client.
+            response (str): The response provided by the honeypot.
+
+        Returns:
+            int: The sequence number of the interaction within the session.
+        """
+        self.seq += 1
+        if command != WELCOME:
+            self.command_count += 1
+            self.bytes_in += _byte_length(command)
+        self.bytes_out += _byte_length(response)
+        return self.seq
+
+def _byte_length(value):
+    if not value:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    return len(value.encode('utf-8', 'surrogateescape'))
+
+def get_engine():
+    """
+    Return the storage engine, building it from the [database] section of config.ini on first use.
+
+    Returns:
+        StorageEngine: The engine handing out per-thread connections.
+    """
+    global _engine
+    if _engine is None:
+        _engine = StorageEngine.from_config(config)
+    return _engine
+
+def get_shards():
+    """
+    Return the shard manager that stores interactions next to the catalog database.
+
+    Returns:
+        ShardManager: The manager configured from the [database] section of config.ini.
+    """
+    global _shards
+    if _shards is None:
+        engine = get_engine()
+        options = {
+            'synchronous': engine.synchronous,
+            'cache_size': engine.cache_size,
+            'mmap_size': engine.mmap_size,
+            'temp_store': engine.temp_store,
+            'busy_timeout': engine.busy_timeout,
+            'auto_vacuum': engine.auto_vacuum,
+        }
+        _shards = ShardManager.from_config(config, engine.path, engine_options=options)
+    return _shards
+
+def open_storage(path=None, **pragmas):
+    """
+    Replace the storage engine, e.g. to point the database layer at another file.
+
+    Args:
+        path (str): Database file; defaults to the configured path.
+        **pragmas: Overrides for StorageEngine settings such as synchronous or cache_size.
+
+    Returns:
+        StorageEngine: The new engine.
+    """
+    global _engine, _closed
+    shutdown_database()
+    _closed = False
+    if pragmas:
+        _engine = StorageEngine(path or config.get('database', 'path', fallback='GenAIPot.db'), **pragmas)
+    else:
+        _engine = StorageEngine.from_config(config, path=path)
+    return _engine
 
 def setup_database():
     """
-    Set up the database by creating the 'connections' table if it does not already exist.
+    Set up the database, creating or migrating the catalog and repairing the shard manifest.
+
+    Each connection to a listener is a row in 'sessions' in the catalog database; every
+    command and response is a row in the 'interactions' table of a time-based shard file,
+    linked to its session. Databases holding the original flat 'connections' table, or
+    interactions inside the catalog, are converted in place.
+    """
+    conn = get_engine().connection()
+    migrate(conn, get_shards())
+    get_shards().upgrade(conn)
+    get_shards().reconcile(conn)
 
-    The 'connections' table logs interactions with the honeypot, including IP address, timestamp,
-    command issued, and the response provided.
+def next_session_id():
     """
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS connections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT,
-            timestamp TEXT,
-            command TEXT,
-            response TEXT
+    Allocate a session id above every id already stored in the catalog.
+
+    Returns:
+        int: A new session id.
+    """
+    global _session_ids
+    with _session_ids_lock:
+        if _session_ids is None:
+            conn = get_engine().connection()
+            migrate(conn, get_shards())
+            last = conn.execute('SELECT MAX(id) FROM sessions').fetchone()[0]
+            _session_ids = itertools.count((last or 0) + 1)
+        return next(_session_ids)
+
+def _flush_records(batch):
+    """
+    Write a batch of queued records.
+
+    Runs on the writer thread, which uses its own connection from the engine. Interactions
+    go to the shard of their own timestamp, so a batch straddling midnight is split rather
+    than dropped; they are committed first, then the catalog records in one transaction.
+    Session opens are written before closes, so a session can open and close in the same
+    batch, and captured messages before the parse results that update them.
+
+    A record that cannot be written does not take the rest of the batch with it: if the
+    catalog transaction fails, its records are retried one by one and only the failing
+    ones are dropped.
+
+    Args:
+        batch (list): Tuples whose first element is OPEN, INTERACTION, CLOSE, MESSAGE, PARSED or CREDENTIAL.
+
+    Returns:
+        int: Number of records dropped.
+    """
+    interactions = []
+    # Catalog records by kind, in the order they are applied
+    catalog = OrderedDict((kind, []) for kind in (OPEN, CLOSE, MESSAGE, PARSED, CREDENTIAL))
+    for record in batch:
+        kind = record[0]
+        if kind == INTERACTION:
+            interactions.append(record[1:])
+        elif kind in catalog:
+            catalog[kind].append(record[1:])
+    conn = get_engine().connection()
+    dropped = 0
+    # Interactions commit on their own, so a failure below cannot roll back the manifest
+    # rows of shards that already hold them
+    if interactions:
+        try:
+            dropped += get_shards().write(conn, interactions)
+        except Exception as e:
+            logger.error(f"Dropped {len(interactions)} interactions: {e}")
+            dropped += len(interactions)
+    try:
+        with conn:
+            _write_catalog(conn, catalog)
+    except Exception as e:
+        logger.warning(f"Catalog batch failed ({e}); retrying record by record")
+        for kind, rows in catalog.items():
+            for row in rows:
+                try:
+                    with conn:
+                        _write_catalog(conn, {kind: [row]})
+                except Exception as e:
+                    logger.error(f"Dropped {kind} record {row!r}: {e}")
+                    dropped += 1
+    return dropped
+
+def _write_catalog(conn, records):
+    for kind, rows in records.items():
+        if not rows:
+            continue
+        if kind == OPEN:
+            conn.executemany(INSERT_SESSION, rows)
+        elif kind == CLOSE:
+            conn.executemany(CLOSE_SESSION, rows)
+        elif kind == MESSAGE:
+            conn.executemany(UPSERT_MESSAGE, rows)
+        elif kind == PARSED:
+            for *row, attachments in rows:
+                conn.execute(UPDATE_PARSED, row)
+                conn.executemany(INSERT_ATTACHMENT, [(row[-1],) + tuple(a) for a in attachments])
+        elif kind == CREDENTIAL:
+            conn.executemany(UPSERT_CREDENTIAL, rows)
+
+def get_writer():
+    """
+    Return the write-behind interaction logger, starting it on first use.
+
+    Batch size, flush interval, queue size and overflow policy are read from
+    the [database] section of config.ini.
+
+    Returns:
+        InteractionWriter: The running writer.
+
+    Raises:
+        RuntimeError: If the database has been shut down; open_storage() reopens it.
+    """
+    global _writer
+    if _closed:
+        raise RuntimeError("The database has been shut down")
+    if _writer is None:
+        _writer = InteractionWriter(
+            _flush_records,
+            batch_size=config.getint('database', 'batch_size', fallback=500),
+            flush_interval=config.getfloat('database', 'flush_interval', fallback=0.2),
+            max_queue=config.getint('database', 'queue_size', fallback=10000),
+            overflow=config.get('database', 'overflow', fallback='drop_newest'),
         )
-    ''')
-    conn.commit()
+        _writer.start()
+    return _writer
+
+def get_retention():
+    """
+    Return the retention manager configured from the [retention] section of config.ini.
+
+    Returns:
+        RetentionManager: The manager expiring old interactions, sessions and rollups.
+    """
+    global _retention
+    if _retention is None:
+        _retention = RetentionManager.from_config(config, get_engine(), get_shards())
+    return _retention
+
+def start_retention():
+    """
+    Apply the retention policies now and then every 'interval' seconds in the background.
+
+    Returns:
+        twisted.internet.defer.Deferred: Fires when the loop stops, or None if both
+            retention periods are 0 and nothing ever expires.
+    """
+    retention = get_retention()
+    if not retention.raw_days and not retention.rollup_days:
+        return None
+    return retention.start(config.getfloat('retention', 'interval', fallback=3600))
+
+def shutdown_database():
+    """
+    Flush every pending interaction, stop the writer thread and close all connections.
+
+    Registered as a reactor shutdown trigger so nothing queued is lost on exit. Events
+    logged afterwards are refused rather than starting a new writer.
+    """
+    global _writer, _shards, _retention, _session_ids, _closed
+    _closed = True
+    if _retention is not None:
+        _retention.stop()
+        _retention = None
+    if _writer is not None:
+        _writer.stop()
+        stats = _writer.stats()
+        logger.info(f"Interaction writer stopped: {stats['flushed']} written, {stats['dropped']} dropped")
+        _writer = None
+    if _shards is not None:
+        _shards.close()
+        _shards = None
+    if _engine is not None:
+        _engine.close()
+    _session_ids = None
 
-def log_interaction(ip, command, response):
+def open_session(protocol, ip, port=None):
+    """
+    Record a new client connection.
+
+    Args:
+        protocol (str): 'smtp' or 'pop3'.
+        ip (str): Peer IP address.
+        port (int): Peer source port.
+
+    Returns:
+        Session: The session to pass to log_interaction() and close_session().
+    """
+    session = Session(next_session_id(), protocol, ip, port, datetime.now().isoformat())
+    get_writer().put((OPEN, session.id, protocol, ip, port, session.start_ts))
+    return session
+
+def close_session(session):
+    """
+    Record the end of a client connection with its final counters.
+
+    Args:
+        session (Session): The session returned by open_session(); closing twice is a no-op.
+    """
+    if session is None or session.closed:
+        return
+    session.closed = True
+    get_writer().put((CLOSE, datetime.now().isoformat(), session.command_count, session.bytes_in,
+                      session.bytes_out, session.id))
+
+def log_interaction(ip, command, response, session=None):
     """
     Log an interaction with the honeypot to the database.
 
+    The row is queued for the writer thread; this never touches the disk.
+
     Args:
         ip (str): The IP address of the entity interacting with the honeypot.
         command (str): The command issued by the entity.
         response (str): The response provided by the honeypot.
+        session (Session): The session the interaction belongs to, if known.
+    """
+    ts = datetime.now().isoformat()
+    if session is None:
+        get_writer().put((INTERACTION, None, 0, None, ip, ts, command, response))
+        return
+    seq = session.record(command, response)
+    get_writer().put((INTERACTION, session.id, seq, session.protocol, ip, ts, command, response))
+
+def log_message(digest, path, size, session=None, ip=None, mail_from=None, recipients=()):
+    """
+    Record a message received over SMTP and stored under its digest.
+
+    The row is queued for the writer thread with status 'pending' until log_message_parse()
+    records what the MIME parser found.
+
+    Args:
+        digest (str): SHA-256 of the message body.
+        path (str): File holding the body.
+        size (int): Body size in bytes.
+        session (Session): The SMTP session the message was received in.
+        ip (str): Peer IP address.
+        mail_from (str): The MAIL FROM address.
+        recipients (list): The RCPT TO addresses.
+    """
+    ts = datetime.now().isoformat()
+    session_id = session.id if session is not None else None
+    get_writer().put((MESSAGE, digest, path, size, session_id, ip, ts, ts, mail_from, ','.join(recipients)))
+
+def log_message_parse(digest, result, error=None):
+    """
+    Record the outcome of parsing a captured message.
+
+    Args:
+        digest (str): SHA-256 of the message body.
+        result (dict): The dict returned by parse_message(), or None if parsing failed.
+        error (str): Why parsing failed.
+    """
+    ts = datetime.now().isoformat()
+    if result is None:
+        get_writer().put((PARSED, 'failed', ts, None, None, None, None, None, None, error, digest, []))
+        return
+    get_writer().put((PARSED, 'parsed', ts, result['subject'], result['from'], result['to'],
+                      result['message_id'], result['date'], result['parts'], None, digest,
+                      result['attachments']))
+
+def log_credentials(rows):
+    """
+    Record authentication attempts, usually aggregated by a CredentialStore.
+
+    Each row is queued for the writer thread and added to the counters of its
+    (username, password) pair.
+
+    Args:
+        rows (list): (username, password, mechanism, ip, count, first_ts, last_ts) tuples.
+    """
+    get_writer().put_many((CREDENTIAL,) + tuple(row) for row in rows)
+
+def pending_messages(limit=100):
+    """
+    Return the oldest captured messages that have not been parsed yet.
+
+    Args:
+        limit (int): Maximum number of messages.
+
+    Returns:
+        list: (digest, path) tuples.
+    """
+    conn = get_engine().connection()
+    return conn.execute("SELECT digest, path FROM messages WHERE status = 'pending' ORDER BY first_ts LIMIT ?",
+                        (limit,)).fetchall()
+
+def writer_stats():
+    """
+    Return the write-behind logger counters.
+
+    Returns:
+        dict: Queue depth, drops and flush latencies, or an empty dict if the writer is not running.
+    """
+    return _writer.stats() if _writer is not None else {}
+
+@contextmanager
+def attached_shards(since=None, until=None):
+    """
+    Open the shards overlapping a time window for ad-hoc SQL.
+
+    Inside the block the calling thread's catalog connection sees the window's rows through
+    TEMP views 'interactions' and 'connections', next to the catalog's own 'sessions' table.
+
+    Args:
+        since (str): Inclusive lower bound as an ISO timestamp, or None.
+        until (str): Inclusive upper bound as an ISO timestamp, or None.
+
+    Yields:
+        sqlite3.Connection: The catalog connection with the shards attached.
+
+    Raises:
+        ValueError: If more shards than SQLite can attach at once overlap a window without a start;
+            iter_interactions() streams any window.
+    """
+    conn = get_engine().connection()
+    shards = get_shards()
+    with shards.attached(conn, shards.shards_for(conn, since, until), since=since, until=until):
+        yield conn
+
+def iter_interactions(since=None, until=None, ip=None, protocol=None, columns=None, chunk_size=50000):
     """
-    c.execute('INSERT INTO connections (ip, timestamp, command, response) VALUES (?, ?, ?, ?)',
-              (ip, datetime.now().isoformat(), command, response))
-    conn.commit()
+    Stream logged interactions as DataFrame chunks instead of loading the whole history.
+
+    Rows are read shard by shard with keyset pagination on 'id', so memory use is bounded
+    by chunk_size. Filters are applied in SQL. Each shard is read from one snapshot, so
+    rows logged while it is being read never show up in some of its chunks only.
 
-def collect_honeypot_data():
+    Args:
+        since (str): Inclusive lower bound as an ISO timestamp, or None.
+        until (str): Inclusive upper bound as an ISO timestamp, or None.
+        ip (str): Only rows from this peer IP address.
+        protocol (str): Only rows of this protocol, e.g. 'smtp' or 'pop3'.
+        columns (iterable): Columns to return; see db.reader.COLUMNS.
+        chunk_size (int): Maximum number of rows per chunk.
+
+    Returns:
+        generator: Yields pandas.DataFrame chunks, oldest rows first.
     """
-    Collect all data from the 'connections' table.
+    return _iter_interactions(get_engine().connection(), get_shards(), since=since, until=until, ip=ip,
+                              protocol=protocol, columns=columns, chunk_size=chunk_size)
+
+def collect_honeypot_data(since=None, until=None, ip=None, protocol=None, columns=None):
+    """
+    Collect the logged interactions matching the filters into one DataFrame.
+
+    Prefer iter_interactions() for large histories; this concatenates every chunk.
+
+    Args:
+        since (str): Inclusive lower bound as an ISO timestamp, or None.
+        until (str): Inclusive upper bound as an ISO timestamp, or None.
+        ip (str): Only rows from this peer IP address.
+        protocol (str): Only rows of this protocol, e.g. 'smtp' or 'pop3'.
+        columns (iterable): Columns to return; defaults to id, ip, timestamp, command and response.
 
     Returns:
-        pandas.DataFrame: A DataFrame containing all logged interactions with the honeypot.
+        pandas.DataFrame: The matching interactions, oldest first.
+    """
+    chunks = list(iter_interactions(since=since, until=until, ip=ip, protocol=protocol, columns=columns))
+    if not chunks:
+        return pd.DataFrame(columns=list(columns or DEFAULT_COLUMNS))
+    return pd.concat(chunks, ignore_index=True)
+
+def export_interactions(out_dir=None, fmt=None, batch_size=None, name='default'):
     """
-    return pd.read_sql_query("SELECT * FROM connections", conn)
+    Export the interactions logged since the previous export to columnar files.
+
+    Defaults come from the [export] section of the configuration.
 
-# Ensure to add a final newline at the end of the file
+    Args:
+        out_dir (str): Root directory of the export.
+        fmt (str): 'parquet' or 'arrow'.
+        batch_size (int): Maximum number of rows held in memory at once.
+        name (str): Export name whose watermark is used and advanced.
+
+    Returns:
+        dict: Number of rows and files written, and the new watermark.
+    """
+    out_dir = out_dir or config.get('export', 'directory', fallback='export')
+    fmt = fmt or config.get('export', 'format', fallback='parquet')
+    batch_size = batch_size or config.getint('export', 'batch_size', fallback=100000)
+    return _export_interactions(get_engine().connection(), get_shards(), out_dir, fmt=fmt,
+                                batch_size=batch_size, name=name)
@@ -0,0 +1,193 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module provides the SQLite storage engine used by the GenAIPot database layer.
+
+The engine runs the database in WAL mode with tunable pragmas and hands out one
+connection per thread, so analytics readers never block the honeypot writer.
+"""
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+TEMP_STORE_MODES = ('DEFAULT', 'FILE', 'MEMORY')
+AUTO_VACUUM_MODES = ('NONE', 'FULL', 'INCREMENTAL')
+
+@contextmanager
+def snapshot(conn):
+    """
+    Run several reads on a connection against one consistent snapshot.
+
+    Args:
+        conn (sqlite3.Connection): A connection outside a transaction; databases cannot be
+            attached or detached inside the block.
+
+    Yields:
+        sqlite3.Connection: The same connection inside a read transaction.
+    """
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.execute('COMMIT')
+
+class StorageEngine:
+    """
+    Open and tune per-thread connections to a single SQLite database file.
+
+    Attributes:
+        path (str): Path of the database file.
+        synchronous (str): Value of PRAGMA synchronous.
+        cache_size (int): Value of PRAGMA cache_size (negative values are KiB).
+        mmap_size (int): Value of PRAGMA mmap_size in bytes.
+        temp_store (str): Value of PRAGMA temp_store.
+        busy_timeout (int): Milliseconds to wait for a lock before failing.
+        auto_vacuum (str): Value of PRAGMA auto_vacuum for newly created files.
+    """
+
+    def __init__(self, path, synchronous='NORMAL', cache_size=-65536, mmap_size=268435456,
+                 temp_store='MEMORY', busy_timeout=5000, auto_vacuum='INCREMENTAL'):
+        """
+        Initialize the engine. Connections are opened lazily by connection().
+
+        Args:
+            path (str): Path of the database file.
+            synchronous (str): One of SYNCHRONOUS_MODES.
+            cache_size (int): Page cache size; negative values are KiB.
+            mmap_size (int): Bytes of the file to memory-map, 0 to disable.
+            temp_store (str): One of TEMP_STORE_MODES.
+            busy_timeout (int): Milliseconds to wait for a lock before failing.
+            auto_vacuum (str): One of AUTO_VACUUM_MODES; it only takes effect on files without tables.
+
+        Raises:
+            ValueError: If a pragma value is not valid.
+        """
+        synchronous = str(synchronous).upper()
+        temp_store = str(temp_store).upper()
+        auto_vacuum = str(auto_vacuum).upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode '{synchronous}', expected one of {SYNCHRONOUS_MODES}")
+        if temp_store not in TEMP_STORE_MODES:
+            raise ValueError(f"Invalid temp_store mode '{temp_store}', expected one of {TEMP_STORE_MODES}")
+        if auto_vacuum not in AUTO_VACUUM_MODES:
+            raise ValueError(f"Invalid auto_vacuum mode '{auto_vacuum}', expected one of {AUTO_VACUUM_MODES}")
+        self.path = path
+        self.synchronous = synchronous
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.temp_store = temp_store
+        self.busy_timeout = int(busy_timeout)
+        self.auto_vacuum = auto_vacuum
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, section='database', path=None):
+        """
+        Build an engine from a ConfigParser section.
+
+        Args:
+            config (ConfigParser): The loaded configuration.
+            section (str): Section holding the storage settings.
+            path (str): Overrides the configured database path.
+
+        Returns:
+            StorageEngine: The configured engine.
+        """
+        return cls(
+            path or config.get(section, 'path', fallback='GenAIPot.db'),
+            synchronous=config.get(section, 'synchronous', fallback='NORMAL'),
+            cache_size=config.getint(section, 'cache_size', fallback=-65536),
+            mmap_size=config.getint(section, 'mmap_size', fallback=268435456),
+            temp_store=config.get(section, 'temp_store', fallback='MEMORY'),
+            busy_timeout=config.getint(section, 'busy_timeout', fallback=5000),
+            auto_vacuum=config.get(section, 'auto_vacuum', fallback='INCREMENTAL'),
+        )
+
+    def connection(self):
+        """
+        Return the connection owned by the calling thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: A tuned connection in WAL mode.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def snapshot(self):
+        """
+        Run several reads against one consistent snapshot of the database.
+
+        In WAL mode the snapshot is taken at the first read and is not affected by
+        concurrent writers until the block exits.
+
+        Returns:
+            contextmanager: Yields the calling thread's connection inside a read transaction.
+        """
+        return snapshot(self.connection())
+
+    def close_thread(self):
+        """Close the connection owned by the calling thread, if any."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+
+    def close(self):
+        """Close every connection handed out by this engine."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error closing connection to {self.path}: {e}")
+        self._local = threading.local()
+
+    def _connect(self):
+        # Connections are only ever used by the thread that opened them; the flag
+        # just lets close() clean them up from the shutdown thread.
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        # Must come first: SQLite ignores it once the file holds a table
+        conn.execute(f'PRAGMA auto_vacuum={self.auto_vacuum}')
+        journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            logger.warning(f"Could not enable WAL mode on {self.path}, using '{journal_mode}'")
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size={self.cache_size}')
+        conn.execute(f'PRAGMA mmap_size={self.mmap_size}')
+        conn.execute(f'PRAGMA temp_store={self.temp_store}')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout}')
+        return conn
@@ -0,0 +1,161 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module exports logged interactions to columnar files for offline analysis.
+
+Each run writes only the rows added since the last exported id, partitioned by
+day into Parquet or Arrow IPC files, and then advances the stored watermark.
+pyarrow is imported only by this module, and only once an export runs.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+EXPORT_COLUMNS = ('i.id', 'i.session_id', 'i.seq', 'i.protocol', 'i.ip', 'i.ts', 'i.command', 'r.text')
+
+# Low-cardinality columns stored as dictionaries
+DICTIONARY_COLUMNS = ('protocol', 'ip', 'command')
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Exporting requires pyarrow; install it with 'pip install pyarrow'") from e
+    return pyarrow
+
+def get_watermark(conn, name='default'):
+    """
+    Return the last exported interaction id.
+
+    Args:
+        conn (sqlite3.Connection): A catalog connection.
+        name (str): Export name, so several destinations can track their own progress.
+
+    Returns:
+        int: The highest exported id, 0 if nothing was exported yet.
+    """
+    row = conn.execute('SELECT watermark FROM export_state WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+def _set_watermark(conn, name, watermark):
+    with conn:
+        conn.execute('''
+            INSERT INTO export_state (name, watermark, updated_ts) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET watermark = excluded.watermark, updated_ts = excluded.updated_ts
+        ''', (name, watermark, datetime.now().isoformat()))
+
+def _text(value):
+    # Commands that were not valid UTF-8 are stored as bytes; Arrow strings must be UTF-8
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'backslashreplace')
+    return value
+
+def _to_table(pa, rows):
+    columns = list(zip(*rows))
+    arrays = OrderedDict()
+    arrays['id'] = pa.array(columns[0], type=pa.int64())
+    arrays['session_id'] = pa.array(columns[1], type=pa.int64())
+    arrays['seq'] = pa.array(columns[2], type=pa.int32())
+    arrays['protocol'] = pa.array(columns[3], type=pa.string())
+    arrays['ip'] = pa.array(columns[4], type=pa.string())
+    timestamps = pa.array(columns[5], type=pa.string())
+    try:
+        arrays['ts'] = timestamps.cast(pa.timestamp('us'))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        arrays['ts'] = timestamps
+    arrays['command'] = pa.array([_text(v) for v in columns[6]], type=pa.string())
+    arrays['response'] = pa.array([_text(v) for v in columns[7]], type=pa.string())
+    for column in DICTIONARY_COLUMNS:
+        arrays[column] = arrays[column].dictionary_encode()
+    return pa.Table.from_arrays(list(arrays.values()), names=list(arrays.keys()))
+
+def _write(pa, table, path, fmt):
+    tmp_path = path + '.tmp'
+    if fmt == 'parquet':
+        pa.parquet.write_table(table, tmp_path, compression='zstd')
+    else:
+        with pa.ipc.new_file(tmp_path, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def export_interactions(conn, shards, out_dir, fmt='parquet', batch_size=100000, name='default'):
+    """
+    Export the interactions added since the last run into day-partitioned columnar files.
+
+    Files are named after the id range they hold, under out_dir/date=YYYY-MM-DD/. The
+    watermark is advanced after every batch, so an interrupted export resumes where it
+    stopped and rewrites at most the batch in flight.
+
+    Args:
+        conn (sqlite3.Connection): The calling thread's catalog connection.
+        shards (ShardManager): Locates the shards holding new rows.
+        out_dir (str): Root directory of the export.
+        fmt (str): 'parquet' or 'arrow'.
+        batch_size (int): Maximum number of rows held in memory at once.
+        name (str): Export name whose watermark is used and advanced.
+
+    Returns:
+        dict: Number of rows and files written, and the new watermark.
+
+    Raises:
+        ValueError: If the format is not supported.
+        RuntimeError: If pyarrow is not installed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid export format '{fmt}', expected one of {tuple(FORMATS)}")
+    pa = _require_pyarrow()
+    watermark = get_watermark(conn, name)
+    stats = {'rows': 0, 'files': 0, 'watermark': watermark}
+    query_columns = ', '.join(EXPORT_COLUMNS)
+
+    for shard in shards.shards_after(conn, watermark):
+        with shards.attached(conn, [shard], views=False) as (alias,):
+            query = (f'SELECT {query_columns} FROM {alias}.interactions AS i '
+                     'LEFT JOIN main.responses AS r ON r.id = i.response_id WHERE i.id > ? ORDER BY i.id LIMIT ?')
+            while True:
+                rows = conn.execute(query, (watermark, batch_size)).fetchall()
+                if not rows:
+                    break
+                partitions = OrderedDict()
+                for row in rows:
+                    partitions.setdefault(row[5][:10], []).append(row)
+                for day, day_rows in partitions.items():
+                    directory = os.path.join(out_dir, f'date={day}')
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f'interactions-{day_rows[0][0]}-{day_rows[-1][0]}{FORMATS[fmt]}')
+                    _write(pa, _to_table(pa, day_rows), path, fmt)
+                    stats['files'] += 1
+                watermark = rows[-1][0]
+                _set_watermark(conn, name, watermark)
+                stats['rows'] += len(rows)
+                stats['watermark'] = watermark
+                if len(rows) < batch_size:
+                    break
+    logger.info(f"Exported {stats['rows']} interactions in {stats['files']} files up to id {stats['watermark']}")
+    return stats
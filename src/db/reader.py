@@ -0,0 +1,119 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module reads logged interactions back in bounded-memory chunks.
+
+Rows are fetched shard by shard with keyset pagination on 'id', so memory use
+depends on the chunk size rather than on the size of the history. Each shard is
+read inside one read transaction, so its pages come from a single snapshot even
+while the writer thread appends to it. Interned response texts are joined back
+in from the catalog only when requested.
+"""
+
+import sys
+
+import pandas as pd
+
+from db.engine import snapshot
+
+# Column name exposed to callers -> SQL expression over a shard's interactions table 'i'
+COLUMNS = {
+    'id': 'i.id',
+    'session_id': 'i.session_id',
+    'seq': 'i.seq',
+    'protocol': 'i.protocol',
+    'ip': 'i.ip',
+    'timestamp': 'i.ts AS timestamp',
+    'command': 'i.command',
+    'response': 'r.text AS response',
+}
+
+RESPONSE_JOIN = ' LEFT JOIN main.responses AS r ON r.id = i.response_id'
+
+DEFAULT_COLUMNS = ('id', 'ip', 'timestamp', 'command', 'response')
+
+def iter_interactions(conn, shards, since=None, until=None, ip=None, protocol=None, columns=None,
+                      chunk_size=50000):
+    """
+    Yield logged interactions matching the filters as DataFrame chunks, oldest first.
+
+    Args:
+        conn (sqlite3.Connection): The calling thread's catalog connection.
+        shards (ShardManager): Locates the shards overlapping the window.
+        since (str): Inclusive lower bound as an ISO timestamp, or None.
+        until (str): Inclusive upper bound as an ISO timestamp, or None.
+        ip (str): Only rows from this peer IP address.
+        protocol (str): Only rows of this protocol, e.g. 'smtp' or 'pop3'.
+        columns (iterable): Columns to return, a subset of COLUMNS; defaults to DEFAULT_COLUMNS.
+        chunk_size (int): Maximum number of rows per chunk.
+
+    Yields:
+        pandas.DataFrame: Up to chunk_size rows with the requested columns.
+
+    Raises:
+        ValueError: If an unknown column is requested.
+    """
+    columns = list(columns or DEFAULT_COLUMNS)
+    unknown = [column for column in columns if column not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}, expected a subset of {list(COLUMNS)}")
+    # 'id' drives the pagination, so it is always fetched and dropped afterwards if unwanted
+    selected = columns if 'id' in columns else ['id'] + columns
+    projection = ', '.join(COLUMNS[column] for column in selected)
+    id_index = selected.index('id')
+
+    join = RESPONSE_JOIN if 'response' in columns else ''
+
+    conditions, params = ['i.id > ?'], []
+    if since:
+        conditions.append('i.ts >= ?')
+        params.append(since)
+    if until:
+        conditions.append('i.ts <= ?')
+        params.append(until)
+    if ip:
+        conditions.append('i.ip = ?')
+        params.append(ip)
+    if protocol:
+        conditions.append('i.protocol = ?')
+        params.append(protocol)
+    where = ' AND '.join(conditions)
+
+    for shard in shards.shards_for(conn, since, until):
+        with shards.attached(conn, [shard], views=False) as (alias,), snapshot(conn):
+            query = f'SELECT {projection} FROM {alias}.interactions AS i{join} WHERE {where} ORDER BY i.id LIMIT ?'
+            last_id = _first_id(conn, alias, since) - 1
+            while True:
+                rows = conn.execute(query, [last_id] + params + [chunk_size]).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][id_index]
+                chunk = pd.DataFrame.from_records(rows, columns=selected)
+                yield chunk[columns] if selected is not columns else chunk
+                if len(rows) < chunk_size:
+                    break
+
+def _first_id(conn, alias, since):
+    # Skip straight to the window instead of paging through the older part of the shard
+    if not since:
+        return 0
+    first = conn.execute(f'SELECT MIN(id) FROM {alias}.interactions WHERE ts >= ?', (since,)).fetchone()[0]
+    return first if first is not None else sys.maxsize
@@ -0,0 +1,104 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module interns response texts in the catalog's 'responses' dictionary table.
+
+The honeypot answers with a handful of distinct strings, so interaction rows store
+a small integer reference instead of the text. Recently used texts are kept in an
+in-process LRU cache so interning a known response never touches the database.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+def response_hash(text):
+    """
+    Return the key a response text is stored under.
+
+    Args:
+        text (str): The response text.
+
+    Returns:
+        bytes: A 16-byte BLAKE2b digest of the UTF-8 text.
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+class ResponseInterner:
+    """
+    Map response texts to ids in the 'responses' table, caching recent ones.
+
+    Not thread-safe; it is owned by the shard manager, which only the writer thread uses.
+
+    Attributes:
+        capacity (int): Maximum number of texts kept in the cache.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that went to the database.
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        Initialize an empty cache.
+
+        Args:
+            capacity (int): Maximum number of texts kept in the cache.
+        """
+        self.capacity = int(capacity)
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+
+    def intern(self, conn, text):
+        """
+        Return the id of a response text, adding it to the dictionary if it is new.
+
+        The caller must commit the new row before anything outside the catalog refers to
+        the id, or call clear() if it rolls back: SQLite hands a rolled back id out again.
+
+        Args:
+            conn (sqlite3.Connection): A catalog connection inside the caller's transaction.
+            text (str): The response text, or None.
+
+        Returns:
+            int: The id in the 'responses' table, or None for a None text.
+        """
+        if text is None:
+            return None
+        response_id = self._ids.get(text)
+        if response_id is not None:
+            self.hits += 1
+            self._ids.move_to_end(text)
+            return response_id
+        self.misses += 1
+        digest = response_hash(text)
+        cursor = conn.execute('INSERT OR IGNORE INTO responses (hash, text) VALUES (?, ?)', (digest, text))
+        if cursor.rowcount:
+            response_id = cursor.lastrowid
+        else:
+            response_id = conn.execute('SELECT id FROM responses WHERE hash = ?', (digest,)).fetchone()[0]
+        self._ids[text] = response_id
+        if len(self._ids) > self.capacity:
+            self._ids.popitem(last=False)
+        return response_id
+
+    def clear(self):
+        """Forget every cached id, e.g. after the transaction that added them was rolled back."""
+        self._ids.clear()
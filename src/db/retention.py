@@ -0,0 +1,226 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module enforces how long logged data is kept and returns the freed space.
+
+Raw interactions older than the raw retention are folded into hourly per-IP,
+per-command rollups and their shard files are dropped whole. Sessions and rollups
+past their own retention are deleted in small batches, and the catalog is shrunk
+with PRAGMA incremental_vacuum, so the listeners never wait on a long lock.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Hourly counts per peer, protocol and command verb of one shard
+ROLLUP_QUERY = '''
+    SELECT substr(ts, 1, 13) AS hour, ip, COALESCE(protocol, '') AS protocol,
+        UPPER(substr(CASE WHEN instr(command, ' ') > 0 THEN substr(command, 1, instr(command, ' ') - 1)
+                          ELSE COALESCE(command, '') END, 1, 16)) AS verb,
+        COUNT(*)
+    FROM {alias}.interactions
+    GROUP BY 1, 2, 3, 4
+'''
+
+UPSERT_ROLLUP = '''
+    INSERT INTO rollups (hour, ip, protocol, verb, count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (hour, ip, protocol, verb) DO UPDATE SET count = count + excluded.count
+'''
+
+# auto_vacuum value reported by SQLite for INCREMENTAL
+INCREMENTAL = 2
+
+class RetentionManager:
+    """
+    Apply the retention policies to the catalog and its shards.
+
+    run() does the work on the calling thread; start() repeats it on the reactor's
+    thread pool so the honeypot keeps serving while data is expired.
+
+    Attributes:
+        raw_days (int): Days of raw interactions and sessions to keep, 0 to keep them forever.
+        rollup_days (int): Days of hourly rollups to keep, 0 to keep them forever.
+        batch_size (int): Rows deleted per transaction.
+        vacuum_pages (int): Free pages returned to the file system per transaction.
+        pause (float): Seconds to sleep between transactions so the writer can get the lock.
+    """
+
+    def __init__(self, engine, shards, raw_days=30, rollup_days=365, batch_size=1000, vacuum_pages=256,
+                 pause=0.01):
+        """
+        Initialize the manager.
+
+        Args:
+            engine (StorageEngine): The catalog's storage engine.
+            shards (ShardManager): Locates the shards to expire.
+            raw_days (int): Days of raw interactions and sessions to keep, 0 to keep them forever.
+            rollup_days (int): Days of hourly rollups to keep, 0 to keep them forever.
+            batch_size (int): Rows deleted per transaction.
+            vacuum_pages (int): Free pages returned to the file system per transaction.
+            pause (float): Seconds to sleep between transactions.
+        """
+        self.engine = engine
+        self.shards = shards
+        self.raw_days = int(raw_days)
+        self.rollup_days = int(rollup_days)
+        self.batch_size = int(batch_size)
+        self.vacuum_pages = int(vacuum_pages)
+        self.pause = float(pause)
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._loop = None
+
+    @classmethod
+    def from_config(cls, config, engine, shards, section='retention'):
+        """
+        Build a manager from a ConfigParser section.
+
+        Args:
+            config (ConfigParser): The loaded configuration.
+            engine (StorageEngine): The catalog's storage engine.
+            shards (ShardManager): Locates the shards to expire.
+            section (str): Section holding the retention settings.
+
+        Returns:
+            RetentionManager: The configured manager.
+        """
+        return cls(
+            engine, shards,
+            raw_days=config.getint(section, 'raw_days', fallback=30),
+            rollup_days=config.getint(section, 'rollup_days', fallback=365),
+            batch_size=config.getint(section, 'batch_size', fallback=1000),
+            vacuum_pages=config.getint(section, 'vacuum_pages', fallback=256),
+        )
+
+    def run(self, now=None):
+        """
+        Expire everything past its retention and release the free pages.
+
+        Args:
+            now (datetime): Reference time for the cutoffs; defaults to the current time.
+
+        Returns:
+            dict: Counts of shards dropped, rollup rows written, sessions and rollups
+                deleted and pages vacuumed.
+        """
+        now = now or datetime.now()
+        stats = {'shards': 0, 'rollups_written': 0, 'sessions': 0, 'rollups_deleted': 0, 'pages': 0}
+        with self._lock:
+            conn = self.engine.connection()
+            if self.raw_days:
+                cutoff = (now - timedelta(days=self.raw_days)).isoformat()
+                for shard in self.shards.expired(conn, cutoff):
+                    if self._stopped:
+                        return stats
+                    stats['rollups_written'] += self._drop_shard(conn, shard)
+                    stats['shards'] += 1
+                stats['sessions'] = self._delete_batches(
+                    conn, 'SELECT id FROM sessions WHERE start_ts < ? LIMIT ?', 'DELETE FROM sessions WHERE id IN',
+                    cutoff)
+            if self.rollup_days:
+                cutoff = (now - timedelta(days=self.rollup_days)).isoformat()[:13]
+                stats['rollups_deleted'] = self._delete_batches(
+                    conn, 'SELECT rowid FROM rollups WHERE hour < ? LIMIT ?', 'DELETE FROM rollups WHERE rowid IN',
+                    cutoff)
+            stats['pages'] = self._vacuum(conn)
+        if any(stats.values()):
+            logger.info(f"Retention run: {stats}")
+        return stats
+
+    def _drop_shard(self, conn, shard):
+        # Aggregate outside any write transaction, then record the rollups and forget
+        # the shard in one short one; the file is only removed once that has committed.
+        rows = []
+        if os.path.exists(shard.path):
+            with self.shards.attached(conn, [shard], views=False) as (alias,):
+                rows = conn.execute(ROLLUP_QUERY.format(alias=alias)).fetchall()
+        with conn:
+            conn.executemany(UPSERT_ROLLUP, rows)
+            conn.execute('DELETE FROM shards WHERE name = ?', (shard.name,))
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(shard.path + suffix)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Shard {shard.name} expired into {len(rows)} hourly rollups")
+        return len(rows)
+
+    def _delete_batches(self, conn, select, delete, cutoff):
+        deleted = 0
+        while not self._stopped:
+            with conn:
+                count = conn.execute(f'{delete} ({select})', (cutoff, self.batch_size)).rowcount
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return deleted
+
+    def _vacuum(self, conn):
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != INCREMENTAL:
+            return 0
+        freed = 0
+        while not self._stopped:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            # execute() would only step the pragma once, freeing a single page
+            conn.executescript(f'PRAGMA incremental_vacuum({self.vacuum_pages});')
+            freed += min(free, self.vacuum_pages)
+            time.sleep(self.pause)
+        return freed
+
+    def start(self, interval=3600):
+        """
+        Run the policies every interval seconds on the reactor's thread pool.
+
+        Args:
+            interval (float): Seconds between runs; the first run starts immediately.
+
+        Returns:
+            twisted.internet.defer.Deferred: Fires when the loop is stopped.
+        """
+        from twisted.internet import task, threads
+
+        def run_in_thread():
+            # Errors are logged so a failing run does not stop the loop
+            d = threads.deferToThread(self.run)
+            d.addErrback(lambda failure: logger.error(f"Retention run failed: {failure.getErrorMessage()}"))
+            return d
+
+        self._stopped = False
+        self._loop = task.LoopingCall(run_in_thread)
+        return self._loop.start(interval)
+
+    def stop(self):
+        """Stop the loop and wait for a run in progress to finish its current transaction."""
+        self._stopped = True
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+        with self._lock:
+            pass
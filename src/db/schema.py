@@ -0,0 +1,268 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module defines the GenAIPot catalog schema and migrates older databases to it.
+
+The schema version is tracked in PRAGMA user_version. Version 0 is either an empty
+file or the original flat 'connections' table; version 2 kept interactions in the
+catalog instead of in shard files. Versions 4 to 9 only add tables; shard files
+are upgraded separately by ShardManager.upgrade().
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 9
+
+# The catalog holds sessions, the shard manifest, interned responses, hourly rollups of
+# expired interactions, export watermarks, captured SMTP messages with their
+# attachments, SMTP AUTH credentials and the interaction id high-water mark;
+# interactions live in the shard files
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        protocol TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        port INTEGER,
+        start_ts TEXT NOT NULL,
+        end_ts TEXT,
+        command_count INTEGER NOT NULL DEFAULT 0,
+        bytes_in INTEGER NOT NULL DEFAULT 0,
+        bytes_out INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_ip_start ON sessions (ip, start_ts);
+    CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions (start_ts);
+
+    CREATE TABLE IF NOT EXISTS shards (
+        name TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        period TEXT NOT NULL,
+        part INTEGER NOT NULL DEFAULT 0,
+        start_ts TEXT NOT NULL,
+        end_ts TEXT NOT NULL,
+        min_id INTEGER,
+        max_id INTEGER,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        sealed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_shards_range ON shards (start_ts, end_ts);
+    CREATE INDEX IF NOT EXISTS idx_shards_period ON shards (period, part);
+
+    CREATE TABLE IF NOT EXISTS responses (
+        id INTEGER PRIMARY KEY,
+        hash BLOB NOT NULL UNIQUE,
+        text TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS rollups (
+        hour TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        protocol TEXT NOT NULL,
+        verb TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (hour, ip, protocol, verb)
+    );
+
+    CREATE TABLE IF NOT EXISTS export_state (
+        name TEXT PRIMARY KEY,
+        watermark INTEGER NOT NULL DEFAULT 0,
+        updated_ts TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS messages (
+        digest TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        session_id INTEGER,
+        ip TEXT,
+        first_ts TEXT NOT NULL,
+        last_ts TEXT NOT NULL,
+        seen_count INTEGER NOT NULL DEFAULT 1,
+        mail_from TEXT,
+        rcpt_to TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        parsed_ts TEXT,
+        subject TEXT,
+        from_header TEXT,
+        to_header TEXT,
+        message_id TEXT,
+        date_header TEXT,
+        part_count INTEGER,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status, first_ts);
+    CREATE INDEX IF NOT EXISTS idx_messages_ip ON messages (ip, first_ts);
+    CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages (message_id);
+
+    CREATE TABLE IF NOT EXISTS attachments (
+        message_digest TEXT NOT NULL,
+        part INTEGER NOT NULL,
+        digest TEXT NOT NULL,
+        filename TEXT,
+        content_type TEXT,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (message_digest, part)
+    );
+    CREATE INDEX IF NOT EXISTS idx_attachments_digest ON attachments (digest);
+
+    CREATE TABLE IF NOT EXISTS credentials (
+        username TEXT NOT NULL,
+        password TEXT NOT NULL,
+        mechanism TEXT,
+        last_ip TEXT,
+        count INTEGER NOT NULL DEFAULT 0,
+        first_ts TEXT NOT NULL,
+        last_ts TEXT NOT NULL,
+        PRIMARY KEY (username, password)
+    );
+    CREATE INDEX IF NOT EXISTS idx_credentials_last ON credentials (last_ts);
+
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+'''
+
+# Rows copied per statement while converting an older database
+MIGRATION_CHUNK = 10000
+
+def schema_version(conn):
+    """
+    Return the schema version recorded in the database.
+
+    Args:
+        conn (sqlite3.Connection): An open connection.
+
+    Returns:
+        int: The value of PRAGMA user_version.
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn, shards):
+    """
+    Bring the catalog database up to SCHEMA_VERSION.
+
+    Version 0 databases with the flat 'connections' table and version 2 databases with an
+    'interactions' table in the catalog have their rows moved into shard files.
+
+    Args:
+        conn (sqlite3.Connection): A catalog connection; the migration commits its own transaction.
+        shards (ShardManager): Receives the interactions of older databases.
+    """
+    version = schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return
+    # DDL does not open a transaction implicitly, so begin one to keep the migration atomic
+    conn.execute('BEGIN')
+    with conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        _create_schema(conn)
+        # Older catalogs only know their ids from the shards retention has not dropped yet
+        conn.execute("INSERT OR IGNORE INTO sequences (name, value) "
+                     "SELECT 'interactions', COALESCE(MAX(max_id), 0) FROM shards")
+        if 'connections' in tables:
+            _migrate_legacy_connections(conn, shards)
+            conn.execute('DROP TABLE connections')
+        if 'interactions' in tables:
+            _migrate_catalog_interactions(conn, shards)
+            conn.execute('DROP VIEW IF EXISTS connections')
+            conn.execute('DROP TABLE interactions')
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    if version:
+        logger.info(f"Database schema migrated from version {version} to {SCHEMA_VERSION}")
+
+def _create_schema(conn):
+    # executescript() would commit the open transaction, so run the statements one by one
+    for statement in SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+def _migrate_catalog_interactions(conn, shards):
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, session_id, seq, protocol, ip, ts, command, response FROM interactions '
+            'WHERE id > ? ORDER BY id LIMIT ?', (last_id, MIGRATION_CHUNK)).fetchall()
+        if not rows:
+            break
+        shards.import_rows(conn, rows)
+        last_id = rows[-1][0]
+
+def _guess_protocol(banner):
+    if banner and banner.startswith('220'):
+        return 'smtp'
+    if banner and banner.startswith('+OK'):
+        return 'pop3'
+    return 'unknown'
+
+def _migrate_legacy_connections(conn, shards):
+    """
+    Copy the flat 'connections' table into sessions and interactions.
+
+    Each 'WELCOME' row opened a connection in the old protocols, so it starts a new
+    session for its IP; the banner tells SMTP from POP3. Rows seen before any
+    WELCOME for their IP are kept without a session.
+    """
+    open_sessions = {}
+    next_session_id = 1
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, ip, timestamp, command, response FROM connections WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, MIGRATION_CHUNK)).fetchall()
+        if not rows:
+            break
+        interactions = []
+        for row_id, ip, ts, command, response in rows:
+            ip = ip or ''
+            ts = ts or ''
+            if command == 'WELCOME':
+                if ip in open_sessions:
+                    _finish_legacy_sessions(conn, [open_sessions[ip]])
+                session = {'id': next_session_id, 'protocol': _guess_protocol(response), 'ip': ip,
+                           'start_ts': ts, 'end_ts': ts, 'seq': 0, 'commands': 0, 'bytes_in': 0, 'bytes_out': 0}
+                next_session_id += 1
+                open_sessions[ip] = session
+                conn.execute('INSERT INTO sessions (id, protocol, ip, start_ts) VALUES (?, ?, ?, ?)',
+                             (session['id'], session['protocol'], ip, ts))
+            else:
+                session = open_sessions.get(ip)
+                if session is not None:
+                    session['commands'] += 1
+                    session['bytes_in'] += len((command or '').encode('utf-8'))
+            if session is None:
+                interactions.append((row_id, None, 0, None, ip, ts, command, response))
+            else:
+                session['seq'] += 1
+                session['end_ts'] = ts
+                session['bytes_out'] += len((response or '').encode('utf-8'))
+                interactions.append((row_id, session['id'], session['seq'], session['protocol'], ip, ts,
+                                     command, response))
+        shards.import_rows(conn, interactions)
+        last_id = rows[-1][0]
+    _finish_legacy_sessions(conn, open_sessions.values())
+
+def _finish_legacy_sessions(conn, sessions):
+    # A session ends at its last row, which is only known once the next one starts
+    conn.executemany(
+        'UPDATE sessions SET end_ts = ?, command_count = ?, bytes_in = ?, bytes_out = ? WHERE id = ?',
+        [(s['end_ts'], s['commands'], s['bytes_in'], s['bytes_out'], s['id']) for s in sessions])
@@ -0,0 +1,597 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module partitions the interactions table into time-based shard files.
+
+Every shard is a small SQLite file holding the interactions of one day (or hour),
+optionally split further when it reaches a size limit. The catalog database keeps
+a manifest of each shard's time and id range, so readers only ATTACH the shards
+that overlap the window they ask for. Response texts are interned in the catalog,
+so shard rows only carry a reference to them.
+"""
+
+import itertools
+import logging
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from db.engine import StorageEngine
+from db.responses import ResponseInterner
+
+logger = logging.getLogger(__name__)
+
+SHARD_SCHEMA_VERSION = 2
+
+SHARD_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS interactions (
+        id INTEGER PRIMARY KEY,
+        session_id INTEGER,
+        seq INTEGER NOT NULL DEFAULT 0,
+        protocol TEXT,
+        ip TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        command TEXT,
+        response_id INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_interactions_ip_ts ON interactions (ip, ts, session_id);
+    CREATE INDEX IF NOT EXISTS idx_interactions_session_seq ON interactions (session_id, seq);
+    CREATE INDEX IF NOT EXISTS idx_interactions_ts ON interactions (ts);
+'''
+
+# Columns of an interaction as seen by callers, and as stored in a shard
+INTERACTION_COLUMNS = ('id', 'session_id', 'seq', 'protocol', 'ip', 'ts', 'command', 'response')
+SHARD_COLUMNS = ('id', 'session_id', 'seq', 'protocol', 'ip', 'ts', 'command', 'response_id')
+
+# Length of the ISO timestamp prefix that identifies a period
+PERIODS = {'day': 10, 'hour': 13}
+
+# SQLite refuses more attached databases than this with the default build
+MAX_ATTACHED = 10
+
+# Row of the catalog's 'sequences' table holding the last interaction id handed out
+ID_SEQUENCE = 'interactions'
+
+# Shard connections kept open by the writer thread
+OPEN_SHARDS = 4
+
+# Schema names for attached shards, unique so nested readers never collide
+_aliases = itertools.count()
+
+@contextmanager
+def _transaction(conn):
+    # Commit on our own, unless the caller holds a transaction it commits itself, as migrate() does
+    if conn.in_transaction:
+        yield
+    else:
+        with conn:
+            yield
+
+def _insert_each(conn, sql, rows):
+    written = []
+    with conn:
+        for row in rows:
+            try:
+                conn.execute(sql, row)
+            except sqlite3.Error as e:
+                logger.error(f"Dropped interaction {row!r}: {e}")
+            else:
+                written.append(row)
+    return written
+
+def _create_shard_schema(conn):
+    for statement in SHARD_SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+class Shard:
+    """
+    One shard file as recorded in the manifest.
+
+    Attributes:
+        name (str): Unique shard name, e.g. '20240804' or '20240804-1'.
+        path (str): Path of the shard file.
+        period (str): Period key the shard belongs to.
+        part (int): Rollover counter within the period.
+    """
+
+    __slots__ = ('name', 'path', 'period', 'part')
+
+    def __init__(self, name, path, period, part):
+        self.name = name
+        self.path = path
+        self.period = period
+        self.part = part
+
+    def __repr__(self):
+        return f"Shard({self.name!r})"
+
+class ShardManager:
+    """
+    Route interactions to shard files and find the shards overlapping a time window.
+
+    Attributes:
+        directory (str): Directory holding the shard files.
+        prefix (str): File name prefix of every shard.
+        period (str): 'day' or 'hour'.
+        max_bytes (int): Size at which a shard is rolled over, 0 for no limit.
+        responses (ResponseInterner): Maps response texts to their ids in the catalog.
+    """
+
+    def __init__(self, directory, prefix='GenAIPot', period='day', max_bytes=0, engine_options=None,
+                 response_cache=4096):
+        """
+        Initialize the manager; shard files are created on first write.
+
+        Args:
+            directory (str): Directory holding the shard files.
+            prefix (str): File name prefix of every shard.
+            period (str): 'day' or 'hour'.
+            max_bytes (int): Size at which a shard is rolled over, 0 for no limit.
+            engine_options (dict): StorageEngine pragmas used for the writer's shard connections.
+            response_cache (int): Number of response texts whose ids are cached in memory.
+
+        Raises:
+            ValueError: If the period is not supported.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Invalid shard period '{period}', expected one of {tuple(PERIODS)}")
+        self.directory = directory
+        self.prefix = prefix
+        self.period = period
+        self.max_bytes = int(max_bytes)
+        self.engine_options = engine_options or {}
+        self.responses = ResponseInterner(response_cache)
+        self._key_length = PERIODS[period]
+        self._current = {}
+        self._engines = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config, catalog_path, section='database', engine_options=None):
+        """
+        Build a manager from a ConfigParser section.
+
+        A relative shard_dir is resolved next to the catalog database.
+
+        Args:
+            config (ConfigParser): The loaded configuration.
+            catalog_path (str): Path of the catalog database.
+            section (str): Section holding the storage settings.
+            engine_options (dict): StorageEngine pragmas for shard connections.
+
+        Returns:
+            ShardManager: The configured manager.
+        """
+        base = os.path.dirname(os.path.abspath(catalog_path))
+        directory = os.path.join(base, config.get(section, 'shard_dir', fallback='shards'))
+        prefix = os.path.splitext(os.path.basename(catalog_path))[0]
+        return cls(directory, prefix=prefix,
+                   period=config.get(section, 'shard_period', fallback='day'),
+                   max_bytes=config.getint(section, 'shard_max_mb', fallback=0) * 1024 * 1024,
+                   engine_options=engine_options,
+                   response_cache=config.getint(section, 'response_cache', fallback=4096))
+
+    def period_key(self, ts):
+        """
+        Return the period a timestamp belongs to.
+
+        Args:
+            ts (str): ISO timestamp.
+
+        Returns:
+            str: '20240804' for daily shards, '20240804T10' for hourly ones.
+        """
+        return ts[:self._key_length].replace('-', '')
+
+    def write(self, catalog, rows):
+        """
+        Append interactions to their shards, assigning ids, and update the manifest.
+
+        Must be called from the writer thread outside any transaction on the catalog
+        connection. Response texts are interned and new shards added to the manifest in
+        a catalog transaction that commits before any row is written to the shards; each
+        shard then commits its rows and its manifest range is committed right after. If
+        anything fails the cached shard state is reset, so the next batch reads it back
+        from the catalog.
+
+        A row that cannot be stored, e.g. without an ip or timestamp, is logged and
+        dropped on its own; the rest of the batch is still written.
+
+        Args:
+            catalog (sqlite3.Connection): The writer's catalog connection.
+            rows (list): Tuples of (session_id, seq, protocol, ip, ts, command, response).
+
+        Returns:
+            int: Number of rows dropped.
+        """
+        try:
+            return self._write(catalog, rows, 'INSERT', assign_ids=True)
+        except Exception:
+            self.reset()
+            raise
+
+    def import_rows(self, catalog, rows):
+        """
+        Copy interactions that already have ids into their shards.
+
+        Used when migrating older databases; rewriting the same rows is harmless.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection inside a transaction.
+            rows (list): Tuples in INTERACTION_COLUMNS order.
+        """
+        self._write(catalog, rows, 'INSERT OR REPLACE')
+
+    def _write(self, catalog, rows, verb, assign_ids=False):
+        # A shard row must never exist without its manifest row, nor refer to a response id
+        # that could be rolled back and reused, so both are committed before the shard write
+        groups = OrderedDict()
+        intern = self.responses.intern
+        dropped = 0
+        with _transaction(catalog):
+            if assign_ids:
+                first = self._reserve_ids(catalog, len(rows))
+                rows = [(first + index,) + tuple(row) for index, row in enumerate(rows)]
+            elif rows:
+                catalog.execute('UPDATE sequences SET value = MAX(value, ?) WHERE name = ?',
+                                (max(row[0] for row in rows), ID_SEQUENCE))
+            for row in rows:
+                try:
+                    key = self.period_key(row[5])
+                    row = row[:7] + (intern(catalog, row[7]),)
+                except (TypeError, AttributeError, sqlite3.Error) as e:
+                    logger.error(f"Dropped interaction {tuple(row)!r}: {e}")
+                    dropped += 1
+                    continue
+                groups.setdefault(key, []).append(row)
+            shards = [(self._shard_for(catalog, key), group) for key, group in groups.items()]
+        sql = f'{verb} INTO interactions ({", ".join(SHARD_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+        for shard, group in shards:
+            conn = self._connection(shard)
+            try:
+                with conn:
+                    conn.executemany(sql, group)
+            except sqlite3.Error:
+                # One bad row fails the whole statement; write the others one by one
+                written = _insert_each(conn, sql, group)
+                dropped += len(group) - len(written)
+                group = written
+                if not group:
+                    continue
+            timestamps = [row[5] for row in group]
+            ids = [row[0] for row in group]
+            with _transaction(catalog):
+                catalog.execute('''
+                    UPDATE shards SET start_ts = MIN(start_ts, ?), end_ts = MAX(end_ts, ?),
+                        min_id = MIN(COALESCE(min_id, ?), ?), max_id = MAX(COALESCE(max_id, ?), ?),
+                        row_count = row_count + ?
+                    WHERE name = ?
+                ''', (min(timestamps), max(timestamps), min(ids), min(ids), max(ids), max(ids), len(group),
+                      shard.name))
+                self._seal_if_full(catalog, shard)
+        return dropped
+
+    def _reserve_ids(self, catalog, count):
+        # The high-water mark is kept in the catalog rather than derived from the manifest,
+        # so ids keep growing after retention has dropped every shard that held them
+        catalog.execute('UPDATE sequences SET value = value + ? WHERE name = ?', (count, ID_SEQUENCE))
+        last = catalog.execute('SELECT value FROM sequences WHERE name = ?', (ID_SEQUENCE,)).fetchone()[0]
+        return last - count + 1
+
+    def _shard_for(self, catalog, key):
+        shard = self._current.get(key)
+        if shard is None:
+            row = catalog.execute('SELECT name, path, period, part, sealed FROM shards WHERE period = ? '
+                                  'ORDER BY part DESC LIMIT 1', (key,)).fetchone()
+            if row is None:
+                shard = self._create(catalog, key, 0)
+            elif row[4]:
+                shard = self._create(catalog, key, row[3] + 1)
+            else:
+                shard = Shard(*row[:4])
+            self._current[key] = shard
+        return shard
+
+    def _seal_if_full(self, catalog, shard):
+        if not self.max_bytes or self._size(shard) < self.max_bytes:
+            return
+        catalog.execute('UPDATE shards SET sealed = 1 WHERE name = ?', (shard.name,))
+        self._close(shard)
+        self._current.pop(shard.period, None)
+        logger.info(f"Shard {shard.name} sealed at size limit of {self.max_bytes} bytes")
+
+    def _create(self, catalog, key, part):
+        name = key if part == 0 else f'{key}-{part}'
+        path = os.path.join(self.directory, f'{self.prefix}-{name}.db')
+        os.makedirs(self.directory, exist_ok=True)
+        shard = Shard(name, path, key, part)
+        conn = self._connection(shard)
+        with conn:
+            _create_shard_schema(conn)
+            conn.execute(f'PRAGMA user_version = {SHARD_SCHEMA_VERSION}')
+        # The manifest range starts empty and widens as rows are written
+        catalog.execute('INSERT OR IGNORE INTO shards (name, path, period, part, start_ts, end_ts) '
+                        "VALUES (?, ?, ?, ?, '9999', '0000')", (name, path, key, part))
+        return shard
+
+    def _connection(self, shard):
+        engine = self._engines.get(shard.name)
+        if engine is None:
+            engine = StorageEngine(shard.path, **self.engine_options)
+            self._engines[shard.name] = engine
+            while len(self._engines) > OPEN_SHARDS:
+                _, oldest = self._engines.popitem(last=False)
+                oldest.close()
+        else:
+            self._engines.move_to_end(shard.name)
+        return engine.connection()
+
+    def _close(self, shard):
+        engine = self._engines.pop(shard.name, None)
+        if engine is not None:
+            engine.close()
+
+    def _size(self, shard):
+        size = 0
+        for suffix in ('', '-wal'):
+            try:
+                size += os.path.getsize(shard.path + suffix)
+            except OSError:
+                pass
+        return size
+
+    def reset(self):
+        """Forget the cached current shards and response ids; they are read again from the catalog."""
+        self._current.clear()
+        self.responses.clear()
+
+    def close(self):
+        """Close the writer's shard connections and forget cached shard state."""
+        for engine in self._engines.values():
+            engine.close()
+        self._engines.clear()
+        self.reset()
+
+    def reconcile(self, catalog):
+        """
+        Repair the manifest after an unclean shutdown.
+
+        Shards commit before the manifest does, so the newest shards may hold rows the
+        manifest has not counted yet; their ranges are recomputed from the files.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection outside any transaction.
+        """
+        rows = catalog.execute('SELECT name, path, period, part FROM shards WHERE sealed = 0').fetchall()
+        with catalog:
+            for row in rows:
+                shard = Shard(*row)
+                if not os.path.exists(shard.path):
+                    continue
+                conn = self._connection(shard)
+                start, end, low, high, count = conn.execute(
+                    'SELECT MIN(ts), MAX(ts), MIN(id), MAX(id), COUNT(*) FROM interactions').fetchone()
+                if count:
+                    catalog.execute('UPDATE shards SET start_ts = ?, end_ts = ?, min_id = ?, max_id = ?, '
+                                    'row_count = ? WHERE name = ?', (start, end, low, high, count, shard.name))
+                self._close(shard)
+
+    def upgrade(self, catalog):
+        """
+        Convert shard files written by older versions to SHARD_SCHEMA_VERSION.
+
+        Version 1 shards stored response texts inline; their texts are interned in the
+        catalog and the table is rebuilt with references, then the file is vacuumed.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection outside any transaction.
+        """
+        for row in catalog.execute('SELECT name, path, period, part FROM shards').fetchall():
+            shard = Shard(*row)
+            if not os.path.exists(shard.path):
+                continue
+            conn = self._connection(shard)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < 2:
+                self._intern_shard_responses(catalog, conn)
+                logger.info(f"Shard {shard.name} upgraded from version {version} to {SHARD_SCHEMA_VERSION}")
+            self._close(shard)
+
+    def _intern_shard_responses(self, catalog, conn):
+        texts = [row[0] for row in conn.execute('SELECT DISTINCT response FROM interactions WHERE response IS NOT NULL')]
+        with catalog:
+            response_ids = [(text, self.responses.intern(catalog, text)) for text in texts]
+        conn.execute('BEGIN')
+        with conn:
+            conn.execute('CREATE TEMP TABLE response_ids (text TEXT PRIMARY KEY, id INTEGER)')
+            conn.executemany('INSERT INTO temp.response_ids VALUES (?, ?)', response_ids)
+            for (index,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                         "AND tbl_name = 'interactions' AND sql IS NOT NULL").fetchall():
+                conn.execute(f'DROP INDEX {index}')
+            conn.execute('ALTER TABLE interactions RENAME TO interactions_v1')
+            _create_shard_schema(conn)
+            columns = ', '.join(f'i.{c}' for c in SHARD_COLUMNS[:-1])
+            conn.execute(f'INSERT INTO interactions ({", ".join(SHARD_COLUMNS)}) SELECT {columns}, r.id '
+                         'FROM interactions_v1 AS i LEFT JOIN temp.response_ids AS r ON r.text = i.response')
+            conn.execute('DROP TABLE interactions_v1')
+            conn.execute('DROP TABLE temp.response_ids')
+            conn.execute(f'PRAGMA user_version = {SHARD_SCHEMA_VERSION}')
+        conn.execute('VACUUM')
+
+    def shards_for(self, catalog, since=None, until=None):
+        """
+        List the shards whose time range overlaps a window, oldest first.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection.
+            since (str): Inclusive lower bound as an ISO timestamp, or None.
+            until (str): Inclusive upper bound as an ISO timestamp, or None.
+
+        Returns:
+            list: Shard objects ordered by their first interaction id.
+        """
+        rows = catalog.execute('''
+            SELECT name, path, period, part FROM shards
+            WHERE row_count > 0 AND end_ts >= ? AND start_ts <= ?
+            ORDER BY min_id
+        ''', (since or '', until or '9999')).fetchall()
+        return [Shard(*row) for row in rows]
+
+    def shards_after(self, catalog, last_id):
+        """
+        List the shards holding interactions with an id above last_id, oldest first.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection.
+            last_id (int): The highest id already processed.
+
+        Returns:
+            list: Shard objects ordered by their first interaction id.
+        """
+        rows = catalog.execute('''
+            SELECT name, path, period, part FROM shards
+            WHERE row_count > 0 AND max_id > ?
+            ORDER BY min_id
+        ''', (last_id,)).fetchall()
+        return [Shard(*row) for row in rows]
+
+    def expired(self, catalog, cutoff):
+        """
+        List the shards holding nothing newer than a cutoff, oldest first.
+
+        Args:
+            catalog (sqlite3.Connection): A catalog connection.
+            cutoff (str): ISO timestamp; shards whose last interaction is older are returned.
+
+        Returns:
+            list: Shard objects ordered by period and part.
+        """
+        # Empty shards have no time range yet, so fall back to their period
+        rows = catalog.execute('''
+            SELECT name, path, period, part FROM shards
+            WHERE (row_count > 0 AND end_ts < ?) OR (row_count = 0 AND period < ?)
+            ORDER BY period, part
+        ''', (cutoff, self.period_key(cutoff))).fetchall()
+        return [Shard(*row) for row in rows]
+
+    @contextmanager
+    def attached(self, conn, shards, views=True, since=None, until=None):
+        """
+        ATTACH shards to a connection and expose them as one 'interactions' view.
+
+        A TEMP view 'connections' with the original column names is created as well,
+        so older queries keep working inside the block. When more shards overlap the
+        window than SQLite can attach at once, the rows inside the window are copied
+        into a scratch shard file next to the others, MAX_ATTACHED - 1 shards at a
+        time, and the views read from that copy instead.
+
+        Args:
+            conn (sqlite3.Connection): The calling thread's catalog connection, outside a transaction.
+            shards (list): Shards returned by shards_for().
+            views (bool): Create the TEMP views; readers that query the aliases directly skip
+                them so several can be open on one connection at once.
+            since (str): Inclusive lower bound of the window, as passed to shards_for().
+            until (str): Inclusive upper bound of the window, as passed to shards_for().
+
+        Yields:
+            list: The schema aliases of the attached shards; empty when the rows were copied.
+
+        Raises:
+            ValueError: If more shards than SQLite can attach at once are requested without
+                views or without a lower bound; iter_interactions() streams any window.
+        """
+        copied = len(shards) > MAX_ATTACHED
+        if copied and not views:
+            raise ValueError(f"{len(shards)} shards requested; attach at most {MAX_ATTACHED} at once")
+        if copied and since is None:
+            raise ValueError(f"{len(shards)} shards overlap an unbounded window; give it a start "
+                             f"or stream it with iter_interactions()")
+        columns = ', '.join(SHARD_COLUMNS)
+        aliases, window = [], None
+        try:
+            if copied:
+                window = self._copy_window(conn, shards, since, until)
+                union = f'SELECT {columns} FROM {window[0]}.interactions'
+            else:
+                for shard in shards:
+                    alias = f'shard{next(_aliases)}'
+                    conn.execute(f'ATTACH DATABASE ? AS {alias}', (shard.path,))
+                    aliases.append(alias)
+                union = ' UNION ALL '.join(f'SELECT {columns} FROM {alias}.interactions' for alias in aliases)
+            if views:
+                if not union:
+                    union = f'SELECT {", ".join("NULL AS " + c for c in SHARD_COLUMNS)} WHERE 0'
+                # Rehydrate the interned response texts from the catalog
+                projection = ', '.join(f'i.{c}' for c in SHARD_COLUMNS[:-1])
+                conn.execute(f'CREATE TEMP VIEW interactions AS SELECT {projection}, r.text AS response '
+                             f'FROM ({union}) AS i LEFT JOIN main.responses AS r ON r.id = i.response_id')
+                conn.execute('CREATE TEMP VIEW connections AS '
+                             'SELECT id, ip, ts AS timestamp, command, response FROM temp.interactions')
+            yield aliases
+        finally:
+            if conn.in_transaction:
+                conn.commit()
+            if views:
+                conn.execute('DROP VIEW IF EXISTS temp.connections')
+                conn.execute('DROP VIEW IF EXISTS temp.interactions')
+            for alias in aliases:
+                conn.execute(f'DETACH DATABASE {alias}')
+            if window is not None:
+                self._drop_window(conn, *window)
+
+    def _copy_window(self, conn, shards, since, until):
+        # A shard-shaped file on disk with the same indexes, so wide windows never have to fit in memory
+        fd, path = tempfile.mkstemp(prefix=f'.{self.prefix}-window-', suffix='.db', dir=self.directory or os.curdir)
+        os.close(fd)
+        scratch = sqlite3.connect(path)
+        with scratch:
+            _create_shard_schema(scratch)
+        scratch.close()
+        alias = f'window{next(_aliases)}'
+        conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+        try:
+            conditions, params = ['ts >= ?'], [since]
+            if until is not None:
+                conditions.append('ts <= ?')
+                params.append(until)
+            columns = ', '.join(SHARD_COLUMNS)
+            # One attachment is taken by the copy itself
+            for start in range(0, len(shards), MAX_ATTACHED - 1):
+                with self.attached(conn, shards[start:start + MAX_ATTACHED - 1], views=False) as sources:
+                    for source in sources:
+                        conn.execute(f'INSERT INTO {alias}.interactions SELECT {columns} FROM '
+                                     f'{source}.interactions WHERE {" AND ".join(conditions)}', params)
+        except BaseException:
+            self._drop_window(conn, alias, path)
+            raise
+        return alias, path
+
+    def _drop_window(self, conn, alias, path):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute(f'DETACH DATABASE {alias}')
+        for name in (path, path + '-journal'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,229 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module provides a write-behind queue for honeypot records.
+
+Protocols enqueue records from the reactor thread and a dedicated writer thread
+drains them in batches bounded by size and time, so a slow disk never stalls
+the listeners.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+class InteractionWriter:
+    """
+    Batch records on a bounded queue and hand them to a flush callback on a worker thread.
+
+    Attributes:
+        flush_callback (callable): Called on the writer thread with a list of records; returns
+            the number of records it dropped, or None if it wrote them all.
+        batch_size (int): Maximum number of records per flush.
+        flush_interval (float): Maximum number of seconds a record waits before being flushed.
+        overflow (str): What to do when the queue is full ('drop_newest', 'drop_oldest' or 'block').
+    """
+
+    def __init__(self, flush_callback, batch_size=500, flush_interval=0.2, max_queue=10000,
+                 overflow='drop_newest', name='interaction-writer'):
+        """
+        Initialize the writer. The worker thread is not started until start() is called.
+
+        Args:
+            flush_callback (callable): Function receiving a list of records to persist.
+            batch_size (int): Maximum number of records per flush.
+            flush_interval (float): Maximum age in seconds of a pending batch.
+            max_queue (int): Maximum number of records waiting in the queue.
+            overflow (str): Overflow policy, one of OVERFLOW_POLICIES.
+            name (str): Name of the worker thread.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.flush_callback = flush_callback
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.001, float(flush_interval))
+        self.overflow = overflow
+        self.name = name
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def start(self):
+        """Start the worker thread if it is not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the worker thread after draining every queued record.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the drain.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error(f"{self.name} did not drain within {timeout}s; {self._queue.qsize()} records pending")
+            self._thread = None
+        else:
+            # Never started: flush synchronously so nothing is lost.
+            self._drain()
+
+    @property
+    def running(self):
+        """bool: True while the worker thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, record):
+        """
+        Enqueue a record without blocking the caller, unless the overflow policy is 'block'.
+
+        Args:
+            record: Any object understood by the flush callback.
+
+        Returns:
+            bool: True if the record was queued, False if it was dropped.
+        """
+        if self.overflow == 'block':
+            self._queue.put(record)
+            self.enqueued += 1
+            return True
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'drop_newest':
+                self.dropped += 1
+                return False
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        self.enqueued += 1
+        return True
+
+    def put_many(self, records):
+        """
+        Enqueue several records.
+
+        Args:
+            records (iterable): Records to queue.
+
+        Returns:
+            int: The number of records that were queued.
+        """
+        return sum(1 for record in records if self.put(record))
+
+    def stats(self):
+        """
+        Return a snapshot of the writer counters.
+
+        Returns:
+            dict: Queue depth, drop count, flush count and flush latencies in milliseconds.
+        """
+        with self._lock:
+            mean = self.total_flush_latency / self.batches if self.batches else 0.0
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failed': self.failed,
+                'last_flush_ms': self.last_flush_latency * 1000,
+                'max_flush_ms': self.max_flush_latency * 1000,
+                'mean_flush_ms': mean * 1000,
+            }
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        try:
+            dropped = self.flush_callback(batch) or 0
+        except Exception as e:
+            logger.error(f"{self.name} failed to flush {len(batch)} records: {e}")
+            with self._lock:
+                self.failed += len(batch)
+            return
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.flushed += len(batch) - dropped
+            self.failed += dropped
+            self.batches += 1
+            self.last_flush_latency = elapsed
+            self.max_flush_latency = max(self.max_flush_latency, elapsed)
+            self.total_flush_latency += elapsed
@@ -0,0 +1,404 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module provides large synthetic mailboxes generated from the sample emails.
+
+Each account gets its own GeneratedMailbox of thousands of messages. A message is
+derived from the mailbox seed and its number: the template it is based on, its sender,
+date, subject, greeting and signature all come from one BLAKE2b digest. Only the size of
+each message is computed up front, from the lengths of its parts; a message is rendered
+when RETR or TOP reads it, and kept in a MessageCache shared by all the mailboxes.
+"""
+
+import datetime
+import glob
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+
+from pop3.mailbox import MailboxSession, CRLF
+from pop3.pop3_utils import _token
+
+logger = logging.getLogger(__name__)
+
+FIRST_NAMES = (
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark', 'Sandra', 'Steven', 'Ashley',
+    'Andrew', 'Emily', 'Kenneth', 'Donna', 'Kevin', 'Michelle', 'Brian', 'Carol', 'George', 'Amanda',
+)
+LAST_NAMES = (
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson',
+    'Walker', 'Young', 'Allen', 'King', 'Wright', 'Scott', 'Torres', 'Nguyen', 'Hill', 'Flores',
+)
+TITLES = (
+    'Senior Manager, Public Sector Services', 'Relationship Manager', 'Vice President, Treasury Services',
+    'Account Executive', 'Director of Operations', 'Compliance Officer', 'Branch Manager',
+    'Head of Commercial Banking', 'Client Services Associate', 'Risk Analyst', 'Chief Financial Officer',
+    'Procurement Specialist', 'IT Security Lead', 'Executive Assistant', 'Loan Officer', 'Controller',
+)
+ORGANIZATIONS = (
+    'bankers.gov', 'treasury-partners.com', 'northwind-capital.com', 'firstfederal.us', 'cityfinance.org',
+    'statecu.org', 'meridianbank.com', 'harborlending.com', 'pinnacle-advisors.com', 'county.gov',
+)
+GREETINGS = (
+    'Dear Client,', 'Dear Team,', 'Hello,', 'Hi all,', 'Good morning,', 'Good afternoon,', 'Dear colleagues,',
+    'Hi,',
+)
+CLOSINGS = ('Best Regards,', 'Kind regards,', 'Sincerely,', 'Thanks,', 'Best,', 'Regards,', 'Warm regards,')
+SUBJECT_PREFIXES = ('', '', '', 'Re: ', 'RE: ', 'Fwd: ', 'FW: ')
+
+def _encoded(values):
+    return tuple(value.encode('utf-8') for value in values)
+
+_FIRST = _encoded(FIRST_NAMES)
+_LAST = _encoded(LAST_NAMES)
+_FIRST_LOWER = _encoded(name.lower() for name in FIRST_NAMES)
+_LAST_LOWER = _encoded(name.lower() for name in LAST_NAMES)
+_TITLES = _encoded(TITLES)
+_ORGANIZATIONS = _encoded(ORGANIZATIONS)
+_GREETINGS = _encoded(GREETINGS)
+_CLOSINGS = _encoded(CLOSINGS)
+_PREFIXES = _encoded(SUBJECT_PREFIXES)
+
+class Template:
+    """
+    The reusable part of a sample email: its subject and the paragraphs of its body.
+
+    The greeting, closing and signature of the sample are dropped, since every generated
+    message gets its own.
+    """
+
+    __slots__ = ('subject', 'body')
+
+    def __init__(self, subject, body):
+        """
+        Args:
+            subject (bytes): The subject line, without the 'Subject:' name.
+            body (bytes): The paragraphs in their wire form, separated by blank lines and ended by CRLF.
+        """
+        self.subject = subject
+        self.body = body
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Split a sample email into a template.
+
+        Args:
+            text (str): The sample email: an optional 'Subject:' line, then the body.
+
+        Returns:
+            Template: The template, or None if the email has no body.
+        """
+        blocks = []
+        for block in text.replace('\r\n', '\n').split('\n\n'):
+            lines = [line.rstrip() for line in block.strip('\n').split('\n')]
+            if any(lines):
+                blocks.append(lines)
+        subject = 'No Subject'
+        if blocks and blocks[0][0].startswith('Subject:'):
+            subject = blocks[0][0][len('Subject:'):].strip() or subject
+            blocks[0] = blocks[0][1:]
+            if not any(blocks[0]):
+                blocks.pop(0)
+        if blocks and _is_salutation(blocks[0][0]):
+            blocks[0] = blocks[0][1:]
+            if not blocks[0]:
+                blocks.pop(0)
+        # The signature follows a closing such as 'Best Regards,' in one of the last two blocks
+        for index in range(len(blocks) - 1, max(len(blocks) - 3, 0), -1):
+            if _is_salutation(blocks[index][0]):
+                del blocks[index:]
+                break
+        if not blocks:
+            return None
+        body = '\r\n\r\n'.join('\r\n'.join(lines) for lines in blocks) + '\r\n'
+        return cls(subject.encode('utf-8'), body.encode('utf-8'))
+
+    @classmethod
+    def load(cls, patterns):
+        """
+        Read the templates from the files matching any of the glob patterns.
+
+        Args:
+            patterns (iterable): Glob patterns of sample email files.
+
+        Returns:
+            list: The templates of the readable files that have a body, in file name order.
+        """
+        templates = []
+        for pattern in patterns:
+            for filename in sorted(glob.glob(pattern)):
+                try:
+                    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+                        template = cls.parse(f.read())
+                except OSError as e:
+                    logger.warning(f"Error reading email template {filename}: {e}")
+                    continue
+                if template is not None:
+                    templates.append(template)
+        return templates
+
+def _is_salutation(line):
+    return line.endswith(',') and len(line) <= 40
+
+class MessageCache:
+    """
+    Bounded LRU of rendered messages, shared by the generated mailboxes of all accounts.
+
+    Keys are (mailbox seed, message number), so a mailbox that is built again for the
+    same account finds the messages it rendered before.
+    """
+
+    def __init__(self, max_messages=256):
+        self.max_messages = max_messages
+        self.messages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        message = self.messages.get(key)
+        if message is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.messages.move_to_end(key)
+        return message
+
+    def put(self, key, message):
+        if self.max_messages <= 0:
+            return
+        self.messages[key] = message
+        self.messages.move_to_end(key)
+        while len(self.messages) > self.max_messages:
+            self.messages.popitem(last=False)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def stats(self):
+        return {'cached': len(self.messages), 'hits': self.hits, 'misses': self.misses}
+
+class GeneratedMailbox:
+    """
+    A read-only mailbox of count synthetic messages derived from templates.
+
+    It offers the interface of Mailbox, so sessions are ordinary MailboxSession objects.
+    Each message carries its own headers, so there are no per-session headers and TOP
+    counts body lines from the blank line that ends them. Messages are dated from
+    `days` days before `now` up to a few hours before it, oldest first.
+
+    Startup costs one digest per message and an array of sizes; the LIST and UIDL
+    listings are built the first time they are asked for, and a message body only when
+    it is read.
+    """
+
+    headers = None
+
+    def __init__(self, templates, count, seed, user='user', domain='localhost', now=None, days=365, cache=None):
+        """
+        Size the messages of a mailbox.
+
+        Args:
+            templates (list): Templates the messages are based on; at least one.
+            count (int): Number of messages.
+            seed (bytes): Seed of the messages, at most 64 bytes; the same seed gives the same mailbox.
+            user (str): Local part of the To address.
+            domain (str): The domain of the To address and of the Received and Message-ID headers.
+            now (datetime): Time of the newest messages; the current UTC time if not given.
+            days (int): Age in days of the oldest message.
+            cache (MessageCache): Cache of rendered messages; a private one of 256 messages if not given.
+        """
+        if not templates:
+            raise ValueError("A generated mailbox needs at least one template")
+        self.templates = templates
+        self.count = count
+        self.seed = seed
+        self.domain = domain
+        self.to = f"{user}@{domain}".encode('utf-8', 'surrogateescape')
+        self.now = now or datetime.datetime.now(datetime.timezone.utc)
+        # Seconds between two consecutive messages; each one is moved back by up to that much
+        self.spacing = max(60, days * 86400 // max(count, 1))
+        self.cache = cache if cache is not None else MessageCache()
+        self._fixed = 0
+        if count:
+            self._fixed = len(self._render(1)) - sum(map(len, self._parts(self._digest(1))))
+        self.octets = array('L', (self._fixed + sum(map(len, self._parts(self._digest(number))))
+                                  for number in range(1, count + 1)))
+        self.total_octets = sum(self.octets)
+        self._listing = None
+        self._uid_listing = None
+
+    @classmethod
+    def for_account(cls, templates, user, domain, messages, now=None, cache=None):
+        """
+        Return the mailbox of an account.
+
+        The seed is derived from the domain and the user name, so an account finds the
+        same messages at every login. Accounts get between 80% and 100% of messages.
+
+        Args:
+            templates (list): Templates the messages are based on.
+            user (str): The account's user name.
+            domain (str): The server's domain.
+            messages (int): The largest number of messages.
+            now (datetime): Time of the newest messages.
+            cache (MessageCache): Cache of rendered messages.
+        """
+        seed = hashlib.blake2b(f"{domain}\0{user}".encode('utf-8', 'surrogateescape'), digest_size=32).digest()
+        count = messages - int.from_bytes(seed[:4], 'big') % (messages // 5 + 1)
+        return cls(templates, count, seed, user, domain, now=now, cache=cache)
+
+    def _digest(self, number):
+        return hashlib.blake2b(number.to_bytes(8, 'big'), key=self.seed, digest_size=32).digest()
+
+    def _parts(self, digest):
+        # The variable parts of a message in the order _render writes them; its size is
+        # their length plus the fixed-width rest
+        first, last = digest[0] % len(_FIRST), digest[1] % len(_LAST)
+        organization = _ORGANIZATIONS[digest[2] % len(_ORGANIZATIONS)]
+        template = self.templates[digest[3] % len(self.templates)]
+        return (
+            _FIRST[first], _LAST[last], _FIRST_LOWER[first], _LAST_LOWER[last], organization,
+            _PREFIXES[digest[4] % len(_PREFIXES)], template.subject,
+            _GREETINGS[digest[5] % len(_GREETINGS)], template.body, _CLOSINGS[digest[6] % len(_CLOSINGS)],
+            _FIRST[first], _LAST[last], _TITLES[digest[7] % len(_TITLES)], organization,
+        )
+
+    def _render(self, number):
+        digest = self._digest(number)
+        (first, last, first_lower, last_lower, organization, prefix, subject, greeting, body, closing,
+         _, _, title, _) = self._parts(digest)
+        # Three-digit octets, like the fixed-width fields below, keep the header size constant
+        ip = '.'.join(str(100 + b % 155) for b in digest[8:12])
+        message_id = f"{1000000000 + int.from_bytes(digest[12:17], 'big') % 9000000000}.{_token(digest[17:22])}"
+        age = (self.count - number) * self.spacing
+        age += 3600 * 3 + int.from_bytes(digest[22:26], 'big') % self.spacing
+        date = (self.now - datetime.timedelta(seconds=age)).strftime('%a, %d %b %Y %H:%M:%S')
+        headers = (
+            f"Received: from {ip} by {self.domain} (SMTPD) id {_token(digest[26:32])}\r\n"
+            f"Message-ID: <{message_id}@{self.domain}>\r\n"
+            f"Date: {date} +0000\r\n"
+        ).encode('utf-8')
+        return b''.join((
+            headers,
+            b'From: ', first, b' ', last, b' <', first_lower, b'.', last_lower, b'@', organization, b'>', CRLF,
+            b'To: ', self.to, CRLF,
+            b'Subject: ', prefix, subject, CRLF,
+            CRLF,
+            greeting, CRLF, CRLF,
+            body, CRLF,
+            closing, CRLF, CRLF,
+            first, b' ', last, CRLF, title, CRLF, organization, CRLF,
+        ))
+
+    def __len__(self):
+        return len(self.octets)
+
+    def __contains__(self, number):
+        return isinstance(number, int) and 1 <= number <= len(self.octets)
+
+    def size(self, number):
+        """Return the octet count of message number (1-based)."""
+        return self.octets[number - 1]
+
+    def message(self, number):
+        """
+        Return a message, rendering it if it is not in the cache.
+
+        Args:
+            number (int): The message number, starting at 1.
+
+        Returns:
+            bytes: The message with its headers, in its wire form.
+        """
+        key = (self.seed, number)
+        message = self.cache.get(key)
+        if message is None:
+            message = self._render(number)
+            self.cache.put(key, message)
+        return message
+
+    def uid(self, number):
+        """Return the unique id of message number (1-based), derived from the seed."""
+        return hashlib.blake2b(b'uid' + number.to_bytes(8, 'big'), key=self.seed, digest_size=16).hexdigest()
+
+    @property
+    def listing(self):
+        """The LIST lines of every message, each ended by CRLF."""
+        if self._listing is None:
+            self._listing = ''.join(f"{number} {octets}\r\n" for number, octets in enumerate(self.octets, 1))
+        return self._listing
+
+    @property
+    def uid_listing(self):
+        """The UIDL lines of every message, each ended by CRLF."""
+        if self._uid_listing is None:
+            self._uid_listing = ''.join(f"{number} {self.uid(number)}\r\n" for number in range(1, len(self) + 1))
+        return self._uid_listing
+
+    def top_size(self, number, lines):
+        """
+        Return the size of the headers and first lines of the body of a message, as sent by TOP.
+
+        Args:
+            number (int): The message number, starting at 1.
+            lines (int): Number of body lines.
+
+        Returns:
+            int: Bytes from the start of the message to the end of its lines-th body line.
+        """
+        message = self.message(number)
+        end = message.find(CRLF + CRLF) + 4
+        for _ in range(max(lines, 0)):
+            position = message.find(CRLF, end)
+            if position < 0:
+                return len(message)
+            end = position + 2
+        return end
+
+    def chunks(self, number, chunk_size, size=None):
+        """
+        Yield a message in slices.
+
+        Args:
+            number (int): The message number, starting at 1.
+            chunk_size (int): Bytes per slice.
+            size (int): Only yield the first size bytes of the message.
+
+        Yields:
+            bytes: Consecutive parts of the message, at most chunk_size bytes each.
+        """
+        message = self.message(number)
+        end = len(message) if size is None else min(len(message), size)
+        for offset in range(0, end, chunk_size):
+            yield message[offset:min(end, offset + chunk_size)]
+
+    def session(self, seed=None, now=None):
+        """Return the per-session view of this mailbox."""
+        return MailboxSession(self, seed, now)
+
+    def close(self):
+        pass
@@ -0,0 +1,352 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module provides the mailbox served by the POP3 listener.
+
+The factory packs the message bodies into one file once and maps it into memory;
+every session reads the bodies from that shared mapping and only keeps a bitmap of
+the messages it marked as deleted, with running totals for STAT.
+"""
+
+import datetime
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from array import array
+
+logger = logging.getLogger(__name__)
+
+CRLF = b'\r\n'
+
+def to_crlf(body):
+    """
+    Return a message body in its wire form: every line ended by CRLF, including the last.
+
+    Args:
+        body (bytes): The body with LF or CRLF line endings.
+
+    Returns:
+        bytes: The normalized body.
+    """
+    body = body.replace(CRLF, b'\n').replace(b'\n', CRLF)
+    if body and not body.endswith(CRLF):
+        body += CRLF
+    return body
+
+class Mailbox:
+    """
+    Read-only messages packed back to back in a memory-mapped file.
+
+    Messages are numbered from 1 as in POP3. The index holds the offset and size of
+    each body in the packed file, so reading a body is a slice of the mapping and no
+    session holds its own copy. Bodies are packed in their CRLF wire form, and the
+    per-session header block has a fixed size, so the octet count of every message,
+    the totals and the LIST listing are computed once here.
+
+    The index also holds each message's unique id for UIDL, the hex BLAKE2b digest of
+    its body, and the end offset of every body line, so TOP sends a prefix of the body
+    without splitting it into lines.
+    """
+
+    def __init__(self, path, sizes, headers=None):
+        """
+        Map an already packed file.
+
+        Args:
+            path (str): The packed file.
+            sizes (list): Size in bytes of each body, in the order they were packed.
+            headers (SessionHeaders): Generator of the headers prepended to each body, if any.
+        """
+        self.path = path
+        self.headers = headers
+        self.header_size = headers.size if headers is not None else 0
+        self.sizes = list(sizes)
+        self.offsets = []
+        offset = 0
+        for size in self.sizes:
+            self.offsets.append(offset)
+            offset += size
+        # Octets of each message as retrieved: headers and body, before dot-stuffing
+        self.octets = [self.header_size + size for size in self.sizes]
+        self.total_octets = sum(self.octets)
+        self.listing = ''.join(f"{number} {octets}\r\n" for number, octets in enumerate(self.octets, 1))
+        self._file = None
+        self._map = None
+        if offset:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.uids = []
+        self.line_ends = []
+        self._index()
+        self.uid_listing = ''.join(f"{number} {uid}\r\n" for number, uid in enumerate(self.uids, 1))
+
+    def _index(self):
+        # One pass over the mapping at startup; sessions only ever look the results up
+        seen = set()
+        for number, (offset, size) in enumerate(zip(self.offsets, self.sizes), 1):
+            end = offset + size
+            digest = hashlib.blake2b(digest_size=16)
+            ends = array('L')
+            if size:
+                with memoryview(self._map) as view:
+                    digest.update(view[offset:end])
+                position = self._map.find(b'\r\n', offset, end)
+                while position >= 0:
+                    ends.append(position + 2 - offset)
+                    position = self._map.find(b'\r\n', position + 2, end)
+            uid = digest.hexdigest()
+            # Identical bodies still need distinct ids within the maildrop
+            if uid in seen:
+                uid = f"{uid}-{number}"
+            seen.add(uid)
+            self.uids.append(uid)
+            self.line_ends.append(ends)
+
+    @classmethod
+    def pack(cls, bodies, path, headers=None):
+        """
+        Write message bodies into a packed file and map it.
+
+        The file is written next to its final path and renamed into place, so a listener
+        that still maps the previous file keeps reading consistent data.
+
+        Args:
+            bodies (iterable): Message bodies as bytes, in their wire form.
+            path (str): The packed file to create or replace.
+            headers (SessionHeaders): Generator of the headers prepended to each body, if any.
+
+        Returns:
+            Mailbox: The mapped mailbox.
+        """
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        sizes = []
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for body in bodies:
+                    f.write(body)
+                    sizes.append(len(body))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return cls(path, sizes, headers)
+
+    @classmethod
+    def from_files(cls, filenames, path, headers=None):
+        """
+        Pack the message files that exist into path, converted to CRLF line endings.
+
+        Args:
+            filenames (iterable): Message files, read as bytes; missing files are skipped.
+            path (str): The packed file.
+            headers (SessionHeaders): Generator of the headers prepended to each body, if any.
+
+        Returns:
+            Mailbox: The mapped mailbox.
+        """
+        bodies = []
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as f:
+                    bodies.append(to_crlf(f.read()))
+            except FileNotFoundError:
+                logger.warning(f"Email file {filename} not found.")
+        if not bodies:
+            return cls(path, [], headers)
+        mailbox = cls.pack(bodies, path, headers)
+        logger.debug(f"Packed {len(mailbox)} messages of {mailbox.total_octets} octets into {path}")
+        return mailbox
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, number):
+        return isinstance(number, int) and 1 <= number <= len(self.sizes)
+
+    def size(self, number):
+        """Return the octet count of message number (1-based), headers included."""
+        return self.octets[number - 1]
+
+    def message(self, number):
+        """
+        Return the body of a message.
+
+        Args:
+            number (int): The message number, starting at 1.
+
+        Returns:
+            bytes: The body as packed.
+        """
+        offset = self.offsets[number - 1]
+        return self._map[offset:offset + self.sizes[number - 1]] if self._map is not None else b''
+
+    def uid(self, number):
+        """Return the unique id of message number (1-based)."""
+        return self.uids[number - 1]
+
+    def top_size(self, number, lines):
+        """
+        Return the size of the first lines of a body, as sent by TOP.
+
+        Args:
+            number (int): The message number, starting at 1.
+            lines (int): Number of body lines.
+
+        Returns:
+            int: Bytes from the start of the body to the end of its lines-th line.
+        """
+        ends = self.line_ends[number - 1]
+        if lines <= 0:
+            return 0
+        if lines > len(ends):
+            return self.sizes[number - 1]
+        return ends[lines - 1]
+
+    def chunks(self, number, chunk_size, size=None):
+        """
+        Yield the body of a message in slices of the mapping.
+
+        Args:
+            number (int): The message number, starting at 1.
+            chunk_size (int): Bytes per slice.
+            size (int): Only yield the first size bytes of the body.
+
+        Yields:
+            bytes: Consecutive parts of the body, at most chunk_size bytes each.
+        """
+        offset = self.offsets[number - 1]
+        end = offset + self.sizes[number - 1]
+        if size is not None:
+            end = min(end, offset + size)
+        while offset < end:
+            yield self._map[offset:min(end, offset + chunk_size)]
+            offset += chunk_size
+
+    def session(self, seed=None, now=None):
+        """
+        Return the per-session view of this mailbox.
+
+        Args:
+            seed (bytes): Seed of the session's headers; random if not given.
+            now (datetime): Time the headers' dates are derived from; the current UTC time if not given.
+        """
+        return MailboxSession(self, seed, now)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = self._file = None
+
+class MailboxSession:
+    """
+    One session's view of a shared Mailbox: the messages it has not marked as deleted.
+
+    The per-session state is a bitmap with one bit per message, the running count and
+    octet total of the messages left, and the seed of the session's headers.
+    """
+
+    __slots__ = ('mailbox', 'deleted', 'count', 'octets', 'seed', 'now')
+
+    def __init__(self, mailbox, seed=None, now=None):
+        self.mailbox = mailbox
+        self.deleted = bytearray((len(mailbox) + 7) // 8)
+        self.count = len(mailbox)
+        self.octets = mailbox.total_octets
+        self.seed = seed if seed is not None else os.urandom(16)
+        self.now = now or datetime.datetime.now(datetime.timezone.utc)
+
+    def __contains__(self, number):
+        """True if number is a message of the mailbox that is not marked as deleted."""
+        return number in self.mailbox and not self.is_deleted(number)
+
+    def is_deleted(self, number):
+        index = number - 1
+        return bool(self.deleted[index >> 3] & (1 << (index & 7)))
+
+    def size(self, number):
+        return self.mailbox.size(number)
+
+    def headers(self, number):
+        """Return this session's header block of a message, b'' if the mailbox adds none."""
+        headers = self.mailbox.headers
+        return headers.render(self.seed, number, self.now) if headers is not None else b''
+
+    def message(self, number):
+        """
+        Return a message as this session retrieves it.
+
+        Returns:
+            bytes: The session's headers for the message followed by its body, not dot-stuffed.
+        """
+        return self.headers(number) + self.mailbox.message(number)
+
+    def delete(self, number):
+        """
+        Mark a message as deleted.
+
+        Returns:
+            bool: False if there is no such message or it was already deleted.
+        """
+        if number not in self:
+            return False
+        index = number - 1
+        self.deleted[index >> 3] |= 1 << (index & 7)
+        self.count -= 1
+        self.octets -= self.mailbox.size(number)
+        return True
+
+    def reset(self):
+        """Unmark every deleted message, as RSET does."""
+        self.deleted = bytearray(len(self.deleted))
+        self.count = len(self.mailbox)
+        self.octets = self.mailbox.total_octets
+
+    def messages(self):
+        """Yield (number, octets) of every message that is not deleted."""
+        for number, octets in enumerate(self.mailbox.octets, 1):
+            if not self.is_deleted(number):
+                yield number, octets
+
+    def stat(self):
+        """
+        Return the STAT figures from the running totals.
+
+        Returns:
+            tuple: (message count, total octets) of the messages not deleted.
+        """
+        return self.count, self.octets
+
+    def listing(self):
+        """Return the LIST lines of the messages not deleted, each ended by CRLF."""
+        if self.count == len(self.mailbox):
+            return self.mailbox.listing
+        return ''.join(f"{number} {octets}\r\n" for number, octets in self.messages())
+
+    def uid_listing(self):
+        """Return the UIDL lines of the messages not deleted, each ended by CRLF."""
+        if self.count == len(self.mailbox):
+            return self.mailbox.uid_listing
+        return ''.join(f"{number} {self.mailbox.uid(number)}\r\n" for number, _ in self.messages())
@@ -17,67 +17,378 @@
 # For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
 #
 
+import datetime
+import itertools
 import logging
+import os
+from collections import OrderedDict
 from twisted.protocols.basic import LineReceiver
+from twisted.protocols.policies import TimeoutMixin
 from twisted.internet import protocol
-from pop3.pop3_utils import generate_email_headers
-from database import log_interaction
+from pop3.pop3_utils import SessionHeaders
+from pop3.mailbox import Mailbox
+from pop3.generator import GeneratedMailbox, MessageCache, Template
+from pop3.streaming import MessageProducer, CHUNK_SIZE
+from sinks import log_interaction, open_session, close_session, WELCOME
 import configparser
-import os
 from auth import check_credentials
+from wire import WireTable, split_command, decode, loggable
+from admission import AdmissionController, TOO_MANY_SESSIONS, TOO_MANY_FROM_IP, IDLE, SESSION
 
 logger = logging.getLogger(__name__)
 
+# Load the config.ini file
+config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'etc', 'config.ini'))
 config = configparser.ConfigParser()
-config.read('config.ini')
+config.read(config_file_path)
 domain_name = config.get('server', 'domain', fallback='localhost')
 technology = config.get('server', 'technology', fallback='generic')
 
-class POP3Protocol(LineReceiver):
-    def __init__(self, debug=False):
+# Fixed replies; together with the response file they are precompiled per factory
+GOODBYE = "+OK Goodbye"
+NOT_ALLOWED = "-ERR Command not allowed in this state"
+UNRECOGNIZED = "-ERR Unrecognized command"
+NO_SUCH_MESSAGE = "-ERR no such message"
+RETR_SYNTAX = "-ERR syntax: RETR <msg>"
+DELE_SYNTAX = "-ERR syntax: DELE <msg>"
+TOP_SYNTAX = "-ERR syntax: TOP <msg> <lines>"
+TOP_FOLLOWS = "+OK top of message follows"
+OK = "+OK"
+CAPABILITIES = "+OK Capability list follows\r\nTOP\r\nUSER\r\nUIDL\r\nRESP-CODES\r\nPIPELINING\r\n."
+USER_ACCEPTED = "+OK User accepted"
+INVALID_USER = "-ERR Invalid username"
+MISSING_USER = "-ERR Missing username"
+PASSWORD_ACCEPTED = "+OK Password accepted"
+INVALID_CREDENTIALS = "-ERR Invalid username or password"
+MISSING_PASSWORD = "-ERR Missing password"
+COMMAND_UNRECOGNIZED = "-ERR Command unrecognized"
+TOO_MANY_SESSIONS_REPLY = "-ERR [SYS/TEMP] Too many connections, try again later"
+TOO_MANY_FROM_IP_REPLY = "-ERR [SYS/TEMP] Too many connections from your address"
+TIMED_OUT = "-ERR Timeout, closing connection"
+LINE_TOO_LONG = "-ERR Line too long"
+
+STATIC_REPLIES = (
+    GOODBYE, NOT_ALLOWED, UNRECOGNIZED, NO_SUCH_MESSAGE, RETR_SYNTAX, DELE_SYNTAX, TOP_SYNTAX, TOP_FOLLOWS, OK,
+    CAPABILITIES, USER_ACCEPTED, INVALID_USER, MISSING_USER, PASSWORD_ACCEPTED, INVALID_CREDENTIALS, MISSING_PASSWORD, COMMAND_UNRECOGNIZED,
+    TOO_MANY_SESSIONS_REPLY, TOO_MANY_FROM_IP_REPLY, TIMED_OUT, LINE_TOO_LONG,
+)
+
+# Replies to connections refused by admission control
+REJECTIONS = {TOO_MANY_SESSIONS: TOO_MANY_SESSIONS_REPLY, TOO_MANY_FROM_IP: TOO_MANY_FROM_IP_REPLY}
+
+class POP3Protocol(LineReceiver, TimeoutMixin):
+    """
+    POP3 command state machine.
+
+    States: 'AUTHORIZATION' until USER/PASS succeed, then 'TRANSACTION'. Every session
+    reads a mailbox shared through the factory, the packed sample emails or the
+    generated mailbox of the account; its own state is the set of messages it marked
+    as deleted. RETR and TOP stream the message with a MessageProducer.
+    """
+
+    # RFC 2449 limits commands to 255 octets; longer lines are junk and end the session
+    MAX_LENGTH = 1024
+
+    # State -> verb -> handler method; each handler takes the argument bytes and returns the
+    # reply, or a (status, chunks) pair for a message to stream
+    COMMANDS = {
+        'AUTHORIZATION': {
+            'USER': 'pop3_USER',
+            'PASS': 'pop3_PASS',
+            'CAPA': 'pop3_CAPA',
+            'QUIT': 'pop3_QUIT',
+        },
+        'TRANSACTION': {
+            'STAT': 'pop3_STAT',
+            'LIST': 'pop3_LIST',
+            'UIDL': 'pop3_UIDL',
+            'RETR': 'pop3_RETR',
+            'TOP': 'pop3_TOP',
+            'DELE': 'pop3_DELE',
+            'RSET': 'pop3_RSET',
+            'NOOP': 'pop3_NOOP',
+            'CAPA': 'pop3_CAPA',
+            'QUIT': 'pop3_QUIT',
+        },
+    }
+
+    def __init__(self, factory, debug=False):
+        self.factory = factory
         self.ip = None
-        self.responses = self.load_responses()
+        self.session = None
+        # Responses, the mailbox and their wire format are loaded once by the factory
+        self.responses = factory.responses
         self.state = 'AUTHORIZATION'
         self.user = None
         self.passwd = None
-        self.emails = self.load_raw_emails()
-        self.deleted_emails = set()
+        # The session only keeps which of the shared messages it marked as deleted
+        self.maildrop = factory.mailbox.session()
         self.debug = debug
-        logging.basicConfig(level=logging.DEBUG)
-
-        if self.debug:
-            
-            logger.debug(f"POP3Protocol initialized with {len(self.emails)} emails loaded.")
+        self.admitted = False
+        self.quitting = False
+        self._session_timer = None
+        self._producer = None
 
     def connectionMade(self):
-        self.ip = self.transport.getPeer().host
-        banner = self.responses.get("+OK", f"+OK {domain_name} {technology} POP3 server ready")
+        peer = self.transport.getPeer()
+        self.ip = peer.host
+        self.session = open_session('pop3', peer.host, getattr(peer, 'port', None))
         logger.info(f"Connection from {self.ip}")
-        self.sendLine(banner.encode('utf-8'))
-        log_interaction(self.ip, 'WELCOME', banner)
+        rejection = self.factory.admission.admit(self.ip)
+        if rejection is not None:
+            logger.info(f"Refused connection from {self.ip}: {rejection} session limit reached")
+            self.send(WELCOME, REJECTIONS[rejection])
+            self.transport.loseConnection()
+            return
+        self.admitted = True
+        admission = self.factory.admission
+        self.setTimeout(admission.idle_timeout or None)
+        if admission.session_timeout:
+            self._session_timer = self.callLater(admission.session_timeout, self._session_expired)
+        self.send(WELCOME, self.factory.banner)
+
+    def send(self, command, response):
+        """Write a reply, precompiled if it is a fixed one, and record the interaction."""
+        self.transport.write(self.factory.wire.get(response))
+        log_interaction(self.ip, command, response, session=self.session)
+
+    def connectionLost(self, reason):
+        self.setTimeout(None)
+        if self._session_timer is not None and self._session_timer.active():
+            self._session_timer.cancel()
+        self._session_timer = None
+        if self.admitted:
+            self.admitted = False
+            self.factory.admission.release(self.ip)
+        close_session(self.session)
+
+    def timeoutConnection(self):
+        self._close_timed_out(IDLE)
+
+    def _session_expired(self):
+        self._session_timer = None
+        self._close_timed_out(SESSION)
+
+    def _close_timed_out(self, kind):
+        logger.info(f"Closing {kind} timed out session from {self.ip}")
+        self.factory.admission.timed_out(kind)
+        if self._producer is not None:
+            # A reply written now would land inside the message body; cut the stream and close
+            self._producer.stopProducing()
+        else:
+            self.transport.write(self.factory.wire.get(TIMED_OUT))
+        self.transport.loseConnection()
+
+    def dataReceived(self, data):
+        self.resetTimeout()
+        LineReceiver.dataReceived(self, data)
 
     def lineReceived(self, line):
+        # The verb is matched on the raw bytes; arguments are decoded only where they are used
+        line = line.strip()
+        command = loggable(line)
+        verb, argument = split_command(line)
+        logger.info(f"Received command: {verb}")
+        handler = self.COMMANDS[self.state].get(verb)
+        if handler is not None:
+            response = getattr(self, handler)(argument)
+        elif verb in KNOWN_COMMANDS:
+            response = NOT_ALLOWED
+        else:
+            response = UNRECOGNIZED
+        if isinstance(response, tuple):
+            self.stream(command, *response)
+        else:
+            self.send(command, response)
+        if self.quitting:
+            self.transport.loseConnection()
+
+    def stream(self, command, status, chunks):
+        """
+        Send a multi-line response whose body is streamed from the mailbox.
+
+        Only the status line is logged. Commands pipelined behind this one are not read
+        until the whole response has been written, and the idle timeout is suspended
+        meanwhile since a client draining a large message is not idle.
+
+        Args:
+            command (str): The client line being answered.
+            status (str): The +OK line.
+            chunks (iterable): The message in chunks of bytes, not dot-stuffed.
+        """
+        self.send(command, status)
+        self.pauseProducing()
+        self.setTimeout(None)
+        self._producer = MessageProducer(self.transport, chunks)
+        d = self._producer.start()
+        d.addCallbacks(self._stream_sent, self._stream_failed)
+
+    def _stream_sent(self, sent):
+        self._producer = None
+        self.setTimeout(self.factory.admission.idle_timeout or None)
+        self.resumeProducing()
+
+    def _stream_failed(self, failure):
+        self._producer = None
+        logger.info(f"Message to {self.ip} not sent completely: {failure.getErrorMessage()}")
+        self.transport.loseConnection()
+
+    def lineLengthExceeded(self, line):
+        logger.info(f"Line of more than {self.MAX_LENGTH} bytes from {self.ip}, closing connection")
+        self.send(loggable(line), LINE_TOO_LONG)
+        self.transport.loseConnection()
+
+    def _message_chunks(self, number, lines=None):
+        # The session's headers, then the body (or its first lines) read from the mapped mailbox
+        mailbox = self.maildrop.mailbox
+        size = mailbox.top_size(number, lines) if lines is not None else None
+        return itertools.chain((self.maildrop.headers(number),), mailbox.chunks(number, self.factory.chunk_size, size))
+
+    def _message_number(self, argument):
+        # The number of a message that is not deleted, or None
+        try:
+            number = int(argument.split()[0])
+        except (IndexError, ValueError):
+            return None
+        return number if number in self.maildrop else None
+
+    def pop3_CAPA(self, argument):
+        return CAPABILITIES
+
+    def pop3_QUIT(self, argument):
+        # Deletions are never applied; the connection is closed once the reply is written
+        self.quitting = True
+        return GOODBYE
+
+    def pop3_NOOP(self, argument):
+        return OK
+
+    def pop3_STAT(self, argument):
+        num_messages, total_size = self.maildrop.stat()
+        return f"+OK {num_messages} {total_size}"
+
+    def pop3_LIST(self, argument):
+        if not argument:
+            return f"+OK maildrop follows\r\n{self.maildrop.listing()}."
+        msg_num = self._message_number(argument)
+        if msg_num is None:
+            return NO_SUCH_MESSAGE
+        return f"+OK {msg_num} {self.maildrop.size(msg_num)}"
+
+    def pop3_UIDL(self, argument):
+        if not argument:
+            return f"+OK unique-id listing follows\r\n{self.maildrop.uid_listing()}."
+        msg_num = self._message_number(argument)
+        if msg_num is None:
+            return NO_SUCH_MESSAGE
+        return f"+OK {msg_num} {self.maildrop.mailbox.uid(msg_num)}"
+
+    def pop3_RETR(self, argument):
+        if not argument:
+            return RETR_SYNTAX
+        msg_num = self._message_number(argument)
+        if msg_num is None:
+            return NO_SUCH_MESSAGE
+        # The announced size is the exact octet count of the message, before dot-stuffing
+        return f"+OK {self.maildrop.size(msg_num)} octets", self._message_chunks(msg_num)
+
+    def pop3_TOP(self, argument):
         try:
-            command = line.decode('utf-8').strip().upper()
-            logger.info(f"Received command: {command}")
-            if command == 'QUIT':
-                response = "+OK Goodbye"
-                self.sendLine(response.encode('utf-8'))
-                self.transport.loseConnection()
-                return
-            
-            if self.state == 'TRANSACTION':
-                response = self.handle_pop3_command(command)
-            elif self.state == 'AUTHORIZATION':
-                response = self.handle_authorization(command)
-            else:
-                response = "-ERR Command not allowed in this state"
-            if response:
-                self.sendLine(response.encode('utf-8'))
-                log_interaction(self.ip, command, response)
-        except UnicodeDecodeError as e:
-            logger.error(f"Unicode decode error: {e}")
-            self.sendLine(b"-ERR Command unrecognized")
+            msg_num, lines = (int(value) for value in argument.split()[:2])
+        except ValueError:
+            return TOP_SYNTAX
+        if lines < 0:
+            return TOP_SYNTAX
+        if msg_num not in self.maildrop:
+            return NO_SUCH_MESSAGE
+        return TOP_FOLLOWS, self._message_chunks(msg_num, lines)
+
+    def pop3_DELE(self, argument):
+        if not argument:
+            return DELE_SYNTAX
+        msg_num = self._message_number(argument)
+        if msg_num is None or not self.maildrop.delete(msg_num):
+            return NO_SUCH_MESSAGE
+        return f"+OK message {msg_num} deleted"
+
+    def pop3_RSET(self, argument):
+        self.maildrop.reset()
+        num_messages, total_size = self.maildrop.stat()
+        return f"+OK maildrop has {num_messages} messages ({total_size} octets)"
+
+    def pop3_USER(self, argument):
+        # User names are compared case-insensitively; passwords are kept exactly as sent
+        self.user = decode(argument.split(b' ')[0]).lower() if argument else None
+        if not self.user:
+            return MISSING_USER
+        logger.debug(f"USER command received. Entered user: {self.user}")
+        if config.get('server', 'anonymous_access', fallback='True') == 'False':
+            stored_username = config.get('server', 'username', fallback=None)
+            logger.debug(f"Stored username: {stored_username}")
+            if stored_username and stored_username == self.user:
+                return USER_ACCEPTED
+            return INVALID_USER
+        return USER_ACCEPTED
+
+    def pop3_PASS(self, argument):
+        # RFC 1939 lets the password contain spaces
+        self.passwd = decode(argument) if argument else None
+        if not self.passwd:
+            return MISSING_PASSWORD
+        stored_password = config.get('server', 'password', fallback=None)
+        logger.debug(f"Entered password: {self.passwd}")
+        logger.debug(f"Stored password (hashed): {stored_password}")
+        if config.get('server', 'anonymous_access', fallback='True') == 'True':
+            logger.debug("Anonymous access enabled; skipping password check.")
+            self._open_maildrop()
+            return PASSWORD_ACCEPTED
+        if stored_password and check_credentials(self.user, self.passwd):
+            logger.debug("PASS command received. Password verified. Moving to TRANSACTION state.")
+            self._open_maildrop()
+            return PASSWORD_ACCEPTED
+        logger.debug("PASS command received. Password incorrect.")
+        self.user = None
+        self.passwd = None
+        return INVALID_CREDENTIALS
+
+    def _open_maildrop(self):
+        self.maildrop = self.factory.mailbox_for(self.user).session()
+        self.state = 'TRANSACTION'
+
+# Verbs answered with "not allowed in this state" rather than "unrecognized" in the wrong state
+KNOWN_COMMANDS = {verb for commands in POP3Protocol.COMMANDS.values() for verb in commands}
+
+class POP3Factory(protocol.Factory):
+    def __init__(self, debug=False, tls=None):
+        self.debug = debug
+        # CertificateOptions of the implicit TLS listener (port 995), None without TLS
+        self.tls = tls
+        # RFC 1939 asks for an inactivity timer of at least 10 minutes
+        self.admission = AdmissionController.from_config(config, idle_timeout=600)
+        if self.debug:
+            logging.basicConfig(level=logging.DEBUG)
+        # Read once and shared by every connection
+        self.chunk_size = config.getint('pop3', 'chunk_size', fallback=CHUNK_SIZE)
+        self.responses = self.load_responses()
+        self.mailbox = self.load_mailbox()
+        # Accounts get generated mailboxes, built at login and kept in an LRU; dating them
+        # from the factory start keeps a rebuilt mailbox identical to the evicted one
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.generated_messages = config.getint('pop3', 'generated_messages', fallback=2500)
+        self.templates = self.load_templates() if self.generated_messages > 0 else []
+        self.message_cache = MessageCache(config.getint('pop3', 'message_cache', fallback=256))
+        self.max_mailboxes = config.getint('pop3', 'max_mailboxes', fallback=64)
+        self.mailboxes = OrderedDict()
+        self.banner = self.responses.get("+OK", f"+OK {domain_name} {technology} POP3 server ready")
+        self.wire = WireTable(STATIC_REPLIES + (self.banner,) + tuple(self.responses.values()))
+
+    def stopFactory(self):
+        logger.info(f"POP3 sessions: {self.admission.stats()}")
+        logger.info(f"POP3 generated messages: {self.message_cache.stats()}")
+
+    def buildProtocol(self, addr):
+        logger.debug(f"Building POP3 protocol with debug = {self.debug}")
+        return POP3Protocol(self, debug=self.debug)
 
     def load_responses(self):
         try:
@@ -107,114 +418,40 @@ class POP3Protocol(LineReceiver):
             "-ERR": "-ERR Default error response"
         }
 
-    def load_raw_emails(self):  
-        emails = {}
-        for i in range(1, 4):
-            filename = f'files/email_{i}_raw_response.txt'
-            if os.path.exists(filename):
-                with open(filename, 'r') as f:
-                    email_content = f.read()
-                    emails[i] = email_content
-                    logger.debug(f"Loaded email content from {filename}, length: {len(email_content)}")
-            else:
-                logger.warning(f"Email file {filename} not found.")
-        logger.debug(f"Total emails loaded: {len(emails)}")
-        return emails
-
-    def handle_pop3_command(self, command):
-        if command == 'STAT':
-            num_messages = len(self.emails) - len(self.deleted_emails)
-            total_size = sum(len(email) for i, email in self.emails.items() if i not in self.deleted_emails)
-            return f"+OK {num_messages} {total_size}"
-        elif command == 'LIST':
-            response = "+OK maildrop follows\n"
-            for i, email in self.emails.items():
-                if i not in self.deleted_emails:
-                    response += f"{i} {len(email)}\n"
-            response += "."
-            return response
-        elif command.startswith('RETR'):
-            try:
-                msg_num = int(command.split()[1])
-                if msg_num in self.emails and msg_num not in self.deleted_emails:
-                    email_body = self.emails[msg_num]
-                    headers = generate_email_headers(email_body)
-                    email_content = headers + "\n" + email_body
-                    return f"+OK {len(email_content)} octets\n{email_content}"
-                else:
-                    return "-ERR no such message"
-            except (IndexError, ValueError):
-                return "-ERR syntax: RETR <msg>"
-        elif command.startswith('DELE'):
-            try:
-                msg_num = int(command.split()[1])
-                if msg_num in self.emails:
-                    self.deleted_emails.add(msg_num)
-                    return f"+OK message {msg_num} deleted"
-                else:
-                    return "-ERR no such message"
-            except (IndexError, ValueError):
-                return "-ERR syntax: DELE <msg>"
-        elif command == 'QUIT':
-            response = self.responses.get("QUIT", "+OK Goodbye")
-            self.sendLine(response.encode('utf-8'))
-            self.transport.loseConnection()
-            return None
-        else:
-            return "-ERR Unrecognized command"
-
-    def handle_authorization(self, command):
-        command = command.upper()
-        if command.startswith('USER'):
-            self.user = command.split(' ')[1].lower() if len(command.split(' ')) > 1 else None
-            
-            if self.user:
-                logger.debug(f"USER command received. Entered user: {self.user}")
-                if config.get('server', 'anonymous_access', fallback='True') == 'False':
-                    stored_username = config.get('server', 'username', fallback=None)
-                    
-                    logger.debug(f"Stored username: {stored_username}")
-                    if stored_username and stored_username == self.user:
-                        return "+OK User accepted"
-                    else:
-                        return "-ERR Invalid username"
-                return "+OK User accepted"
-            else:
-                return "-ERR Missing username"
-
-        elif command.startswith('PASS'):
-            self.passwd = command.split(' ')[1].lower() if len(command.split(' ')) > 1 else None
-            if self.passwd:
-                stored_password = config.get('server', 'password', fallback=None)
-                logger.debug(f"Entered password: {self.passwd}")
-                logger.debug(f"Stored password (hashed): {stored_password}")
-                if config.get('server', 'anonymous_access', fallback='True') == 'True':
-                    logger.debug("Anonymous access enabled; skipping password check.")
-                    self.state = 'TRANSACTION'
-                    return "+OK Password accepted"
-                elif stored_password and check_credentials(self.user, self.passwd):
-                    logger.debug("PASS command received. Password verified. Moving to TRANSACTION state.")
-                    self.state = 'TRANSACTION'
-                    return "+OK Password accepted"
-                else:
-                    logger.debug("PASS command received. Password incorrect.")
-                    self.user = None
-                    self.passwd = None
-                    return "-ERR Invalid username or password"
-            else:
-                return "-ERR Missing password"
-
-        else:
-            return "-ERR Unrecognized command"
+    def load_mailbox(self):
+        # The sample emails are packed into one memory-mapped file shared by every session
+        filenames = [f'files/email_{i}_raw_response.txt' for i in range(1, 4)]
+        path = config.get('pop3', 'mailbox_file', fallback='files/pop3_mailbox.pack')
+        try:
+            mailbox = Mailbox.from_files(filenames, path, SessionHeaders(domain_name))
+        except OSError as e:
+            logger.error(f"Error packing the POP3 mailbox into {path}: {e}")
+            mailbox = Mailbox(path, [], SessionHeaders(domain_name))
+        logger.debug(f"Total emails loaded: {len(mailbox)}")
+        return mailbox
 
-class POP3Factory(protocol.Factory):
-    def __init__(self, debug=False):
-        self.debug = debug
+    def load_templates(self):
+        # The sample emails of the deployment, or the offline ones if there are none
+        patterns = config.get('pop3', 'templates', fallback='files/email*_raw_response.txt')
+        templates = Template.load(pattern.strip() for pattern in patterns.split(',') if pattern.strip())
+        if not templates:
+            templates = Template.load(['var/no_ai/email*_raw_response.txt'])
+        if not templates:
+            logger.warning("No email templates found; accounts are served the sample emails.")
+        logger.debug(f"Loaded {len(templates)} email templates")
+        return templates
 
-    def buildProtocol(self, addr):
-        print("Building POP3 protocol with debug =", self.debug)
-        if self.debug:
-            logging.basicConfig(level=logging.DEBUG)
-        return POP3Protocol(debug=self.debug)
-    
-    # Ensure to add a final newline at the end of the file
\ No newline at end of file
+    def mailbox_for(self, user):
+        # The account's generated mailbox; the packed sample emails if generation is off
+        if self.generated_messages <= 0 or not self.templates:
+            return self.mailbox
+        mailbox = self.mailboxes.get(user)
+        if mailbox is None:
+            mailbox = GeneratedMailbox.for_account(self.templates, user, domain_name, self.generated_messages,
+                                                   now=self.started, cache=self.message_cache)
+            self.mailboxes[user] = mailbox
+            while len(self.mailboxes) > self.max_mailboxes:
+                self.mailboxes.popitem(last=False)
+        else:
+            self.mailboxes.move_to_end(user)
+        return mailbox
@@ -18,6 +18,7 @@
 # For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
 #
 
+import hashlib
 import logging
 import os
 import json
@@ -25,11 +26,14 @@ import random
 import string
 import datetime
 import configparser
+import sinks
 
 logger = logging.getLogger(__name__)
 
+# Load the config.ini file
+config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'etc', 'config.ini'))
 config = configparser.ConfigParser()
-config.read('config.ini')
+config.read(config_file_path)
 domain_name = config.get('server', 'domain', fallback='localhost')
 
 def load_emails():
@@ -107,18 +111,73 @@ def generate_email_headers(email_body):
     )
     return headers
 
+# Characters of the random tokens in generated headers
+TOKEN_ALPHABET = string.ascii_letters + string.digits
+
+class SessionHeaders:
+    """
+    Synthetic headers prepended to the messages served over POP3.
+
+    Unlike generate_email_headers(), the values are derived from a per-session seed and
+    the message number with BLAKE2b, so a client sees the same headers every time it
+    retrieves a message within a session, and different ones in the next session.
+    Every field has a fixed width, so the header block of any message is exactly `size`
+    octets and message sizes can be computed before any session exists.
+    """
+
+    def __init__(self, domain=domain_name):
+        """
+        Initialize the generator.
+
+        Args:
+            domain (str): The domain named in the Received and Message-ID headers.
+        """
+        self.domain = domain
+        self.size = len(self.render(bytes(16), 1, datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)))
+
+    def render(self, seed, number, now):
+        """
+        Return the header block of a message, ended by the blank line before the body.
+
+        Args:
+            seed (bytes): The session's seed, at most 64 bytes.
+            number (int): The message number.
+            now (datetime): The session start time, in UTC.
+
+        Returns:
+            bytes: The headers with CRLF line endings.
+        """
+        digest = hashlib.blake2b(number.to_bytes(8, 'big'), key=seed, digest_size=32).digest()
+        # Three-digit octets keep the address, and so the header size, a fixed width
+        ip = '.'.join(str(100 + b % 155) for b in digest[:4])
+        message_id = f"{1000000000 + int.from_bytes(digest[4:9], 'big') % 9000000000}.{_token(digest[9:14])}"
+        date = now - datetime.timedelta(hours=5 + digest[24] % 4, minutes=digest[25] % 60, seconds=digest[26] % 60)
+        return (
+            f"Received: from {ip} by {self.domain} (SMTPD) id {_token(digest[14:24])}\r\n"
+            f"Message-ID: <{message_id}@{self.domain}>\r\n"
+            f"Date: {date.strftime('%a, %d %b %Y %H:%M:%S')} +0000\r\n"
+            f"From: unknown@domain.com\r\n"
+            f"To: recipient@domain.com\r\n"
+            f"Subject: No Subject\r\n"
+            f"\r\n"
+        ).encode('utf-8')
+
+def _token(data):
+    return ''.join(TOKEN_ALPHABET[b % len(TOKEN_ALPHABET)] for b in data)
+
 def log_interaction(ip, command, response):
     """
     Log interactions between the client and the server.
 
-    This function logs the IP address of the client, the command sent, and the server's response.
+    This function passes the IP address of the client, the command sent, and the server's
+    response to the configured event sinks; enable the 'logging' sink to see them in the log.
 
     Args:
         ip (str): The IP address of the client.
         command (str): The command issued by the client.
         response (str): The response from the server.
     """
-    logger.info(f"IP: {ip}, Command: {command}, Response: {response}")
+    sinks.log_interaction(ip, command, response)
 
 def format_responses(responses):
     """
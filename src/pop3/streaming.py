@@ -0,0 +1,146 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+"""
+This module streams multi-line POP3 responses from the mailbox to the transport.
+
+RETR and TOP send messages through a MessageProducer: the body is read from the
+mapped mailbox in fixed-size chunks, dot-stuffed as it goes and written only while
+the transport accepts more data, so a retrieval holds at most a chunk plus the
+transport's write buffer in memory whatever the size of the message.
+"""
+
+import logging
+from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the mailbox per write
+CHUNK_SIZE = 16384
+
+class DotStuffer:
+    """
+    Incremental RFC 1939 dot-stuffing of data split into arbitrary chunks.
+
+    A '.' is prepended to every line that starts with one, including lines whose CRLF
+    and leading dot fall in different chunks.
+    """
+
+    def __init__(self):
+        self.line_start = True
+        self._cr = False
+
+    def feed(self, chunk):
+        """
+        Stuff the next chunk.
+
+        Args:
+            chunk (bytes): The next bytes of the message.
+
+        Returns:
+            bytes: The chunk as sent.
+        """
+        if not chunk:
+            return chunk
+        if self.line_start and chunk[:1] == b'.':
+            chunk = b'.' + chunk
+        elif self._cr and chunk[:2] == b'\n.':
+            chunk = b'\n..' + chunk[2:]
+        chunk = chunk.replace(b'\r\n.', b'\r\n..')
+        self.line_start = chunk.endswith(b'\r\n') or (self._cr and chunk == b'\n')
+        self._cr = chunk.endswith(b'\r')
+        return chunk
+
+@implementer(IPushProducer)
+class MessageProducer:
+    """
+    Writes a message to a consumer as a dot-stuffed multi-line response.
+
+    The producer writes chunks while the consumer has not paused it; Twisted transports
+    pause a registered streaming producer as soon as their write buffer is full and
+    resume it once the buffer drains. The final '.' line is written after the last
+    chunk, preceded by a CRLF if the data did not end with one.
+    """
+
+    def __init__(self, consumer, chunks):
+        """
+        Initialize the producer.
+
+        Args:
+            consumer: The transport to write to.
+            chunks (iterable): The message in chunks of bytes, not dot-stuffed.
+        """
+        self.consumer = consumer
+        self.chunks = iter(chunks)
+        self.stuffer = DotStuffer()
+        self.paused = False
+        self.sent = 0
+        self.deferred = None
+
+    def start(self):
+        """
+        Register with the consumer and start writing.
+
+        Returns:
+            Deferred: Fires with the number of bytes sent once the response is complete,
+                or fails if the message could not be read or the connection was lost.
+        """
+        deferred = self.deferred = defer.Deferred()
+        self.consumer.registerProducer(self, True)
+        self.resumeProducing()
+        return deferred
+
+    def resumeProducing(self):
+        self.paused = False
+        while not self.paused and self.deferred is not None:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self._finish()
+                return
+            except Exception as e:
+                logger.error(f"Error reading message: {e}")
+                # A terminated response would pass a truncated message off as complete
+                self._finish(e, write=False)
+                return
+            data = self.stuffer.feed(chunk)
+            self.sent += len(data)
+            self.consumer.write(data)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def stopProducing(self):
+        # The connection is gone; nothing more can be written
+        self._finish(ConnectionError("Connection lost while sending message"), write=False)
+
+    def _finish(self, error=None, write=True):
+        deferred, self.deferred = self.deferred, None
+        if deferred is None:
+            return
+        if write:
+            self.consumer.write(b'.\r\n' if self.stuffer.line_start else b'\r\n.\r\n')
+        self.consumer.unregisterProducer()
+        if error is None:
+            deferred.callback(self.sent)
+        else:
+            deferred.errback(error)
@@ -0,0 +1,207 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This package fans interaction events out to the configured sinks.
+
+The listeners call open_session(), log_interaction() and close_session() here; every
+sink enabled in the [sinks] section of config.ini receives each event, so logging can
+go to SQLite, to JSON Lines files, to the application log, or to several at once.
+"""
+
+import configparser
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from database import Session, WELCOME
+from sinks.base import EventSink, INTERACTION_FIELDS
+from sinks.jsonl_sink import JSONLSink
+from sinks.log_sink import LogSink
+from sinks.sqlite_sink import SQLiteSink
+
+logger = logging.getLogger(__name__)
+
+# Load the config.ini file
+config_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'etc', 'config.ini'))
+config = configparser.ConfigParser()
+config.read(config_file_path)
+
+# Sink name in config.ini -> class
+SINKS = {sink.name: sink for sink in (SQLiteSink, JSONLSink, LogSink)}
+
+_sinks = None
+_session_ids = None
+# Set by shutdown_sinks() so late events cannot rebuild the sinks and their writers
+_closed = False
+_lock = threading.Lock()
+
+def get_sinks():
+    """
+    Return the active sinks, building them from the [sinks] section of config.ini on first use.
+
+    Returns:
+        list: EventSink instances, in the configured order.
+
+    Raises:
+        ValueError: If an unknown sink is enabled.
+        RuntimeError: If the sinks have been shut down; set_sinks() replaces them.
+    """
+    global _sinks
+    with _lock:
+        if _closed:
+            raise RuntimeError("The sinks have been shut down")
+        if _sinks is None:
+            names = [name.strip() for name in config.get('sinks', 'enabled', fallback='sqlite').split(',')]
+            unknown = [name for name in names if name and name not in SINKS]
+            if unknown:
+                raise ValueError(f"Unknown sinks {unknown}, expected some of {list(SINKS)}")
+            _sinks = [SINKS[name].from_config(config) for name in names if name]
+            logger.info(f"Logging interactions to {', '.join(sink.name for sink in _sinks)}")
+        return _sinks
+
+def set_sinks(sinks):
+    """
+    Replace the active sinks, closing the previous ones.
+
+    Args:
+        sinks (list): EventSink instances to use from now on.
+    """
+    global _sinks, _session_ids, _closed
+    shutdown_sinks()
+    with _lock:
+        _sinks = list(sinks)
+        _session_ids = None
+        _closed = False
+
+def shutdown_sinks():
+    """
+    Flush and close every active sink.
+
+    Registered as a reactor shutdown trigger so nothing queued is lost on exit. Events
+    logged afterwards are refused rather than reopening the sinks.
+    """
+    global _sinks, _session_ids, _closed
+    with _lock:
+        sinks, _sinks = _sinks, None
+        _session_ids = None
+        _closed = True
+    for sink in sinks or ():
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error(f"Error closing the {sink.name} sink: {e}")
+
+def sink_stats():
+    """
+    Return the counters of every active sink.
+
+    Returns:
+        dict: Sink name -> that sink's stats().
+    """
+    return {sink.name: sink.stats() for sink in _sinks or ()}
+
+def _next_session_id(sinks):
+    global _session_ids
+    for sink in sinks:
+        session_id = sink.next_session_id()
+        if session_id is not None:
+            return session_id
+    # Without a sink keeping a sequence, millisecond timestamps keep ids unique across restarts
+    with _lock:
+        if _session_ids is None:
+            _session_ids = itertools.count(int(time.time() * 1000))
+        return next(_session_ids)
+
+def _dispatch(sinks, method, *args):
+    # A failing sink must never break the listener or starve the other sinks
+    for sink in sinks:
+        try:
+            getattr(sink, method)(*args)
+        except Exception as e:
+            logger.error(f"The {sink.name} sink failed in {method}: {e}")
+
+def open_session(protocol, ip, port=None):
+    """
+    Record a new client connection in every sink.
+
+    Args:
+        protocol (str): 'smtp' or 'pop3'.
+        ip (str): Peer IP address.
+        port (int): Peer source port.
+
+    Returns:
+        Session: The session to pass to log_interaction() and close_session().
+    """
+    sinks = get_sinks()
+    session = Session(_next_session_id(sinks), protocol, ip, port, datetime.now().isoformat())
+    _dispatch(sinks, 'open_session', session)
+    return session
+
+def log_interaction(ip, command, response, session=None):
+    """
+    Record one interaction in every sink.
+
+    Args:
+        ip (str): The IP address of the entity interacting with the honeypot.
+        command (str): The command issued by the entity.
+        response (str): The response provided by the honeypot.
+        session (Session): The session the interaction belongs to, if known.
+    """
+    ts = datetime.now().isoformat()
+    if session is None:
+        record = (None, 0, None, ip, ts, command, response)
+    else:
+        record = (session.id, session.record(command, response), session.protocol, ip, ts, command, response)
+    _dispatch(get_sinks(), 'log_interaction', record)
+
+def log_batch(ip, interactions, session=None):
+    """
+    Record several interactions of one client in every sink with a single call per sink.
+
+    Args:
+        ip (str): The IP address of the entity interacting with the honeypot.
+        interactions (iterable): (command, response) pairs in the order they happened.
+        session (Session): The session the interactions belong to, if known.
+    """
+    ts = datetime.now().isoformat()
+    if session is None:
+        records = [(None, 0, None, ip, ts, command, response) for command, response in interactions]
+    else:
+        records = [(session.id, session.record(command, response), session.protocol, ip, ts, command, response)
+                   for command, response in interactions]
+    if records:
+        _dispatch(get_sinks(), 'log_batch', records)
+
+def close_session(session):
+    """
+    Record the end of a client connection in every sink.
+
+    Args:
+        session (Session): The session returned by open_session(); closing twice is a no-op.
+    """
+    if session is None or session.closed:
+        return
+    session.closed = True
+    _dispatch(get_sinks(), 'close_session', session, datetime.now().isoformat())
@@ -0,0 +1,114 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module defines the interface implemented by every interaction event sink.
+
+Sinks receive three kinds of events: a session opening, interactions within it,
+and the session closing with its counters. Interactions are passed as plain tuples
+in INTERACTION_FIELDS order so a sink can queue them without copying.
+"""
+
+# Fields of an interaction record handed to EventSink.log_interaction()
+INTERACTION_FIELDS = ('session_id', 'seq', 'protocol', 'ip', 'ts', 'command', 'response')
+
+class EventSink:
+    """
+    Base class of the destinations interaction events are written to.
+
+    Sinks are called from the reactor thread, so they must not block; slow work
+    belongs on a writer thread. Every method except log_interaction() is optional.
+
+    Attributes:
+        name (str): Name the sink is enabled by in the [sinks] section of config.ini.
+    """
+
+    name = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the sink from the loaded configuration.
+
+        Args:
+            config (ConfigParser): The loaded configuration.
+
+        Returns:
+            EventSink: The configured sink.
+        """
+        return cls()
+
+    def next_session_id(self):
+        """
+        Allocate a session id, for sinks that keep their own id sequence.
+
+        Returns:
+            int: A new session id, or None to let another sink or the clock decide.
+        """
+        return None
+
+    def open_session(self, session):
+        """
+        Record a new client connection.
+
+        Args:
+            session (Session): The new session; only its identity fields are final.
+        """
+
+    def log_interaction(self, record):
+        """
+        Record one interaction.
+
+        Args:
+            record (tuple): Values in INTERACTION_FIELDS order.
+        """
+        raise NotImplementedError
+
+    def log_batch(self, records):
+        """
+        Record several interactions at once.
+
+        Args:
+            records (list): Tuples in INTERACTION_FIELDS order.
+        """
+        for record in records:
+            self.log_interaction(record)
+
+    def close_session(self, session, ts):
+        """
+        Record the end of a client connection.
+
+        Args:
+            session (Session): The session with its final counters.
+            ts (str): ISO timestamp of the disconnection.
+        """
+
+    def stats(self):
+        """
+        Return the sink's counters.
+
+        Returns:
+            dict: Sink-specific counters, empty by default.
+        """
+        return {}
+
+    def close(self):
+        """Flush everything pending and release the sink's resources."""
@@ -0,0 +1,205 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module provides an append-only JSON Lines sink for high connection rates.
+
+Events are queued in memory and written by a background thread in large buffered
+writes, with fsync batched on an interval. When the file reaches its size limit it
+is renamed with a timestamp and compressed with gzip off the writer thread, so the
+files can be loaded into analytics later without slowing down logging.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from db.writer import InteractionWriter
+from sinks.base import EventSink
+
+logger = logging.getLogger(__name__)
+
+OPEN, INTERACTION, CLOSE = 'open', 'interaction', 'close'
+
+def _json_default(value):
+    # Raw command bytes that were not valid UTF-8 keep their bytes as escaped surrogates
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'surrogateescape')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _event(item):
+    kind = item[0]
+    if kind == INTERACTION:
+        _, session_id, seq, protocol, ip, ts, command, response = item
+        return {'event': kind, 'ts': ts, 'session': session_id, 'seq': seq, 'protocol': protocol, 'ip': ip,
+                'command': command, 'response': response}
+    if kind == OPEN:
+        _, session_id, protocol, ip, port, ts = item
+        return {'event': kind, 'ts': ts, 'session': session_id, 'protocol': protocol, 'ip': ip, 'port': port}
+    _, ts, session_id, commands, bytes_in, bytes_out = item
+    return {'event': kind, 'ts': ts, 'session': session_id, 'commands': commands, 'bytes_in': bytes_in,
+            'bytes_out': bytes_out}
+
+def _compress(path):
+    try:
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.remove(path)
+    except OSError as e:
+        logger.error(f"Failed to compress {path}: {e}")
+
+class JSONLSink(EventSink):
+    """
+    Append one JSON object per event to a size-rotated file.
+
+    Attributes:
+        path (str): Path of the active file.
+        max_bytes (int): Size at which the file is rotated, 0 for no limit.
+        compress (bool): Gzip rotated files.
+        fsync_interval (float): Minimum seconds between fsync calls, 0 to fsync every batch.
+        rotations (int): Number of files rotated since the sink was created.
+    """
+
+    name = 'jsonl'
+
+    def __init__(self, path='logs/interactions.jsonl', max_bytes=100 * 1024 * 1024, compress=True,
+                 fsync_interval=1.0, batch_size=1000, flush_interval=0.2, max_queue=100000,
+                 overflow='drop_newest'):
+        """
+        Open the file for appending and start the writer thread.
+
+        Args:
+            path (str): Path of the active file; its directory is created if needed.
+            max_bytes (int): Size at which the file is rotated, 0 for no limit.
+            compress (bool): Gzip rotated files.
+            fsync_interval (float): Minimum seconds between fsync calls, 0 to fsync every batch.
+            batch_size (int): Maximum events per write.
+            flush_interval (float): Maximum seconds an event waits in memory.
+            max_queue (int): Events buffered before the overflow policy applies.
+            overflow (str): Overflow policy of the underlying InteractionWriter.
+        """
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.compress = compress
+        self.fsync_interval = float(fsync_interval)
+        self.rotations = 0
+        self._compressors = []
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'ab', buffering=1024 * 1024)
+        self._size = self._file.tell()
+        self._last_sync = time.monotonic()
+        if compress:
+            # Finish rotated files left uncompressed by an earlier run
+            stem, ext = os.path.splitext(path)
+            for leftover in glob.glob(f'{glob.escape(stem)}-*{ext}'):
+                self._compress_later(leftover)
+        self._writer = InteractionWriter(self._flush, batch_size=batch_size, flush_interval=flush_interval,
+                                         max_queue=max_queue, overflow=overflow, name='jsonl-writer')
+        self._writer.start()
+
+    @classmethod
+    def from_config(cls, config, section='jsonl'):
+        """
+        Build the sink from the [jsonl] section of the configuration.
+
+        Args:
+            config (ConfigParser): The loaded configuration.
+            section (str): Section holding the sink settings.
+
+        Returns:
+            JSONLSink: The configured sink.
+        """
+        return cls(
+            config.get(section, 'path', fallback='logs/interactions.jsonl'),
+            max_bytes=config.getint(section, 'max_mb', fallback=100) * 1024 * 1024,
+            compress=config.getboolean(section, 'compress', fallback=True),
+            fsync_interval=config.getfloat(section, 'fsync_interval', fallback=1.0),
+            batch_size=config.getint(section, 'batch_size', fallback=1000),
+            flush_interval=config.getfloat(section, 'flush_interval', fallback=0.2),
+            max_queue=config.getint(section, 'queue_size', fallback=100000),
+            overflow=config.get(section, 'overflow', fallback='drop_newest'),
+        )
+
+    def open_session(self, session):
+        self._writer.put((OPEN, session.id, session.protocol, session.ip, session.port, session.start_ts))
+
+    def log_interaction(self, record):
+        self._writer.put((INTERACTION,) + record)
+
+    def log_batch(self, records):
+        self._writer.put_many([(INTERACTION,) + record for record in records])
+
+    def close_session(self, session, ts):
+        self._writer.put((CLOSE, ts, session.id, session.command_count, session.bytes_in, session.bytes_out))
+
+    def _flush(self, batch):
+        data = ''.join(json.dumps(_event(item), default=_json_default) + '\n' for item in batch).encode('utf-8')
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        now = time.monotonic()
+        if now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+        if self.max_bytes and self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        os.fsync(self._file.fileno())
+        self._file.close()
+        stem, ext = os.path.splitext(self.path)
+        rotated = f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{self.rotations}{ext}"
+        os.replace(self.path, rotated)
+        self._file = open(self.path, 'ab', buffering=1024 * 1024)
+        self._size = 0
+        self.rotations += 1
+        logger.info(f"Rotated {self.path} to {rotated}")
+        if self.compress:
+            self._compress_later(rotated)
+
+    def _compress_later(self, path):
+        thread = threading.Thread(target=_compress, args=(path,), name='jsonl-compress', daemon=True)
+        thread.start()
+        self._compressors = [t for t in self._compressors if t.is_alive()] + [thread]
+
+    def stats(self):
+        stats = self._writer.stats()
+        stats.update({'bytes': self._size, 'rotations': self.rotations})
+        return stats
+
+    def close(self):
+        """Write every queued event, fsync the file and wait for pending compressions."""
+        self._writer.stop()
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        for thread in self._compressors:
+            thread.join()
+        self._compressors = []
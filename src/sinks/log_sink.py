@@ -0,0 +1,44 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module provides the sink that writes interactions to the application log.
+"""
+
+import logging
+
+from sinks.base import EventSink
+
+logger = logging.getLogger(__name__)
+
+class LogSink(EventSink):
+    """Write every interaction to the application log, e.g. for debugging a deployment."""
+
+    name = 'logging'
+
+    def open_session(self, session):
+        logger.debug(f"Session {session.id} opened: {session.protocol} from {session.ip}:{session.port}")
+
+    def log_interaction(self, record):
+        logger.info(f"IP: {record[3]}, Command: {record[5]}, Response: {record[6]}")
+
+    def close_session(self, session, ts):
+        logger.debug(f"Session {session.id} closed after {session.command_count} commands")
@@ -0,0 +1,59 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module provides the sink that stores interactions in the sharded SQLite database.
+"""
+
+import database
+from sinks.base import EventSink
+
+class SQLiteSink(EventSink):
+    """
+    Queue events for the database layer's write-behind writer.
+
+    Session ids come from the catalog, so they stay unique across restarts.
+    """
+
+    name = 'sqlite'
+
+    def next_session_id(self):
+        return database.next_session_id()
+
+    def open_session(self, session):
+        database.get_writer().put((database.OPEN, session.id, session.protocol, session.ip, session.port,
+                                   session.start_ts))
+
+    def log_interaction(self, record):
+        database.get_writer().put((database.INTERACTION,) + record)
+
+    def log_batch(self, records):
+        database.get_writer().put_many([(database.INTERACTION,) + record for record in records])
+
+    def close_session(self, session, ts):
+        database.get_writer().put((database.CLOSE, ts, session.command_count, session.bytes_in,
+                                   session.bytes_out, session.id))
+
+    def stats(self):
+        return database.writer_stats()
+
+    def close(self):
+        database.shutdown_database()
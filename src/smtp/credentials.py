@@ -0,0 +1,170 @@
+# src/smtp/credentials.py
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """
+    Compact set of byte strings that may report false positives but never false negatives.
+
+    The bit array is sized for capacity keys at error_rate; past capacity the false
+    positive rate grows but membership of added keys stays exact. The bit positions of a
+    key are derived from a single BLAKE2b digest by double hashing.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError(f"Invalid Bloom filter capacity {capacity} or error rate {error_rate}")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        """
+        Add a key.
+
+        Returns:
+            bool: True if the key was certainly not in the filter before.
+        """
+        bits = self.bits
+        added = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __len__(self):
+        return self.count
+
+def _key(username, password):
+    # Length-prefixed so no (username, password) split of the same bytes collides
+    username = username if isinstance(username, bytes) else username.encode('utf-8', 'surrogateescape')
+    password = password if isinstance(password, bytes) else password.encode('utf-8', 'surrogateescape')
+    return len(username).to_bytes(4, 'big') + username + password
+
+class CredentialStore:
+    """
+    Deduplicating front of the credentials table.
+
+    A (username, password) pair the Bloom filter has never seen is written at once. Later
+    attempts with a pair still in the LRU of recently seen pairs are only counted there,
+    and the counts are written as one upsert per pair when the pair is evicted or on
+    flush(). A dictionary attack replaying the same pairs from many sources therefore
+    costs a few writes per pair instead of one per attempt. A Bloom false positive only
+    delays the first write of a pair until its next flush; nothing is lost.
+
+    Rows are handed to write(rows) as
+    (username, password, mechanism, ip, count, first_ts, last_ts) tuples.
+    """
+
+    def __init__(self, write, max_cached=10000, capacity=1000000, error_rate=0.01, clock=None):
+        self.write = write
+        self.max_cached = max_cached
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.clock = clock or (lambda: datetime.now().isoformat())
+        # (username, password) -> [pending count, first pending ts, last ts, ip, mechanism]
+        self.cache = OrderedDict()
+        self.attempts = 0
+        self.written = 0
+
+    @classmethod
+    def from_config(cls, write, config, section='smtp'):
+        return cls(
+            write,
+            max_cached=config.getint(section, 'credential_cache', fallback=10000),
+            capacity=config.getint(section, 'credential_bloom_capacity', fallback=1000000),
+        )
+
+    def record(self, username, password, mechanism=None, ip=None):
+        """
+        Count an authentication attempt.
+
+        Args:
+            username (str or bytes): The user name sent; bytes if it was not valid UTF-8.
+            password (str or bytes): The password sent; missing passwords are recorded as ''.
+            mechanism (str): The SASL mechanism, e.g. 'LOGIN' or 'PLAIN'.
+            ip (str): Peer IP address.
+
+        Returns:
+            bool: True if the pair was new and written immediately.
+        """
+        self.attempts += 1
+        username = '' if username is None else username
+        password = '' if password is None else password
+        now = self.clock()
+        pair = (username, password)
+        entry = self.cache.get(pair)
+        if entry is not None:
+            self.cache.move_to_end(pair)
+            if not entry[0]:
+                entry[1] = now
+            entry[0] += 1
+            entry[2], entry[3], entry[4] = now, ip, mechanism
+            return False
+        new = self.bloom.add(_key(username, password))
+        if new:
+            self._write([(username, password, mechanism, ip, 1, now, now)])
+            self.cache[pair] = [0, None, now, ip, mechanism]
+        else:
+            self.cache[pair] = [1, now, now, ip, mechanism]
+        if len(self.cache) > self.max_cached:
+            evicted, entry = self.cache.popitem(last=False)
+            if entry[0]:
+                self._write([_row(evicted, entry)])
+        return new
+
+    def flush(self):
+        """
+        Write the attempts counted since the last flush.
+
+        Returns:
+            int: Number of rows written.
+        """
+        rows = []
+        for pair, entry in self.cache.items():
+            if entry[0]:
+                rows.append(_row(pair, entry))
+                entry[0], entry[1] = 0, None
+        if rows:
+            self._write(rows)
+        return len(rows)
+
+    def _write(self, rows):
+        try:
+            self.write(rows)
+            self.written += len(rows)
+        except Exception as e:
+            logger.error(f"Error recording {len(rows)} credentials: {e}")
+
+    @property
+    def pending(self):
+        return sum(entry[0] for entry in self.cache.values())
+
+    def stats(self):
+        return {'attempts': self.attempts, 'written': self.written, 'cached': len(self.cache),
+                'pending': self.pending, 'known': len(self.bloom)}
+
+def _row(pair, entry):
+    pending, first_ts, last_ts, ip, mechanism = entry
+    return (pair[0], pair[1], mechanism, ip, pending, first_ts, last_ts)
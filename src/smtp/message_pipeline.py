@@ -0,0 +1,176 @@
+# src/smtp/message_pipeline.py
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import task, threads
+from smtp.mime_parser import parse_message
+
+logger = logging.getLogger(__name__)
+
+# Parse latencies kept for the percentiles reported by stats()
+LATENCY_SAMPLES = 1000
+
+class MessagePipeline:
+    """
+    Parses captured messages in a pool of worker processes, off the reactor thread.
+
+    At most max_pending messages are queued or being parsed at any time. A message that
+    arrives while the pool is full is not queued: it stays 'pending' in the catalog and
+    sweep() submits it once there is room, so a flood of spam delays parsing instead of
+    growing memory or stalling the listener.
+
+    Results are handed to on_result(digest, result, error) on the executor's callback
+    thread; backlog(limit) returns (digest, path) pairs of messages still waiting to be parsed.
+    """
+
+    def __init__(self, attachment_dir, on_result, backlog=None, workers=2, max_pending=64):
+        self.attachment_dir = attachment_dir
+        self.on_result = on_result
+        self.backlog = backlog
+        self.workers = workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.parsed = 0
+        self.failed = 0
+        self.deferred = 0
+        self._in_flight = set()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._parse_times = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._loop = None
+
+    @property
+    def pending(self):
+        return len(self._in_flight)
+
+    def submit(self, digest, path):
+        """
+        Queue a stored message for parsing unless the pool is saturated.
+
+        Args:
+            digest (str): SHA-256 of the message.
+            path (str): The message file.
+
+        Returns:
+            bool: True if the message was queued, False if it is left for a later sweep.
+        """
+        with self._lock:
+            if digest in self._in_flight:
+                return True
+            if len(self._in_flight) >= self.max_pending:
+                self.deferred += 1
+                return False
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._in_flight.add(digest)
+            self.submitted += 1
+            future = self._executor.submit(parse_message, path, self.attachment_dir)
+        started = time.perf_counter()
+        future.add_done_callback(lambda f: self._done(digest, started, f))
+        return True
+
+    def _done(self, digest, started, future):
+        result, error = None, None
+        try:
+            result = future.result()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Error parsing message {digest}: {error}")
+        with self._lock:
+            self._in_flight.discard(digest)
+            self._latencies.append((time.perf_counter() - started) * 1000)
+            if result is None:
+                self.failed += 1
+            else:
+                self.parsed += 1
+                self._parse_times.append(result['parse_ms'])
+        try:
+            self.on_result(digest, result, error)
+        except Exception as e:
+            logger.error(f"Error recording parse of message {digest}: {e}")
+
+    def sweep(self):
+        """
+        Submit messages left 'pending' by a full pool or a restart, as far as there is room.
+
+        Returns:
+            int: Number of messages submitted.
+        """
+        room = self.max_pending - self.pending
+        if self.backlog is None or room <= 0:
+            return 0
+        submitted = 0
+        for digest, path in self.backlog(room + self.pending):
+            if digest in self._in_flight:
+                continue
+            if not self.submit(digest, path):
+                break
+            submitted += 1
+        return submitted
+
+    def start(self, interval=60):
+        """
+        Sweep the backlog now and then every interval seconds on a thread.
+
+        Args:
+            interval (float): Seconds between sweeps.
+        """
+        if self._loop is None and self.backlog is not None:
+            self._loop = task.LoopingCall(self._sweep_in_thread)
+            self._loop.start(interval, now=True)
+
+    def _sweep_in_thread(self):
+        d = threads.deferToThread(self.sweep)
+        d.addErrback(lambda failure: logger.error(f"Error sweeping message backlog: {failure.getErrorMessage()}"))
+        return d
+
+    def stop(self, wait=True):
+        """
+        Stop sweeping and shut the worker pool down.
+
+        Messages that were never submitted stay 'pending' and are parsed after the next start.
+
+        Args:
+            wait (bool): Wait for the messages already submitted to be parsed.
+        """
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            stats = self.stats()
+            logger.info(f"Message pipeline stopped: {stats['parsed']} parsed, {stats['failed']} failed, "
+                        f"{stats['deferred']} deferred, p99 latency {stats['latency_p99_ms']:.1f} ms")
+
+    def stats(self):
+        """
+        Return counters and latency percentiles.
+
+        Returns:
+            dict: submitted, parsed, failed, deferred and pending counts, with p50/p99 of the
+                submit-to-result latency and of the parse time alone, in milliseconds.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            parse_times = sorted(self._parse_times)
+            return {
+                'submitted': self.submitted,
+                'parsed': self.parsed,
+                'failed': self.failed,
+                'deferred': self.deferred,
+                'pending': len(self._in_flight),
+                'latency_p50_ms': _percentile(latencies, 0.5),
+                'latency_p99_ms': _percentile(latencies, 0.99),
+                'parse_p50_ms': _percentile(parse_times, 0.5),
+                'parse_p99_ms': _percentile(parse_times, 0.99),
+            }
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,63 @@
+# src/smtp/mime_parser.py
+import hashlib
+import os
+import time
+from email import policy
+from email.parser import BytesParser
+from smtp.spool import write_once
+
+# Longest header value kept in the catalog
+MAX_HEADER_LENGTH = 998
+
+def parse_message(path, attachment_dir):
+    """
+    Parse a stored message and extract its attachments.
+
+    Runs in a worker process: it only reads the message file, writes attachment files
+    and returns plain data that can be pickled back to the listener.
+
+    Args:
+        path (str): The message file written by MessageStore.
+        attachment_dir (str): Root of the content-addressed attachment store.
+
+    Returns:
+        dict: Headers, the number of MIME parts, the attachments as
+            (part, sha256, filename, content type, size) tuples and the parse time in ms.
+    """
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        message = BytesParser(policy=policy.default).parse(f)
+    attachments = []
+    parts = 0
+    for index, part in enumerate(message.walk()):
+        parts += 1
+        if part.is_multipart():
+            continue
+        filename = _safe(part.get_filename)
+        if filename is None and part.get_content_disposition() != 'attachment':
+            continue
+        payload = part.get_payload(decode=True) or b''
+        digest = hashlib.sha256(payload).hexdigest()
+        write_once(os.path.join(attachment_dir, digest[:2], digest), payload)
+        attachments.append((index, digest, filename, part.get_content_type(), len(payload)))
+    return {
+        'subject': _header(message, 'subject'),
+        'from': _header(message, 'from'),
+        'to': _header(message, 'to'),
+        'message_id': _header(message, 'message-id'),
+        'date': _header(message, 'date'),
+        'parts': parts,
+        'attachments': attachments,
+        'parse_ms': (time.perf_counter() - started) * 1000,
+    }
+
+def _safe(getter):
+    # Malformed headers surface as exceptions when their value is decoded
+    try:
+        return getter()
+    except Exception:
+        return None
+
+def _header(message, name):
+    value = _safe(lambda: message.get(name))
+    return None if value is None else str(value)[:MAX_HEADER_LENGTH]
@@ -1,31 +1,107 @@
 # src/smtp/rate_limiter.py
-import time
 import logging
-from twisted.internet import reactor
+import socket
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+# Prefix of IPv4-mapped IPv6 addresses (::ffff:a.b.c.d), which share the bucket of the IPv4 address
+IPV4_MAPPED = b'\0' * 10 + b'\xff\xff'
+
 class RateLimiter:
-    def __init__(self, rate_limit):
+    """
+    Per-source token buckets for incoming connections.
+
+    Each source may open rate_limit connections per period seconds, refilled continuously.
+    A check is O(1): the bucket is refilled from the time elapsed since its last use, so no
+    timers are scheduled and idle entries simply expire when they are next touched. At most
+    max_tracked sources are kept; the least recently seen one is evicted first, which only
+    forgets a source that has been quiet longer than every other tracked source.
+
+    Sources can be grouped by network: prefix_v4=24 or prefix_v6=64 make all addresses of
+    a /24 or /64 share one bucket.
+    """
+
+    def __init__(self, rate_limit, period=60, max_tracked=100000, prefix_v4=32, prefix_v6=128, clock=time.monotonic):
+        if not 0 <= prefix_v4 <= 32 or not 0 <= prefix_v6 <= 128:
+            raise ValueError(f"Invalid prefix lengths /{prefix_v4} and /{prefix_v6}")
         self.rate_limit = rate_limit
-        self.connection_attempts = {}
+        self.period = period
+        self.max_tracked = max_tracked
+        self.prefix_v4 = prefix_v4
+        self.prefix_v6 = prefix_v6
+        self.clock = clock
+        self.refill_rate = rate_limit / period if period > 0 else float('inf')
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_config(cls, config, section='server'):
+        return cls(
+            config.getint(section, 'rate_limit', fallback=5),
+            period=config.getint(section, 'rate_limit_period', fallback=60),
+            max_tracked=config.getint(section, 'rate_limit_max_ips', fallback=100000),
+            prefix_v4=config.getint(section, 'rate_limit_prefix_v4', fallback=32),
+            prefix_v6=config.getint(section, 'rate_limit_prefix_v6', fallback=128),
+        )
+
+    def key(self, ip):
+        """Return the bucket key of an address: the address itself or its network prefix."""
+        if self.prefix_v4 == 32 and self.prefix_v6 == 128:
+            return ip
+        try:
+            if ':' not in ip:
+                return (4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big') >> (32 - self.prefix_v4))
+            packed = socket.inet_pton(socket.AF_INET6, ip)
+        except (OSError, TypeError):
+            return ip
+        if packed[:12] == IPV4_MAPPED:
+            return (4, int.from_bytes(packed[12:], 'big') >> (32 - self.prefix_v4))
+        return (6, int.from_bytes(packed, 'big') >> (128 - self.prefix_v6))
 
     def allow_connection(self, ip):
-        current_time = time.time()
-        attempts = self.connection_attempts.get(ip, [])
+        """
+        Take a token from the bucket of ip.
 
-        # Remove attempts older than 1 minute
-        attempts = [t for t in attempts if current_time - t < 60]
+        Args:
+            ip (str): The peer address.
 
-        attempts.append(current_time)
-        self.connection_attempts[ip] = attempts
+        Returns:
+            bool: False if the source exceeded its rate and the connection should be refused.
+        """
+        if self.rate_limit <= 0:
+            self.allowed += 1
+            return True
+        now = self.clock()
+        key = self.key(ip)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            tokens = self.rate_limit
+            if len(self.buckets) >= self.max_tracked:
+                self.buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            tokens = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.refill_rate)
+            self.buckets.move_to_end(key)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            self.allowed += 1
+        else:
+            self.rejected += 1
+            logger.debug(f"Rate limit exceeded for {ip}")
+        if bucket is None:
+            self.buckets[key] = [tokens, now]
+        else:
+            bucket[0], bucket[1] = tokens, now
+        return allowed
 
-        if len(attempts) > self.rate_limit:
-            reactor.callLater(60, self._unblock_ip, ip)
-            return False
-        return True
+    @property
+    def tracked(self):
+        return len(self.buckets)
 
-    def _unblock_ip(self, ip):
-        if ip in self.connection_attempts:
-            del self.connection_attempts[ip]
-            logger.debug(f"IP {ip} has been unblocked after rate limiting period.")
\ No newline at end of file
+    def stats(self):
+        return {'allowed': self.allowed, 'rejected': self.rejected, 'evicted': self.evicted, 'tracked': self.tracked}
@@ -1,22 +1,83 @@
 # src/smtp/response_manager.py
 import json
 import logging
+import os
+from types import MappingProxyType
+from twisted.internet import task
+from wire import WireTable
 
 logger = logging.getLogger(__name__)
 
 class ResponseManager:
-    def __init__(self, ai_service, debug=False):
-        self.ai_service = ai_service
+    """
+    SMTP response table shared by every connection of a factory.
+
+    The table is an immutable mapping that is replaced as a whole when the response
+    file changes, so protocols can read it without locks and never see a partial update.
+    A timer checks the file's mtime; nothing is read from disk per connection.
+
+    Every table entry and every text in static is also precompiled into wire, the bytes
+    sent to the client, and swapped together with the table.
+    """
+
+    def __init__(self, path='files/smtp_response.txt', debug=False, static=()):
+        self.path = path
         self.debug = debug
-        self.responses = self._load_responses()
+        self.static = tuple(static)
+        self.mtime = None
+        self.responses = MappingProxyType({})
+        self.wire = WireTable(self.static)
+        self._loop = None
+        self.reload()
 
-    def _load_responses(self):
+    def reload(self):
+        """
+        Reload the table if the response file changed since it was last read.
+
+        Returns:
+            bool: True if a new table was swapped in.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        if mtime is None:
+            logger.warning(f"Response file {self.path} not found. Using default responses.")
+            self._publish({})
+            return True
         try:
-            responses = self.ai_service.load_responses("smtp")
-            return self._format_responses(responses)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                responses = self._format_responses(f.read())
         except Exception as e:
             logger.error(f"Error loading SMTP responses: {e}")
-            return self.default_responses()
+            responses = self.default_responses()
+        self._publish(responses)
+        logger.info(f"Loaded {len(responses)} SMTP responses from {self.path}")
+        return True
+
+    def _publish(self, responses):
+        self.wire = WireTable(self.static + tuple(responses.values()))
+        self.responses = MappingProxyType(responses)
+
+    def start(self, interval=5):
+        """
+        Check the response file for changes every interval seconds.
+
+        Args:
+            interval (float): Seconds between mtime checks.
+        """
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.reload)
+            self._loop.start(interval, now=False)
+
+    def stop(self):
+        """Stop checking the response file."""
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
 
     def _format_responses(self, responses):
         formatted_responses = {}
@@ -59,4 +120,4 @@ class ResponseManager:
         }
 
     def get_response(self, code, default=None):
-        return self.responses.get(code, default)
\ No newline at end of file
+        return self.responses.get(code, default)
@@ -1,13 +1,36 @@
 # src/smtp/smtp_banner.py
+import time
 from datetime import datetime
+from wire import to_wire
 
 class SMTPBanner:
-    def __init__(self, domain_name, technology):
+    """
+    Greeting sent when a client connects.
+
+    The generic banner is compiled once; the Exchange banner carries the current time,
+    so it is rebuilt at most once per second however many clients connect.
+    """
+
+    def __init__(self, domain_name, technology, clock=time.time):
         self.domain_name = domain_name
         self.technology = technology
+        self.clock = clock
+        self.exchange = technology.lower() == 'exchange'
+        self._second = None
+        self._banner = None
+        if not self.exchange:
+            text = f"220 {self.domain_name} ESMTP"
+            self._banner = (text, to_wire(text))
+
+    def render(self):
+        """Return the banner text and its wire format."""
+        if self.exchange:
+            second = int(self.clock())
+            if second != self._second:
+                current_date = datetime.fromtimestamp(second).strftime("%a, %d %b %Y %H:%M:%S %z")
+                text = f"220 {self.domain_name} Microsoft ESMTP MAIL Service ready at {current_date}"
+                self._second, self._banner = second, (text, to_wire(text))
+        return self._banner
 
     def get_banner(self):
-        if self.technology.lower() == 'exchange':
-            current_date = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %z")
-            return f"220 {self.domain_name} Microsoft ESMTP MAIL Service ready at {current_date}"
-        return f"220 {self.domain_name} ESMTP"
\ No newline at end of file
+        return self.render()[0]
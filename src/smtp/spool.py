@@ -0,0 +1,166 @@
+# src/smtp/spool.py
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Size advertised in the EHLO SIZE capability
+MAX_MESSAGE_SIZE = 37748736
+
+# Message bytes kept in memory before the spool moves to a temporary file
+SPOOL_MEMORY = 1024 * 1024
+
+def write_once(path, data):
+    """
+    Write data to path unless the file exists, through a temporary file so readers never see a partial file.
+
+    Returns:
+        bool: True if the file was written, False if it already existed.
+    """
+    if os.path.exists(path):
+        return False
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+class MessageSpool:
+    """
+    Receives one DATA body line by line.
+
+    Lines are dot-unstuffed, hashed with SHA-256 and counted as they arrive. The body
+    stays in memory up to max_memory bytes and is then moved to a temporary file, so a
+    large message never sits in RAM. Once max_size is exceeded the rest of the body is
+    discarded; the spool keeps counting so the transaction can be rejected at the final ".".
+    """
+
+    def __init__(self, spool_dir, max_size=MAX_MESSAGE_SIZE, max_memory=SPOOL_MEMORY):
+        self.spool_dir = spool_dir
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.size = 0
+        self.lines = 0
+        self.overflow = False
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    def add_line(self, line):
+        """
+        Append a line received in DATA state, without its CRLF.
+
+        Args:
+            line (bytes): The raw line as sent by the client.
+        """
+        if line.startswith(b'.'):
+            line = line[1:]
+        self.lines += 1
+        self.size += len(line) + 2
+        if self.overflow:
+            return
+        if self.max_size and self.size > self.max_size:
+            self.overflow = True
+            self.discard()
+            return
+        data = line + b'\r\n'
+        self._sha256.update(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._buffer += data
+        if len(self._buffer) > self.max_memory:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix='spool-', delete=False)
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    @property
+    def digest(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def in_memory(self):
+        return self._file is None
+
+    def getvalue(self):
+        """Return the body if it is still held in memory, None once it was spooled to disk."""
+        return bytes(self._buffer) if self._file is None else None
+
+    def detach(self):
+        """
+        Close the temporary file and hand its path to the caller.
+
+        Returns:
+            str: Path of the spooled body, or None if the body is held in memory.
+        """
+        if self._file is None:
+            return None
+        self._file.close()
+        path, self._file = self._file.name, None
+        return path
+
+    def discard(self):
+        """Drop the body, removing the temporary file if there is one."""
+        self._buffer = bytearray()
+        path = self.detach()
+        if path is not None:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.error(f"Error removing spool file {path}: {e}")
+
+class MessageStore:
+    """
+    Content-addressed store of received messages.
+
+    Each body is saved once as <directory>/<first two hex digits>/<sha256>.eml; a message
+    that is already stored is not written again. Spooled bodies are renamed into place,
+    so the temporary files live in <directory>/tmp on the same file system.
+    """
+
+    def __init__(self, directory='files/messages'):
+        self.directory = directory
+        self.spool_dir = os.path.join(directory, 'tmp')
+        self.stored = 0
+        self.duplicates = 0
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], f'{digest}.eml')
+
+    def spool(self, max_size=MAX_MESSAGE_SIZE, max_memory=SPOOL_MEMORY):
+        return MessageSpool(self.spool_dir, max_size=max_size, max_memory=max_memory)
+
+    def store(self, spool):
+        """
+        Save a completed spool under its SHA-256 digest.
+
+        Args:
+            spool (MessageSpool): A spool whose body was received completely.
+
+        Returns:
+            tuple: (digest, path, stored) where stored is False if the message was already known.
+        """
+        digest = spool.digest
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            self.duplicates += 1
+            spool.discard()
+            return digest, path, False
+        spooled = spool.detach()
+        if spooled is None:
+            write_once(path, spool.getvalue())
+            spool.discard()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(spooled, path)
+        self.stored += 1
+        return digest, path, True
+
+    @property
+    def stats(self):
+        return {'stored': self.stored, 'duplicates': self.duplicates}
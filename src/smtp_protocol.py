@@ -21,98 +21,564 @@
 #
 # src/smtp_protocol.py
 
+import base64
+import binascii
 import logging
-from twisted.internet import protocol
+from twisted.internet import protocol, task
+from twisted.internet.interfaces import ISSLTransport
 from smtp.config_manager import ConfigManager
 from smtp.smtp_banner import SMTPBanner
 from smtp.response_manager import ResponseManager
 from smtp.rate_limiter import RateLimiter
+from smtp.spool import MessageStore, MAX_MESSAGE_SIZE, SPOOL_MEMORY
+from smtp.message_pipeline import MessagePipeline
+from smtp.credentials import CredentialStore
 from twisted.protocols.basic import LineReceiver
-from ai_services import AIService
-from database import log_interaction
+from twisted.protocols.policies import TimeoutMixin
+from admission import AdmissionController, TOO_MANY_SESSIONS, TOO_MANY_FROM_IP, IDLE, SESSION
+from wire import to_wire, split_command, decode, loggable
+from sinks import log_batch, open_session, close_session, WELCOME
+from database import log_message, log_message_parse, pending_messages, log_credentials
 
 logger = logging.getLogger(__name__)
 
+# Base64 prompts of the AUTH LOGIN exchange
+USERNAME_PROMPT = "334 VXNlcm5hbWU6"
+PASSWORD_PROMPT = "334 UGFzc3dvcmQ6"
+
+# Fixed replies; together with the response table they are precompiled per factory
+BAD_SYNTAX = "500 5.5.2 Error: bad syntax"
+UNRECOGNIZED = "500 5.5.2 Command unrecognized"
+PROCESSING_ERROR = "500 Command unrecognized"
+NOT_IMPLEMENTED_REPLY = "502 5.5.1 Command not implemented"
+OK = "250 2.0.0 Ok"
+SENDER_OK = "250 2.1.0 Ok"
+RECIPIENT_OK = "250 2.1.5 Ok"
+HELO_OK = "250 localhost"
+START_DATA = "354 End data with <CR><LF>.<CR><LF>"
+QUEUED = "250 OK: Queued"
+QUEUE_ERROR = "451 4.3.0 Error: queue file write error"
+TOO_BIG = "552 5.3.4 Message size exceeds fixed maximum message size"
+CANNOT_VRFY = "252 2.0.0 Cannot VRFY user, but will accept message and attempt delivery"
+HELP = "214 2.0.0 Help message"
+BYE = "221 2.0.0 Bye"
+NEED_HELO = "503 5.5.1 Error: send HELO/EHLO first"
+NESTED_MAIL = "503 5.5.1 Error: nested MAIL command"
+NEED_MAIL = "503 5.5.1 Error: need MAIL command"
+NEED_RCPT = "503 5.5.1 Error: need RCPT command"
+MAIL_IN_PROGRESS = "503 5.5.1 Error: MAIL transaction in progress"
+HELO_SYNTAX = "501 5.5.4 Syntax: HELO hostname"
+EHLO_SYNTAX = "501 5.5.4 Syntax: EHLO hostname"
+MAIL_SYNTAX = "501 5.5.4 Syntax: MAIL FROM:<address>"
+RCPT_SYNTAX = "501 5.5.4 Syntax: RCPT TO:<address>"
+VRFY_SYNTAX = "501 5.5.4 Syntax: VRFY address"
+BAD_MECHANISM = "504 5.5.4 Unrecognized authentication type"
+PLAIN_PROMPT = "334 "
+AUTH_ABORTED = "501 5.7.0 Authentication aborted"
+UNDECODABLE = "501 5.5.2 Cannot decode response"
+AUTH_FAILED = "535 5.7.8 Authentication credentials invalid"
+READY_FOR_TLS = "220 2.0.0 Ready to start TLS"
+TLS_UNAVAILABLE = "454 4.7.0 TLS not available due to temporary reason"
+TLS_ACTIVE = "554 5.5.1 Error: TLS already active"
+STARTTLS_SYNTAX = "501 5.5.4 Syntax: STARTTLS"
+TOO_MANY_SESSIONS_REPLY = "421 4.3.2 Too many connections, try again later"
+TOO_MANY_FROM_IP_REPLY = "421 4.7.0 Too many connections from your host"
+TIMED_OUT = "421 4.4.2 Error: timeout exceeded"
+LINE_TOO_LONG = "500 5.5.0 Error: line too long"
+
+STATIC_REPLIES = (
+    USERNAME_PROMPT, PASSWORD_PROMPT, BAD_SYNTAX, UNRECOGNIZED, PROCESSING_ERROR, NOT_IMPLEMENTED_REPLY, OK,
+    SENDER_OK, RECIPIENT_OK, HELO_OK, START_DATA, QUEUED, QUEUE_ERROR, TOO_BIG, CANNOT_VRFY, HELP, BYE,
+    NEED_HELO, NESTED_MAIL, NEED_MAIL, NEED_RCPT, MAIL_IN_PROGRESS, HELO_SYNTAX, EHLO_SYNTAX, MAIL_SYNTAX,
+    RCPT_SYNTAX, VRFY_SYNTAX, BAD_MECHANISM, PLAIN_PROMPT, AUTH_ABORTED, UNDECODABLE, AUTH_FAILED,
+    READY_FOR_TLS, TLS_UNAVAILABLE, TLS_ACTIVE, STARTTLS_SYNTAX, TOO_MANY_SESSIONS_REPLY, TOO_MANY_FROM_IP_REPLY,
+    TIMED_OUT, LINE_TOO_LONG,
+)
+
+# Replies to connections refused by admission control
+REJECTIONS = {TOO_MANY_SESSIONS: TOO_MANY_SESSIONS_REPLY, TOO_MANY_FROM_IP: TOO_MANY_FROM_IP_REPLY}
+
+# Longest line accepted, without its CRLF; RFC 5321 allows 1000 octets with it, spam often sends more
+MAX_LINE_LENGTH = 4096
+
+# Verbs a real MTA knows but the honeypot does not implement
+NOT_IMPLEMENTED = {'EXPN', 'ETRN', 'BDAT', 'TURN'}
+
 # SMTP Protocol
-class SMTPProtocol(LineReceiver):
+class SMTPProtocol(LineReceiver, TimeoutMixin):
+    """
+    SMTP command state machine.
+
+    States: 'INITIAL' until HELO/EHLO, 'GREETED' between transactions, 'MAIL' after
+    MAIL FROM, 'RCPT' once a recipient is accepted, 'DATA' while the message is
+    received and 'AUTH' during an AUTH exchange.
+
+    DATA bodies are streamed into a MessageSpool and saved in the factory's
+    content-addressed MessageStore; bodies over the advertised SIZE are rejected with 552.
+
+    AUTH LOGIN and AUTH PLAIN always fail, but every username and password offered is
+    recorded in the factory's CredentialStore.
+
+    STARTTLS upgrades the connection with the factory's shared TLS options once its
+    reply is written; lines pipelined after it are discarded and the session starts
+    over, as RFC 3207 requires. Connections accepted by an implicit TLS listener
+    (port 465) are treated as already secured.
+
+    The factory's AdmissionController caps concurrent sessions; refused clients get a
+    421. Sessions idle for idle_timeout seconds, or open longer than session_timeout,
+    are closed with a 421 as well.
+
+    Command lines are parsed as bytes: the verb is matched without decoding, arguments
+    are decoded only by the handlers that need them and lines that are not UTF-8 are
+    logged verbatim. A command line longer than max_line_length bytes, or a message line
+    longer than the in-memory spool, is answered with a 500 and the connection is closed.
+
+    All commands that arrive in one TCP segment (e.g. from a PIPELINING client) are
+    answered with a single transport.writeSequence() call and logged as one batch.
+    """
+
+    # Verb -> handler method; each handler takes the argument bytes and returns the reply
+    COMMANDS = {
+        'HELO': 'smtp_HELO',
+        'EHLO': 'smtp_EHLO',
+        'MAIL': 'smtp_MAIL',
+        'RCPT': 'smtp_RCPT',
+        'DATA': 'smtp_DATA',
+        'RSET': 'smtp_RSET',
+        'NOOP': 'smtp_NOOP',
+        'VRFY': 'smtp_VRFY',
+        'HELP': 'smtp_HELP',
+        'QUIT': 'smtp_QUIT',
+        'AUTH': 'smtp_AUTH',
+        'STARTTLS': 'smtp_STARTTLS',
+    }
+
     def __init__(self, factory, debug=False):
         self.factory = factory
+        self.MAX_LENGTH = factory.max_line_length
         self.ip = None
+        self.session = None
         self.debug = debug
-        self.ai_service = AIService(debug_mode=self.debug)
-        self.responses = ResponseManager(self.ai_service, debug)
+        self.responses = factory.responses
         self.state = 'INITIAL'
-        self.data_buffer = []
+        self.greeted = False
+        self.mail_from = None
+        self.recipients = []
+        self.spool = None
+        self.auth_mechanism = None
         self.auth_step = None
         self.auth_username = None
         self.auth_password = None
+        self.auth_return_state = None
+        self.quitting = False
+        self.tls_active = False
+        self.admitted = False
+        self._start_tls = False
+        self._session_timer = None
+        self._replies = None
+        self._interactions = None
 
     def connectionMade(self):
-        self.ip = self.transport.getPeer().host
+        peer = self.transport.getPeer()
+        self.ip = peer.host
+        self.tls_active = ISSLTransport.providedBy(self.transport)
+        self.session = open_session('smtp', peer.host, getattr(peer, 'port', None))
         if not self.factory.rate_limiter.allow_connection(self.ip):
             logger.info(f"Rate limit exceeded for IP: {self.ip}")
             self.transport.loseConnection()
             return
 
-        banner = self.factory.banner.get_banner()
-        self.sendLine(banner.encode('utf-8'))
-        log_interaction(self.ip, 'WELCOME', banner)
+        self._begin_batch()
+        rejection = self.factory.admission.admit(self.ip)
+        if rejection is not None:
+            logger.info(f"Refused connection from {self.ip}: {rejection} session limit reached")
+            self.reply(WELCOME, REJECTIONS[rejection])
+            self.quitting = True
+        else:
+            self.admitted = True
+            admission = self.factory.admission
+            self.setTimeout(admission.idle_timeout or None)
+            if admission.session_timeout:
+                self._session_timer = self.callLater(admission.session_timeout, self._session_expired)
+            self.reply(WELCOME, *self.factory.banner.render())
+        self._end_batch()
 
-    def lineReceived(self, line):
+    def connectionLost(self, reason):
+        self.setTimeout(None)
+        if self._session_timer is not None and self._session_timer.active():
+            self._session_timer.cancel()
+        self._session_timer = None
+        if self.admitted:
+            self.admitted = False
+            self.factory.admission.release(self.ip)
+        self._reset_transaction()
+        close_session(self.session)
+
+    def timeoutConnection(self):
+        self._close_timed_out(IDLE)
+
+    def _session_expired(self):
+        self._session_timer = None
+        self._close_timed_out(SESSION)
+
+    def _close_timed_out(self, kind):
+        logger.info(f"Closing {kind} timed out session from {self.ip}")
+        self.factory.admission.timed_out(kind)
+        self.quitting = True
+        self.transport.write(self.responses.wire.get(TIMED_OUT))
+        self.transport.loseConnection()
+
+    def dataReceived(self, data):
+        self.resetTimeout()
+        # Collect the replies to every complete line in this segment, then write and log them once
+        self._begin_batch()
         try:
-            command = line.decode('utf-8').strip()
-            if self.state == 'DATA':
-                if command == ".":
-                    self.state = 'INITIAL'
-                    data_message = "\n".join(self.data_buffer)
-                    self.data_buffer = []
-                    response = self.responses.get_response("250-DATA", "250 OK: Queued")
-                else:
-                    self.data_buffer.append(command)
-                    return
-            else:
-                response = self._get_response(command)
+            LineReceiver.dataReceived(self, data)
+        finally:
+            self._end_batch()
 
-            self.sendLine(response.encode('utf-8'))
-            log_interaction(self.ip, command, response)
+    def _begin_batch(self):
+        self._replies = []
+        self._interactions = []
 
+    def _end_batch(self):
+        replies, interactions = self._replies, self._interactions
+        self._replies = self._interactions = None
+        if replies:
+            self.transport.writeSequence(replies)
+        if interactions:
+            log_batch(self.ip, interactions, session=self.session)
+        if self._start_tls:
+            self._start_tls = False
+            self.transport.startTLS(self.factory.tls)
+            self.tls_active = True
+            # The client must greet again; nothing from the plaintext session carries over
+            self.greeted = False
+            self.state = 'INITIAL'
+            self._reset_transaction()
+        if self.quitting:
+            self.transport.loseConnection()
+
+    def reply(self, command, response, data=None):
+        """
+        Queue a reply for the current batch and record the interaction.
+
+        Args:
+            command (str): The client line being answered.
+            response (str): The reply; multi-line replies are separated by CRLF. Handlers
+                may also return a (text, data) pair whose wire format is already built.
+            data (bytes): The reply as sent, if the caller already has it; precompiled
+                replies are looked up in the factory's wire table.
+        """
+        if isinstance(response, tuple):
+            response, data = response
+        if data is None:
+            data = self.responses.wire.get(response)
+        if self._replies is None:
+            self.transport.write(data)
+            log_batch(self.ip, [(command, response)], session=self.session)
+        else:
+            self._replies.append(data)
+            self._interactions.append((command, response))
+
+    def lineReceived(self, line):
+        if self.quitting:
+            return
+        if self.state == 'DATA':
+            # Message lines are kept as bytes; only the final "." is a command
+            try:
+                self._data_line(line)
+            except Exception as e:
+                logger.error(f"Error receiving message from {self.ip}: {e}")
+                self._reset_transaction()
+                self.state = 'GREETED'
+                self.reply(".", QUEUE_ERROR)
+            return
+        line = line.strip()
+        try:
+            if self.state == 'AUTH':
+                response = self._auth_continue(line)
+            else:
+                response = self._dispatch(line)
         except Exception as e:
             logger.error(f"Error processing command from {self.ip}: {e}")
-            self.sendLine(b"500 Command unrecognized")
+            response = PROCESSING_ERROR
+        self.reply(loggable(line), response)
+
+    def lineLengthExceeded(self, line):
+        # The rest of the line would be read as commands, so the session cannot go on
+        logger.info(f"Line of more than {self.MAX_LENGTH} bytes from {self.ip}, closing connection")
+        self._reset_transaction()
+        self.quitting = True
+        self.reply(loggable(line), LINE_TOO_LONG)
+
+    def _dispatch(self, line):
+        verb, argument = split_command(line)
+        handler = self.COMMANDS.get(verb)
+        if handler is not None:
+            return getattr(self, handler)(argument)
+        if not verb:
+            return BAD_SYNTAX
+        if verb in NOT_IMPLEMENTED:
+            return self.responses.get_response("502", NOT_IMPLEMENTED_REPLY)
+        return self.responses.get_response("500", UNRECOGNIZED)
+
+    def _data_line(self, line):
+        if line != b".":
+            self.spool.add_line(line)
+            return
+        spool, mail_from, recipients = self.spool, self.mail_from, self.recipients
+        self.spool = None
+        self.state = 'GREETED'
+        self._reset_transaction()
+        if spool.overflow:
+            logger.info(f"Rejected message of {spool.size} bytes from {self.ip}")
+            self.reply(".", TOO_BIG)
+            return
+        digest, path, stored = self.factory.message_store.store(spool)
+        logger.info(f"Received message {digest} of {spool.size} bytes from {self.ip}"
+                    f"{'' if stored else ' (already stored)'}")
+        self.factory.message_received(self, digest, path, spool.size, mail_from, recipients, stored)
+        self.reply(".", self.responses.get_response("250-DATA", QUEUED))
+
+    def _reset_transaction(self):
+        self.MAX_LENGTH = self.factory.max_line_length
+        self.mail_from = None
+        self.recipients = []
+        if self.spool is not None:
+            self.spool.discard()
+            self.spool = None
+
+    def smtp_HELO(self, argument):
+        if not argument:
+            return HELO_SYNTAX
+        self.greeted = True
+        self.state = 'GREETED'
+        self._reset_transaction()
+        return self.responses.get_response("250-HELO", HELO_OK)
+
+    def smtp_EHLO(self, argument):
+        if not argument:
+            return EHLO_SYNTAX
+        self.greeted = True
+        self.state = 'GREETED'
+        self._reset_transaction()
+        return self._ehlo_response()
+
+    def smtp_MAIL(self, argument):
+        if not self.greeted:
+            return NEED_HELO
+        if self.state in ('MAIL', 'RCPT'):
+            return NESTED_MAIL
+        argument = decode(argument)
+        if not argument.upper().startswith("FROM:"):
+            return MAIL_SYNTAX
+        address, _, parameters = argument[5:].strip().partition(' ')
+        for parameter in parameters.split():
+            name, _, value = parameter.partition('=')
+            if name.upper() == 'SIZE' and value.isdigit() and int(value) > self.factory.max_message_size:
+                return TOO_BIG
+        self.mail_from = address
+        self.state = 'MAIL'
+        return SENDER_OK
+
+    def smtp_RCPT(self, argument):
+        if self.state not in ('MAIL', 'RCPT'):
+            return NEED_MAIL
+        argument = decode(argument)
+        if not argument.upper().startswith("TO:"):
+            return RCPT_SYNTAX
+        self.recipients.append(argument[3:].strip())
+        self.state = 'RCPT'
+        return RECIPIENT_OK
+
+    def smtp_DATA(self, argument):
+        if self.state != 'RCPT':
+            return NEED_RCPT
+        self.state = 'DATA'
+        # A message line may be as long as the part of the body the spool keeps in memory
+        self.MAX_LENGTH = max(self.factory.max_line_length, self.factory.spool_memory)
+        self.spool = self.factory.message_store.spool(self.factory.max_message_size, self.factory.spool_memory)
+        return self.responses.get_response("354", START_DATA)
+
+    def smtp_RSET(self, argument):
+        self._reset_transaction()
+        self.state = 'GREETED' if self.greeted else 'INITIAL'
+        return OK
 
-    def _get_response(self, command):
-        command_upper = command.upper()
-        if command_upper.startswith("EHLO"):
-            return self._ehlo_response()
-        elif command_upper.startswith("HELO"):
-            return self.responses.get_response("250-HELO", "250 localhost")
-        # Other SMTP commands here
+    def smtp_NOOP(self, argument):
+        return OK
+
+    def smtp_VRFY(self, argument):
+        if not argument:
+            return VRFY_SYNTAX
+        return self.responses.get_response("252", CANNOT_VRFY)
+
+    def smtp_HELP(self, argument):
+        return self.responses.get_response("214", HELP)
+
+    def smtp_QUIT(self, argument):
+        # The connection is closed once the replies of this segment are written
+        self.quitting = True
+        return self.responses.get_response("221", BYE)
+
+    def smtp_AUTH(self, argument):
+        if not self.greeted:
+            return NEED_HELO
+        if self.state in ('MAIL', 'RCPT'):
+            return MAIL_IN_PROGRESS
+        mechanism, _, initial = argument.partition(b' ')
+        mechanism = mechanism.upper()
+        if mechanism not in (b'LOGIN', b'PLAIN'):
+            return BAD_MECHANISM
+        self.auth_mechanism = mechanism.decode('ascii')
+        self.auth_username = self.auth_password = None
+        self.auth_return_state = self.state
+        self.state = 'AUTH'
+        if mechanism == b'PLAIN':
+            self.auth_step = 'credentials'
+            return self._auth_continue(initial.strip()) if initial.strip() else PLAIN_PROMPT
+        self.auth_step = 'username'
+        return self._auth_continue(initial.strip()) if initial.strip() else USERNAME_PROMPT
+
+    def smtp_STARTTLS(self, argument):
+        if argument:
+            return STARTTLS_SYNTAX
+        if self.tls_active:
+            return TLS_ACTIVE
+        if self.factory.tls is None:
+            return TLS_UNAVAILABLE
+        # Anything pipelined behind STARTTLS was sent in the clear and must not be executed
+        self.clearLineBuffer()
+        self._start_tls = True
+        return READY_FOR_TLS
+
+    def _auth_continue(self, line):
+        if line == b"*":
+            self._end_auth()
+            return AUTH_ABORTED
+        try:
+            decoded = base64.b64decode(line, validate=True)
+        except (binascii.Error, ValueError):
+            self._end_auth()
+            return UNDECODABLE
+        # Credentials are kept as text when they are UTF-8 and as their exact bytes otherwise
+        if self.auth_step == 'username':
+            self.auth_username = loggable(decoded)
+            self.auth_step = 'password'
+            return PASSWORD_PROMPT
+        if self.auth_step == 'password':
+            self.auth_password = loggable(decoded)
+        else:
+            # PLAIN: authorization identity, authentication identity and password separated by NUL
+            parts = decoded.split(b'\0')
+            self.auth_username = loggable(parts[1] if len(parts) > 2 else parts[0])
+            self.auth_password = loggable(parts[-1]) if len(parts) > 1 else None
+        logger.info(f"AUTH {self.auth_mechanism} attempt from {self.ip} as {self.auth_username!r}")
+        self.factory.credentials.record(self.auth_username, self.auth_password, self.auth_mechanism, self.ip)
+        self._end_auth()
+        return self.responses.get_response("535", AUTH_FAILED)
+
+    def _end_auth(self):
+        self.state = self.auth_return_state or 'GREETED'
+        self.auth_step = None
+        self.auth_return_state = None
 
     def _ehlo_response(self):
-        response = [self.responses.get_response("250-EHLO", f"250-{self.factory.banner.domain_name} Hello [{self.ip}]")]
-        capabilities = [
-            "SIZE 37748736",
-            "PIPELINING",
-            "DSN",
-            "ENHANCEDSTATUSCODES",
-            "STARTTLS",
-            "AUTH LOGIN PLAIN",
-            "8BITMIME",
-            "SMTPUTF8",
-        ]
-        response.extend([f"250-{cap}" for cap in capabilities[:-1]])
-        response.append(f"250 {capabilities[-1]}")
-        return "\n".join(response)
+        # Only the greeting line carries the client's address; the capabilities are precompiled
+        greeting = self.responses.get_response("250-EHLO")
+        if greeting is None:
+            greeting = f"250-{self.factory.banner.domain_name} Hello [{self.ip}]"
+        capabilities, data = self.factory.ehlo_capabilities(starttls=not self.tls_active)
+        return f"{greeting}\r\n{capabilities}", greeting.encode('utf-8') + self.delimiter + data
 
 
 # SMTP Factory
 class SMTPFactory(protocol.Factory):
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, tls=None):
         self.config = ConfigManager()
+        # CertificateOptions shared by STARTTLS and the implicit TLS listener, None without TLS
+        self.tls = tls
         self.debug = debug or self.config.getboolean('server', 'debug')
         self.banner = SMTPBanner(self.config.get('server', 'domain', fallback='localhost'),
                                  self.config.get('server', 'technology', fallback='generic'))
-        self.rate_limiter = RateLimiter(self.config.getint('server', 'rate_limit', fallback=5))
+        self.rate_limiter = RateLimiter.from_config(self.config)
+        self.admission = AdmissionController.from_config(self.config)
+        # One response table for every connection, reloaded when the file changes
+        self.responses = ResponseManager(debug=self.debug, static=STATIC_REPLIES)
+        self.response_reload_interval = self.config.getint('server', 'response_reload_interval', fallback=5)
+        self.max_message_size = self.config.getint('smtp', 'max_message_size', fallback=MAX_MESSAGE_SIZE)
+        self.spool_memory = self.config.getint('smtp', 'spool_memory', fallback=SPOOL_MEMORY)
+        self.max_line_length = self.config.getint('smtp', 'max_line_length', fallback=MAX_LINE_LENGTH)
+        self._ehlo = {}
+        # AUTH attempts, deduplicated in memory before they reach the credentials table
+        self.credentials = CredentialStore.from_config(log_credentials, self.config)
+        self.credential_flush_interval = self.config.getint('smtp', 'credential_flush_interval', fallback=10)
+        self._credential_loop = None
+        self.message_store = MessageStore(self.config.get('smtp', 'message_dir', fallback='files/messages'))
+        # Messages are parsed in worker processes; the listener only records and submits them
+        self.pipeline = None
+        self.parse_interval = self.config.getint('smtp', 'parse_interval', fallback=60)
+        if self.config.getboolean('smtp', 'parse_messages', fallback=True):
+            self.pipeline = MessagePipeline(
+                self.config.get('smtp', 'attachment_dir', fallback='files/attachments'),
+                log_message_parse,
+                backlog=pending_messages,
+                workers=self.config.getint('smtp', 'parse_workers', fallback=2),
+                max_pending=self.config.getint('smtp', 'parse_queue', fallback=64),
+            )
+
+    def startFactory(self):
+        self.responses.start(self.response_reload_interval)
+        self._credential_loop = task.LoopingCall(self.credentials.flush)
+        self._credential_loop.start(self.credential_flush_interval, now=False)
+        if self.pipeline is not None:
+            self.pipeline.start(self.parse_interval)
+
+    def stopFactory(self):
+        self.responses.stop()
+        if self._credential_loop is not None and self._credential_loop.running:
+            self._credential_loop.stop()
+        self._credential_loop = None
+        self.credentials.flush()
+        logger.info(f"SMTP credentials: {self.credentials.stats()}")
+        logger.info(f"SMTP sessions: {self.admission.stats()}")
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+    def ehlo_capabilities(self, starttls=True):
+        """
+        Return the EHLO capability lines and their wire format.
+
+        They are built once per SIZE limit; STARTTLS is offered only when TLS is configured
+        and the connection is not encrypted yet.
+        """
+        starttls = starttls and self.tls is not None
+        key = (self.max_message_size, starttls)
+        if key not in self._ehlo:
+            capabilities = [
+                f"SIZE {self.max_message_size}",
+                "PIPELINING",
+                "DSN",
+                "ENHANCEDSTATUSCODES",
+                "STARTTLS",
+                "AUTH LOGIN PLAIN",
+                "8BITMIME",
+                "SMTPUTF8",
+            ]
+            if not starttls:
+                capabilities.remove("STARTTLS")
+            lines = [f"250-{cap}" for cap in capabilities[:-1]] + [f"250 {capabilities[-1]}"]
+            text = "\r\n".join(lines)
+            self._ehlo[key] = (text, to_wire(text))
+        return self._ehlo[key]
+
+    def message_received(self, protocol, digest, path, size, mail_from, recipients, stored):
+        """Record a stored message and hand new ones to the MIME pipeline, if parsing is enabled."""
+        log_message(digest, path, size, session=protocol.session, ip=protocol.ip,
+                    mail_from=mail_from, recipients=recipients)
+        if stored and self.pipeline is not None:
+            self.pipeline.submit(digest, path)
 
     def buildProtocol(self, addr):
         return SMTPProtocol(self, debug=self.debug)
@@ -0,0 +1,150 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module provides the TLS settings shared by the GenAIPot listeners.
+
+A self-signed certificate is generated on first run when none is configured. The
+listeners share one CertificateOptions, whose OpenSSL context is built once and
+keeps a server-side session cache and session tickets, so scanners that reconnect
+over and over resume their sessions instead of paying for a full handshake.
+
+pyOpenSSL and cryptography are optional; without them the listeners run without TLS.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Lifetime of a generated certificate
+CERTIFICATE_DAYS = 825
+
+def available():
+    """
+    Tell whether the TLS dependencies are installed.
+
+    Returns:
+        bool: True if pyOpenSSL and cryptography can be imported.
+    """
+    try:
+        import OpenSSL  # noqa: F401
+        import cryptography  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def generate_certificate(cert_path, key_path, hostname, days=CERTIFICATE_DAYS):
+    """
+    Write a self-signed certificate and its RSA key as PEM files.
+
+    Args:
+        cert_path (str): Destination of the certificate.
+        key_path (str): Destination of the private key, created readable by the owner only.
+        hostname (str): Common name and DNS subject alternative name of the certificate.
+        days (int): Validity period.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    for path in (cert_path, key_path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    with open(cert_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    logger.info(f"Generated a self-signed certificate for {hostname} in {cert_path}")
+
+def server_options(cert_path, key_path, hostname='localhost'):
+    """
+    Build the TLS options of the listeners, generating a certificate if there is none.
+
+    Args:
+        cert_path (str): PEM certificate.
+        key_path (str): PEM private key.
+        hostname (str): Name put in a generated certificate.
+
+    Returns:
+        twisted.internet.ssl.CertificateOptions: Options with session caching and tickets enabled.
+
+    Raises:
+        RuntimeError: If pyOpenSSL or cryptography is not installed.
+    """
+    if not available():
+        raise RuntimeError("TLS requires pyOpenSSL and cryptography; install them with 'pip install pyOpenSSL'")
+    from twisted.internet import ssl
+
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        generate_certificate(cert_path, key_path, hostname)
+    with open(cert_path, 'rb') as f:
+        cert_pem = f.read()
+    with open(key_path, 'rb') as f:
+        key_pem = f.read()
+    certificate = ssl.PrivateCertificate.loadPEM(cert_pem + key_pem)
+    return ssl.CertificateOptions(
+        privateKey=certificate.privateKey.original,
+        certificate=certificate.original,
+        enableSessions=True,
+        enableSessionTickets=True,
+    )
+
+def from_config(config, section='tls'):
+    """
+    Build the TLS options from a configuration section.
+
+    Args:
+        config: A ConfigParser or ConfigManager.
+        section (str): Section holding the TLS settings.
+
+    Returns:
+        twisted.internet.ssl.CertificateOptions: The options, or None if TLS is disabled or unavailable.
+    """
+    if not config.getboolean(section, 'enabled', fallback=True):
+        return None
+    hostname = config.get(section, 'hostname', fallback=None) or config.get('server', 'domain', fallback='localhost')
+    try:
+        return server_options(config.get(section, 'certificate', fallback='files/tls/genaipot.crt'),
+                              config.get(section, 'private_key', fallback='files/tls/genaipot.key'),
+                              hostname)
+    except Exception as e:
+        logger.warning(f"TLS disabled: {e}")
+        return None
@@ -0,0 +1,145 @@
+# Copyright (C) 2024 Nucleon Cyber. All rights reserved.
+#
+# This file is part of GenAIPot.
+#
+# GenAIPot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GenAIPot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GenAIPot. If not, see <http://www.gnu.org/licenses/>.
+#
+# For more information, visit: www.nucleon.sh or send email to contact[@]nucleon.sh
+#
+
+
+"""
+This module precompiles protocol replies into the bytes sent on the wire.
+
+Listeners answer most commands with a fixed set of texts. Each factory builds a
+WireTable of them once, so sending a reply is a dictionary lookup instead of an
+encode per command; texts with dynamic fields are encoded when they are sent.
+
+Client lines go the other way: split_command() finds the verb of a raw line without
+decoding it, arguments stay bytes until a handler needs them, and decode() turns them
+into text losslessly, so bytes that are not UTF-8 survive to the logs.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CRLF = b'\r\n'
+
+def to_wire(text):
+    """
+    Encode a reply as sent on the wire: UTF-8 with every line ended by CRLF.
+
+    Args:
+        text (str): The reply; lines may be separated by LF or CRLF.
+
+    Returns:
+        bytes: The encoded reply including the final CRLF.
+    """
+    if '\n' in text:
+        text = text.replace('\r\n', '\n').replace('\n', '\r\n')
+    return text.encode('utf-8') + CRLF
+
+def split_command(line):
+    """
+    Split a raw command line into its verb and argument without decoding it.
+
+    Args:
+        line (bytes): The line as received, without its CRLF.
+
+    Returns:
+        tuple: (verb, argument) where verb is the upper-cased first word as a str and
+            argument the rest of the line as bytes, stripped of surrounding whitespace.
+    """
+    verb, _, argument = line.strip().partition(b' ')
+    # Only ASCII letters are upper-cased; a verb with other bytes never matches a command
+    return verb.upper().decode('latin-1'), argument.strip()
+
+def decode(data):
+    """
+    Decode client bytes as UTF-8, keeping invalid bytes as escaped surrogates.
+
+    data.encode('utf-8', 'surrogateescape') gives back the exact bytes.
+
+    Args:
+        data (bytes): Bytes sent by the client.
+
+    Returns:
+        str: The decoded text.
+    """
+    return data.decode('utf-8', 'surrogateescape')
+
+def loggable(line):
+    """
+    Return a client line in the form it is logged.
+
+    Args:
+        line (bytes): The line as received.
+
+    Returns:
+        str or bytes: The text if the line is valid UTF-8, otherwise the line itself, which
+            the sinks store verbatim (a BLOB in SQLite).
+    """
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        return line
+
+class WireTable:
+    """
+    Reply texts mapped to their precompiled wire format.
+
+    The table is replaced rather than modified by update(), so a reload never shows
+    connections a partially built table.
+    """
+
+    def __init__(self, texts=()):
+        """
+        Initialize the table.
+
+        Args:
+            texts (iterable): Reply texts to precompile.
+        """
+        self._wire = {}
+        self.update(texts)
+
+    def update(self, texts):
+        """
+        Precompile more reply texts.
+
+        Args:
+            texts (iterable): Reply texts to add.
+        """
+        wire = dict(self._wire)
+        wire.update((text, to_wire(text)) for text in texts if text)
+        self._wire = wire
+
+    def get(self, text):
+        """
+        Return the wire format of a reply.
+
+        Args:
+            text (str): The reply text.
+
+        Returns:
+            bytes: The precompiled bytes, or the text encoded now if it was not precompiled.
+        """
+        data = self._wire.get(text)
+        return data if data is not None else to_wire(text)
+
+    def __contains__(self, text):
+        return text in self._wire
+
+    def __len__(self):
+        return len(self._wire)
@@ -0,0 +1,39 @@
+import os
+import sys
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sinks.base import EventSink
+
+class RecordingSink(EventSink):
+    """A sink that keeps every event in memory."""
+
+    name = 'recording'
+
+    def __init__(self):
+        self.events = []
+        # (command, response) of each interaction
+        self.interactions = []
+
+    def open_session(self, session):
+        self.events.append(('open', session.id))
+
+    def log_interaction(self, record):
+        self.events.append(('interaction',) + record[:3] + record[5:])
+        self.interactions.append(record[5:])
+
+    def close_session(self, session, ts):
+        self.events.append(('close', session.id, session.command_count))
+
+class FakeClock:
+    """A clock that advances by step on every reading, formatted with format if given."""
+
+    def __init__(self, now=1000.0, step=0, format=None):
+        self.now = now
+        self.step = step
+        self.format = format
+
+    def __call__(self):
+        self.now += self.step
+        return self.now if self.format is None else self.format % self.now
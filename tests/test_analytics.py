@@ -61,5 +61,32 @@ class TestAnalytics(unittest.TestCase):
         self.assertEqual(mock_savefig.call_count, 2)
         self.assertEqual(mock_show.call_count, 2)
 
+    @patch('src.analytics.plt.show')
+    @patch('src.analytics.plt.savefig')
+    @patch('src.analytics.plt.figure')
+    def test_generate_graphs_from_chunks(self, mock_figure, mock_savefig, mock_show):
+        self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
+        self.df.loc[self.df.shape[0] - 1, 'timestamp'] = pd.Timestamp.now()
+        chunks = iter([self.df.iloc[:2], self.df.iloc[2:]])
+
+        with patch('builtins.print') as mock_print:
+            analytics.generate_graphs(chunks)
+
+        top_ips = mock_print.call_args_list[1][0][0]
+        self.assertEqual(top_ips.to_dict(), {'192.168.1.1': 2, '192.168.1.2': 2, '192.168.1.3': 1})
+        self.assertEqual(mock_savefig.call_count, 2)
+
+    @patch('src.analytics.Prophet')
+    @patch('src.analytics.pd.DataFrame.to_csv')
+    def test_perform_prediction_from_chunks(self, mock_to_csv, MockProphet):
+        mock_model = MockProphet.return_value
+        mock_model.predict.return_value = pd.DataFrame({'yhat': [1]})
+
+        analytics.perform_prediction(iter([self.df.iloc[:3], self.df.iloc[3:]]))
+
+        fitted = mock_model.fit.call_args[0][0]
+        self.assertEqual(list(fitted.columns), ['ds', 'y'])
+        self.assertEqual(list(fitted['y']), [4, 4, 4, 4, 4])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from smtp.credentials import BloomFilter, CredentialStore
+from tests.helpers import FakeClock
+
+class TestBloomFilter(unittest.TestCase):
+    def test_added_keys_are_always_found(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f'user{i}:pass{i}'.encode() for i in range(1000)]
+        # A new key may already look present (a false positive), but an added key is never missed
+        self.assertGreater(sum(bloom.add(key) for key in keys), 980)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertFalse(bloom.add(keys[0]))
+
+    def test_false_positive_rate_matches_the_sizing(self):
+        bloom = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom.add(b'in%d' % i)
+        false_positives = sum(b'out%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 250)
+
+    def test_invalid_sizing(self):
+        with self.assertRaises(ValueError):
+            BloomFilter(0)
+        with self.assertRaises(ValueError):
+            BloomFilter(100, 1.5)
+
+class TestCredentialStore(unittest.TestCase):
+    def setUp(self):
+        self.rows = []
+        self.store = CredentialStore(self.rows.extend, max_cached=2, capacity=1000, clock=FakeClock(0, step=1, format='ts%03d'))
+
+    def test_new_pairs_are_written_once_and_repeats_are_aggregated(self):
+        self.assertTrue(self.store.record('admin', 'admin', 'LOGIN', '10.0.0.1'))
+        for _ in range(1000):
+            self.assertFalse(self.store.record('admin', 'admin', 'PLAIN', '10.0.0.2'))
+        self.assertEqual(self.rows, [('admin', 'admin', 'LOGIN', '10.0.0.1', 1, 'ts001', 'ts001')])
+
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(self.rows[-1], ('admin', 'admin', 'PLAIN', '10.0.0.2', 1000, 'ts002', 'ts1001'))
+        self.assertEqual(self.store.flush(), 0)
+        self.assertEqual(self.store.stats(), {'attempts': 1001, 'written': 2, 'cached': 1, 'pending': 0,
+                                              'known': 1})
+
+    def test_pairs_known_to_the_filter_are_written_on_eviction(self):
+        self.store.record('a', '1')
+        self.store.record('b', '2')
+        self.store.record('c', '3')
+        self.assertEqual(len(self.store.cache), 2)
+        # 'a' was evicted from the LRU, so it is counted there again and written when evicted
+        self.assertFalse(self.store.record('a', '1'))
+        self.assertFalse(self.store.record('a', '1'))
+        self.store.record('d', '4')
+        self.store.record('e', '5')
+        self.assertIn(('a', '1', None, None, 2, 'ts004', 'ts005'), self.rows)
+
+    def test_missing_and_binary_credentials(self):
+        self.store.record('root', None)
+        self.store.record(b'\xff', b'\xfe')
+        self.assertEqual([row[:2] for row in self.rows], [('root', ''), (b'\xff', b'\xfe')])
+
+    def test_write_errors_are_not_raised(self):
+        def fail(rows):
+            raise RuntimeError('disk full')
+        store = CredentialStore(fail, capacity=100)
+        self.assertTrue(store.record('admin', 'admin'))
+        self.assertEqual(store.stats()['written'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
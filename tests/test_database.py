@@ -1,50 +1,81 @@
 import os
 import sys
+import time
+import sqlite3
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 from datetime import datetime
 import pandas as pd
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Add the src directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
 from src import database
+from db.engine import StorageEngine
+from db.writer import InteractionWriter
 
 class TestDatabase(unittest.TestCase):
-    @patch('sqlite3.connect')
-    def setUp(self, mock_connect):
-        # Mock the database connection and cursor
-        self.mock_conn = MagicMock()
-        self.mock_cursor = MagicMock()
-        mock_connect.return_value = self.mock_conn
-        self.mock_conn.cursor.return_value = self.mock_cursor
-
-        # Mock the cursor methods to ensure they work as expected
-        self.mock_cursor.execute.return_value = None
-        self.mock_cursor.fetchall.return_value = []
-
-        # Call the setup_database function to ensure the table is created
-        database.conn = self.mock_conn
-        database.c = self.mock_cursor
+    def setUp(self):
+        # Point the database layer at a throwaway file
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'test.db')
+        database.open_storage(self.db_path)
         database.setup_database()
 
+    def tearDown(self):
+        database.shutdown_database()
+        self.tmpdir.cleanup()
+
+    def interactions(self, sql, since=None, until=None):
+        with database.attached_shards(since, until) as conn:
+            return conn.execute(sql).fetchall()
+
     def test_setup_database(self):
-        # Check that the correct SQL command was executed
-        expected_call = '''
-        CREATE TABLE IF NOT EXISTS connections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT,
-            timestamp TEXT,
-            command TEXT,
-            response TEXT
-        )
-        '''
-        actual_call = self.mock_cursor.execute.call_args[0][0].strip()
-        self.assertEqual(expected_call.strip(), actual_call)
-        self.mock_conn.commit.assert_called_once()
+        database._flush_records([(database.INTERACTION, None, 0, None, '192.168.1.1', '2024-08-04T10:05:57',
+                                  'HELO x', '250 localhost')])
+
+        conn = sqlite3.connect(self.db_path)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        shard_path = conn.execute('SELECT path FROM shards').fetchone()[0]
+        conn.close()
+        shard = sqlite3.connect(shard_path)
+        indexes = {row[1] for row in shard.execute('PRAGMA index_list(interactions)')}
+        shard.close()
+
+        self.assertTrue({'sessions', 'shards'} <= tables)
+        self.assertEqual(os.path.basename(shard_path), 'test-20240804.db')
+        self.assertTrue({'idx_interactions_ip_ts', 'idx_interactions_session_seq'} <= indexes)
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_no_writer_is_started_after_shutdown(self):
+        session = database.open_session('smtp', '10.0.0.1', 40000)
+        database.shutdown_database()
+
+        with self.assertRaises(RuntimeError):
+            database.close_session(session)
+        self.assertIsNone(database._writer)
+        self.assertNotIn('interaction-writer', [thread.name for thread in threading.enumerate()])
+        database.open_storage(self.db_path)
+        database.close_session(database.open_session('smtp', '10.0.0.2', 40001))
+        database.shutdown_database()
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('SELECT ip, end_ts IS NOT NULL FROM sessions ORDER BY id').fetchall(),
+                         [('10.0.0.1', 0), ('10.0.0.2', 1)])
+        conn.close()
 
+    @patch('src.database.get_writer')
     @patch('src.database.datetime')
-    def test_log_interaction(self, mock_datetime):
+    def test_log_interaction(self, mock_datetime, mock_get_writer):
         # Define test data
         ip = '192.168.1.1'
         command = 'TEST COMMAND'
@@ -55,43 +86,522 @@ class TestDatabase(unittest.TestCase):
         # Call the function to log the interaction
         database.log_interaction(ip, command, response)
 
-        # Check that the correct SQL command was executed with the expected data
-        expected_create_table_call = '''
-        CREATE TABLE IF NOT EXISTS connections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT,
-            timestamp TEXT,
-            command TEXT,
-            response TEXT
-        )
-        '''.strip()
-
-        expected_insert_call = 'INSERT INTO connections (ip, timestamp, command, response) VALUES (?, ?, ?, ?)'
-        expected_insert_data = (ip, test_time.isoformat(), command, response)
-
-        actual_create_table_call = self.mock_cursor.execute.call_args_list[0][0][0].strip()
-        actual_insert_call = self.mock_cursor.execute.call_args_list[1][0][0]
-        actual_insert_data = self.mock_cursor.execute.call_args_list[1][0][1]
-
-        self.assertEqual(expected_create_table_call, actual_create_table_call)
-        self.assertEqual(expected_insert_call, actual_insert_call)
-        self.assertEqual(expected_insert_data, actual_insert_data)
-        self.mock_conn.commit.assert_called()
-
-    @patch('pandas.read_sql_query')
-    def test_collect_honeypot_data(self, mock_read_sql):
-        # Mock the pandas.read_sql_query function
-        mock_df = MagicMock(spec=pd.DataFrame)
-        mock_read_sql.return_value = mock_df
-
-        # Call the function to collect data
+        # The row is queued for the writer thread instead of being written inline
+        mock_get_writer.return_value.put.assert_called_once_with(
+            (database.INTERACTION, None, 0, None, ip, test_time.isoformat(), command, response))
+
+    def test_session_lifecycle(self):
+        session = database.open_session('smtp', '10.0.0.1', 40000)
+        database.log_interaction('10.0.0.1', database.WELCOME, '220 localhost ESMTP', session=session)
+        database.log_interaction('10.0.0.1', 'EHLO x', '250 localhost', session=session)
+        database.close_session(session)
+        database.close_session(session)
+        database.shutdown_database()
+
+        conn = sqlite3.connect(self.db_path)
+        sessions = conn.execute('SELECT id, protocol, ip, port, end_ts IS NOT NULL, command_count, bytes_in, bytes_out '
+                                'FROM sessions').fetchall()
+        conn.close()
+        interactions = self.interactions('SELECT session_id, seq, protocol, command FROM interactions ORDER BY seq')
+        self.assertEqual(sessions, [(session.id, 'smtp', '10.0.0.1', 40000, 1, 1, 6, 32)])
+        self.assertEqual(interactions, [(session.id, 1, 'smtp', 'WELCOME'), (session.id, 2, 'smtp', 'EHLO x')])
+
+    def test_log_interaction_is_written_by_writer(self):
+        database.log_interaction('192.168.1.1', 'HELO x', '250 localhost')
+        database.log_interaction('192.168.1.2', 'QUIT', '221 Bye')
+        database.shutdown_database()
+
+        rows = self.interactions('SELECT ip, command, response FROM connections ORDER BY id')
+        self.assertEqual(rows, [('192.168.1.1', 'HELO x', '250 localhost'), ('192.168.1.2', 'QUIT', '221 Bye')])
+
+    def test_flush_records(self):
+        batch = [(database.INTERACTION, None, 0, None, '192.168.1.1', '2024-08-04T10:05:57', 'HELO x', '250 localhost')] * 3
+        database._flush_records(batch)
+
+        self.assertEqual(self.interactions('SELECT id FROM connections'), [(1,), (2,), (3,)])
+
+    def test_credentials_are_upserted(self):
+        database.log_credentials([('admin', 'admin', 'LOGIN', '10.0.0.1', 1, '2024-08-04T10:00:00', '2024-08-04T10:00:00'),
+                                  (b'\xff', 'x', 'PLAIN', '10.0.0.2', 1, '2024-08-04T10:00:01', '2024-08-04T10:00:01')])
+        database.log_credentials([('admin', 'admin', 'PLAIN', '10.0.0.3', 41, '2024-08-04T09:00:00', '2024-08-04T11:00:00')])
+        database.shutdown_database()
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT username, password, mechanism, last_ip, count, first_ts, last_ts '
+                            'FROM credentials ORDER BY first_ts').fetchall()
+        conn.close()
+        self.assertEqual(rows, [('admin', 'admin', 'PLAIN', '10.0.0.3', 42, '2024-08-04T09:00:00', '2024-08-04T11:00:00'),
+                                (b'\xff', 'x', 'PLAIN', '10.0.0.2', 1, '2024-08-04T10:00:01', '2024-08-04T10:00:01')])
+
+    def test_collect_honeypot_data(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '192.168.1.1', '2024-08-04T10:05:57',
+                                  'HELO x', '250 localhost')])
+
         result = database.collect_honeypot_data()
 
-        # Check that the correct SQL command was executed
-        mock_read_sql.assert_called_once_with("SELECT * FROM connections", database.conn)
+        self.assertIsInstance(result, pd.DataFrame)
+        self.assertEqual(list(result.columns), ['id', 'ip', 'timestamp', 'command', 'response'])
+        self.assertEqual(result.loc[0, 'command'], 'HELO x')
+
+    def test_collect_honeypot_data_window(self):
+        database._flush_records([
+            (database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-03T23:59:59', 'NOOP', '250 OK'),
+            (database.INTERACTION, None, 0, None, '10.0.0.2', '2024-08-04T00:00:01', 'NOOP', '250 OK'),
+            (database.INTERACTION, None, 0, None, '10.0.0.3', '2024-08-05T12:00:00', 'NOOP', '250 OK'),
+        ])
+
+        result = database.collect_honeypot_data(since='2024-08-04T00:00:00', until='2024-08-04T23:59:59')
+        everything = database.collect_honeypot_data()
+
+        self.assertEqual(list(result['ip']), ['10.0.0.2'])
+        self.assertEqual(list(everything['id']), [1, 2, 3])
+
+    def test_iter_interactions_pages_with_filters(self):
+        database._flush_records([
+            (database.INTERACTION, 1, i, 'smtp' if i % 2 else 'pop3', f'10.0.0.{i % 3}', f'2024-08-04T10:00:{i:02d}',
+             f'CMD {i}', 'x' * 100)
+            for i in range(10)
+        ] + [(database.INTERACTION, 2, 0, 'smtp', '10.0.0.1', '2024-08-05T10:00:00', 'LATER', 'y')])
+
+        chunks = list(database.iter_interactions(chunk_size=4))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2, 1])
+        self.assertEqual(list(chunks[0].columns), ['id', 'ip', 'timestamp', 'command', 'response'])
+
+        chunks = list(database.iter_interactions(ip='10.0.0.1', protocol='smtp', columns=['timestamp', 'command'],
+                                                 until='2024-08-04T23:59:59', chunk_size=2))
+        self.assertEqual(list(chunks[0].columns), ['timestamp', 'command'])
+        self.assertEqual([c for chunk in chunks for c in chunk['command']], ['CMD 1', 'CMD 7'])
+
+        chunks = list(database.iter_interactions(since='2024-08-04T10:00:08'))
+        self.assertEqual([c for chunk in chunks for c in chunk['command']], ['CMD 8', 'CMD 9', 'LATER'])
+
+        with self.assertRaises(ValueError):
+            list(database.iter_interactions(columns=['password']))
+
+    def test_shards_for_window(self):
+        database._flush_records([
+            (database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-03T23:59:59', 'NOOP', '250 OK'),
+            (database.INTERACTION, None, 0, None, '10.0.0.2', '2024-08-04T00:00:01', 'NOOP', '250 OK'),
+        ])
+        conn = database.get_engine().connection()
+        shards = database.get_shards()
+
+        self.assertEqual([shard.name for shard in shards.shards_for(conn)], ['20240803', '20240804'])
+        self.assertEqual([shard.name for shard in shards.shards_for(conn, since='2024-08-04T00:00:00')], ['20240804'])
+        self.assertEqual(shards.shards_for(conn, since='2024-08-06T00:00:00'), [])
+        self.assertEqual(self.interactions('SELECT ip FROM interactions', since='2024-08-04T00:00:00'), [('10.0.0.2',)])
+
+    def test_windows_over_more_shards_than_can_be_attached(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', f'2024-08-{day:02d}T{hour}:00:00',
+                                  'NOOP', f'250 day {day}') for day in range(1, 13) for hour in (10, 20)])
+
+        # Only the rows inside the window are copied, to a file next to the shards
+        since, until = '2024-08-01T15:00:00', '2024-08-11T15:00:00'
+        with database.attached_shards(since, until) as conn:
+            rows = conn.execute('SELECT id, response FROM connections ORDER BY id').fetchall()
+            (alias, path), = [row[1:] for row in conn.execute('PRAGMA database_list') if row[1].startswith('window')]
+            copied = conn.execute(f'SELECT COUNT(*) FROM {alias}.interactions').fetchone()[0]
+        self.assertEqual(rows, [(id, f'250 day {(id + 1) // 2}') for id in range(2, 22)])
+        self.assertEqual(copied, 20)
+        self.assertEqual(os.path.dirname(path), database.get_shards().directory)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([row[1] for row in conn.execute('PRAGMA database_list')], ['main', 'temp'])
+
+        with self.assertRaises(ValueError):
+            self.interactions('SELECT COUNT(*) FROM interactions')
+        with self.assertRaises(ValueError):
+            with database.get_shards().attached(conn, database.get_shards().shards_for(conn), views=False):
+                pass
+        self.assertEqual(sum(len(chunk) for chunk in database.iter_interactions()), 24)
+
+    def test_each_shard_is_read_from_one_snapshot(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', f'2024-08-04T10:00:0{i}',
+                                  'NOOP', '250 OK') for i in range(3)])
+        shard_path = database.get_engine().connection().execute('SELECT path FROM shards').fetchone()[0]
+
+        chunks = database.iter_interactions(columns=['id'], chunk_size=1)
+        first = next(chunks)
+        writer = sqlite3.connect(shard_path)
+        with writer:
+            writer.execute("INSERT INTO interactions (id, ip, ts, command) VALUES (4, '10.0.0.2', "
+                           "'2024-08-04T10:00:09', 'QUIT')")
+        writer.close()
+
+        self.assertEqual([int(chunk['id'][0]) for chunk in [first] + list(chunks)], [1, 2, 3])
+        self.assertEqual(list(database.iter_interactions(columns=['id']))[0]['id'].tolist(), [1, 2, 3, 4])
+
+    def test_shard_rolls_over_at_size_limit(self):
+        shards = database.get_shards()
+        shards.max_bytes = 1
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:00', 'NOOP', 'x')])
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:01', 'NOOP', 'y')])
+
+        conn = sqlite3.connect(self.db_path)
+        manifest = conn.execute('SELECT name, min_id, max_id, row_count, sealed FROM shards ORDER BY part').fetchall()
+        conn.close()
+        self.assertEqual(manifest, [('20240804', 1, 1, 1, 1), ('20240804-1', 2, 2, 1, 1)])
+        self.assertEqual(list(database.collect_honeypot_data()['response']), ['x', 'y'])
+
+    def test_reconcile_repairs_manifest(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:00', 'NOOP', 'x')])
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE shards SET row_count = 0, end_ts = '2024-08-04T00:00:00'")
+        conn.commit()
+        conn.close()
+
+        database.shutdown_database()
+        database.setup_database()
+
+        self.assertEqual(len(database.collect_honeypot_data(since='2024-08-04T09:00:00')), 1)
+
+    def test_failed_batch_keeps_the_manifest_of_written_shards(self):
+        interaction = (database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:00', 'NOOP', '250 OK')
+        # A session without an ip violates NOT NULL and rolls back the catalog part of the batch
+        self.assertEqual(database._flush_records([interaction, (database.OPEN, 1, 'smtp', None, None,
+                                                               '2024-08-04T10:00:00')]), 1)
+        database._flush_records([interaction])
+
+        conn = sqlite3.connect(self.db_path)
+        manifest = conn.execute('SELECT name, min_id, max_id, row_count FROM shards').fetchall()
+        conn.close()
+        self.assertEqual(manifest, [('20240804', 1, 2, 2)])
+        self.assertEqual(len(database.collect_honeypot_data()), 2)
+
+    def test_response_ids_survive_a_failed_batch(self):
+        bad_open = (database.OPEN, 1, 'smtp', None, None, '2024-08-04T10:00:00')
+        self.assertEqual(database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1',
+                                                   '2024-08-04T10:00:00', 'EHLO a', 'FIRST RESPONSE'), bad_open]), 1)
+        # A failure before any shard is written rolls the interned texts back with it
+        with patch.object(database.get_shards(), '_shard_for', side_effect=sqlite3.OperationalError('disk I/O error')):
+            self.assertEqual(database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1',
+                                                       '2024-08-04T10:00:01', 'EHLO b', 'LOST RESPONSE')]), 1)
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:02',
+                                  'EHLO c', 'SECOND RESPONSE')])
+
+        conn = sqlite3.connect(self.db_path)
+        responses = conn.execute('SELECT id, text FROM responses ORDER BY id').fetchall()
+        conn.close()
+        self.assertEqual(responses, [(1, 'FIRST RESPONSE'), (2, 'SECOND RESPONSE')])
+        rows = database.collect_honeypot_data()
+        self.assertEqual(list(zip(rows['command'], rows['response'])),
+                         [('EHLO a', 'FIRST RESPONSE'), ('EHLO c', 'SECOND RESPONSE')])
+
+    def test_bad_records_are_dropped_alone(self):
+        dropped = database._flush_records([
+            (database.OPEN, 1, 'smtp', '10.0.0.1', None, '2024-08-04T10:00:00'),
+            (database.OPEN, 2, 'smtp', None, None, '2024-08-04T10:00:00'),
+            (database.INTERACTION, 1, 1, 'smtp', '10.0.0.1', '2024-08-04T10:00:00', 'EHLO x', '250 OK'),
+            (database.INTERACTION, 1, 2, 'smtp', None, '2024-08-04T10:00:01', 'NOOP', '250 OK'),
+            (database.INTERACTION, 1, 3, 'smtp', '10.0.0.1', None, 'NOOP', '250 OK'),
+            (database.INTERACTION, 1, 4, 'smtp', '10.0.0.1', '2024-08-04T10:00:02', 'QUIT', '221 Bye'),
+            (database.CLOSE, '2024-08-04T10:00:02', 2, 10, 20, 1),
+        ])
+
+        conn = sqlite3.connect(self.db_path)
+        sessions = conn.execute('SELECT id, end_ts FROM sessions').fetchall()
+        row_count = conn.execute('SELECT row_count FROM shards').fetchone()[0]
+        conn.close()
+        self.assertEqual(dropped, 3)
+        self.assertEqual(sessions, [(1, '2024-08-04T10:00:02')])
+        self.assertEqual(row_count, 2)
+        self.assertEqual(list(database.collect_honeypot_data()['command']), ['EHLO x', 'QUIT'])
+
+    def test_responses_are_interned(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:00',
+                                  'NOOP', '250 OK')] * 3)
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:01',
+                                  'NOOP', '250 OK'),
+                                 (database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:02',
+                                  'QUIT', None)])
+
+        conn = sqlite3.connect(self.db_path)
+        responses = conn.execute('SELECT id, text FROM responses').fetchall()
+        shard_path = conn.execute('SELECT path FROM shards').fetchone()[0]
+        conn.close()
+        shard = sqlite3.connect(shard_path)
+        response_ids = [row[0] for row in shard.execute('SELECT response_id FROM interactions ORDER BY id')]
+        shard.close()
+
+        self.assertEqual(responses, [(1, '250 OK')])
+        self.assertEqual(response_ids, [1, 1, 1, 1, None])
+        self.assertEqual(database.get_shards().responses.hits, 3)
+        self.assertEqual(list(database.collect_honeypot_data()['response']), ['250 OK'] * 4 + [None])
+        self.assertEqual(self.interactions('SELECT DISTINCT response FROM connections'), [('250 OK',), (None,)])
+
+    def test_version_1_shards_are_upgraded(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-04T10:00:00', 'NOOP', 'x')])
+        conn = database.get_engine().connection()
+        shard_path = conn.execute('SELECT path FROM shards').fetchone()[0]
+        database.shutdown_database()
+        # Rewrite the shard the way version 1 stored it, with response texts inline
+        shard = sqlite3.connect(shard_path)
+        shard.executescript('''
+            DROP TABLE interactions;
+            CREATE TABLE interactions (id INTEGER PRIMARY KEY, session_id INTEGER, seq INTEGER NOT NULL DEFAULT 0,
+                protocol TEXT, ip TEXT NOT NULL, ts TEXT NOT NULL, command TEXT, response TEXT);
+            CREATE INDEX idx_interactions_ts ON interactions (ts);
+            INSERT INTO interactions VALUES (1, NULL, 0, NULL, '10.0.0.1', '2024-08-04T10:00:00', 'NOOP', '250 OK');
+            INSERT INTO interactions VALUES (2, NULL, 0, NULL, '10.0.0.1', '2024-08-04T10:00:01', 'QUIT', '221 Bye');
+            PRAGMA user_version = 1;
+        ''')
+        shard.close()
+
+        database.setup_database()
+
+        shard = sqlite3.connect(shard_path)
+        version = shard.execute('PRAGMA user_version').fetchone()[0]
+        columns = [row[1] for row in shard.execute('PRAGMA table_info(interactions)')]
+        shard.close()
+        self.assertEqual(version, 2)
+        self.assertIn('response_id', columns)
+        self.assertEqual(list(database.collect_honeypot_data()['response']), ['250 OK', '221 Bye'])
+
+    def test_retention_rolls_up_expired_shards(self):
+        database._flush_records([
+            (database.OPEN, 1, 'smtp', '10.0.0.1', None, '2024-08-01T10:00:00'),
+            (database.INTERACTION, 1, 1, 'smtp', '10.0.0.1', '2024-08-01T10:00:00', 'helo x', '250 OK'),
+            (database.INTERACTION, 1, 2, 'smtp', '10.0.0.1', '2024-08-01T10:30:00', 'HELO y', '250 OK'),
+            (database.INTERACTION, 1, 3, 'smtp', '10.0.0.1', '2024-08-01T11:00:00', 'QUIT', '221 Bye'),
+            (database.INTERACTION, None, 0, 'pop3', '10.0.0.2', '2024-08-05T10:00:00', 'USER a', '+OK'),
+        ])
+        conn = database.get_engine().connection()
+        old_shard = conn.execute("SELECT path FROM shards WHERE period = '20240801'").fetchone()[0]
+        retention = database.get_retention()
+        retention.raw_days, retention.rollup_days, retention.batch_size = 7, 365, 1
+
+        stats = retention.run(now=datetime(2024, 8, 10))
+
+        self.assertEqual(stats['shards'], 1)
+        self.assertEqual(stats['sessions'], 1)
+        self.assertFalse(os.path.exists(old_shard))
+        self.assertEqual(conn.execute('SELECT hour, ip, protocol, verb, count FROM rollups ORDER BY hour').fetchall(),
+                         [('2024-08-01T10', '10.0.0.1', 'smtp', 'HELO', 2), ('2024-08-01T11', '10.0.0.1', 'smtp', 'QUIT', 1)])
+        self.assertEqual(list(database.collect_honeypot_data()['ip']), ['10.0.0.2'])
+        self.assertEqual(conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+
+        # Rollups expire on their own, longer schedule
+        self.assertEqual(retention.run(now=datetime(2025, 8, 10))['rollups_deleted'], 3)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM rollups').fetchone()[0], 0)
+
+    def test_ids_keep_growing_once_every_shard_has_expired(self):
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-01T10:00:00', 'NOOP', 'x')] * 2)
+        # A catalog from before the sequence existed takes its high-water mark from the manifest
+        conn = database.get_engine().connection()
+        conn.executescript('DROP TABLE sequences; PRAGMA user_version = 8;')
+        database.shutdown_database()
+        database.setup_database()
+        retention = database.get_retention()
+        retention.raw_days = 7
+        self.assertEqual(retention.run(now=datetime(2024, 8, 10))['shards'], 1)
+        database.shutdown_database()
+        database.setup_database()
+
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-10T10:00:00', 'NOOP', 'y')])
+        self.assertEqual(list(database.collect_honeypot_data()['id']), [3])
+
+    @unittest.skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_export_is_incremental_and_partitioned(self):
+        out_dir = os.path.join(self.tmpdir.name, 'export')
+        database._flush_records([
+            (database.INTERACTION, None, 0, 'smtp', '10.0.0.1', '2024-08-04T23:59:59', 'NOOP', '250 OK'),
+            (database.INTERACTION, None, 0, 'smtp', '10.0.0.1', '2024-08-05T00:00:01', 'NOOP', '250 OK'),
+            (database.INTERACTION, None, 0, 'smtp', '10.0.0.2', '2024-08-05T00:00:02', 'QUIT', '221 Bye'),
+        ])
+
+        stats = database.export_interactions(out_dir, fmt='parquet', batch_size=2)
+        self.assertEqual(stats, {'rows': 3, 'files': 2, 'watermark': 3})
+        self.assertEqual(sorted(os.listdir(out_dir)), ['date=2024-08-04', 'date=2024-08-05'])
+        table = pyarrow.parquet.read_table(os.path.join(out_dir, 'date=2024-08-05'))
+        self.assertEqual(table.column('id').to_pylist(), [2, 3])
+        self.assertTrue(pyarrow.types.is_dictionary(table.schema.field('ip').type))
+
+        # Only rows logged after the previous run are exported
+        self.assertEqual(database.export_interactions(out_dir)['rows'], 0)
+        database._flush_records([(database.INTERACTION, None, 0, 'pop3', '10.0.0.3', '2024-08-05T01:00:00',
+                                  'USER a', '+OK')])
+        stats = database.export_interactions(out_dir, fmt='arrow')
+        self.assertEqual(stats, {'rows': 1, 'files': 1, 'watermark': 4})
+        path = os.path.join(out_dir, 'date=2024-08-05', 'interactions-4-4.arrow')
+        with pyarrow.ipc.open_file(path) as reader:
+            self.assertEqual(reader.read_all().column('command').to_pylist(), ['USER a'])
+
+    def test_export_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            database.export_interactions(self.tmpdir.name, fmt='csv')
+
+class TestSchemaMigration(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'legacy.db')
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE connections (id INTEGER PRIMARY KEY AUTOINCREMENT, ip TEXT, timestamp TEXT, '
+                     'command TEXT, response TEXT)')
+        conn.executemany('INSERT INTO connections (ip, timestamp, command, response) VALUES (?, ?, ?, ?)', [
+            ('1.2.3.4', '2024-08-04T10:00:00', 'EHLO early', '250 localhost'),
+            ('1.2.3.4', '2024-08-04T10:00:01', 'WELCOME', '220 bankers.gov ESMTP'),
+            ('5.6.7.8', '2024-08-04T10:00:02', 'WELCOME', '+OK POP3 server ready'),
+            ('1.2.3.4', '2024-08-04T10:00:03', 'EHLO x', '250 localhost'),
+            ('5.6.7.8', '2024-08-04T10:00:04', 'STAT', '+OK 3 300'),
+            ('1.2.3.4', '2024-08-04T10:00:05', 'WELCOME', '220 bankers.gov ESMTP'),
+        ])
+        conn.commit()
+        conn.close()
+        database.open_storage(self.db_path)
+
+    def tearDown(self):
+        database.shutdown_database()
+        self.tmpdir.cleanup()
+
+    def test_legacy_connections_are_migrated(self):
+        database.setup_database()
+        database.setup_database()
+
+        conn = sqlite3.connect(self.db_path)
+        sessions = conn.execute('SELECT id, protocol, ip, start_ts, end_ts, command_count FROM sessions ORDER BY id').fetchall()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        conn.close()
+        with database.attached_shards() as conn:
+            interactions = conn.execute('SELECT id, session_id, seq, protocol FROM interactions ORDER BY id').fetchall()
+            legacy_view = conn.execute('SELECT COUNT(*) FROM connections').fetchone()[0]
+
+        self.assertEqual(sessions, [
+            (1, 'smtp', '1.2.3.4', '2024-08-04T10:00:01', '2024-08-04T10:00:03', 1),
+            (2, 'pop3', '5.6.7.8', '2024-08-04T10:00:02', '2024-08-04T10:00:04', 1),
+            (3, 'smtp', '1.2.3.4', '2024-08-04T10:00:05', '2024-08-04T10:00:05', 0),
+        ])
+        self.assertEqual(interactions, [(1, None, 0, None), (2, 1, 1, 'smtp'), (3, 2, 1, 'pop3'), (4, 1, 2, 'smtp'),
+                                        (5, 2, 2, 'pop3'), (6, 3, 1, 'smtp')])
+        self.assertEqual(legacy_view, 6)
+        self.assertNotIn('connections', tables)
+        self.assertEqual(len(database.collect_honeypot_data()), 6)
+
+    def test_new_sessions_continue_after_migrated_ones(self):
+        database.setup_database()
+        self.assertEqual(database.open_session('pop3', '9.9.9.9').id, 4)
+
+    def test_new_interactions_continue_after_migrated_ones(self):
+        database.setup_database()
+        database._flush_records([(database.INTERACTION, None, 0, None, '10.0.0.1', '2024-08-05T10:00:00', 'NOOP', 'x')])
+        self.assertEqual(list(database.collect_honeypot_data()['id']), [1, 2, 3, 4, 5, 6, 7])
+
+class TestStorageEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = StorageEngine(os.path.join(self.tmpdir.name, 'engine.db'), synchronous='full',
+                                    cache_size=-2048, mmap_size=0, temp_store='memory')
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmpdir.cleanup()
+
+    def test_pragmas_are_applied(self):
+        conn = self.engine.connection()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 2)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0], -2048)
+        self.assertEqual(conn.execute('PRAGMA temp_store').fetchone()[0], 2)
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+
+    def test_connections_are_per_thread(self):
+        main_conn = self.engine.connection()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.engine.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(self.engine.connection(), main_conn)
+        self.assertIsNot(other[0], main_conn)
+
+    def test_snapshot_is_isolated_from_writer(self):
+        conn = self.engine.connection()
+        conn.execute('CREATE TABLE t (v INTEGER)')
+        conn.commit()
+
+        def write():
+            writer_conn = self.engine.connection()
+            with writer_conn:
+                writer_conn.execute('INSERT INTO t VALUES (1)')
+
+        with self.engine.snapshot() as snapshot:
+            before = snapshot.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+            thread = threading.Thread(target=write)
+            thread.start()
+            thread.join()
+            during = snapshot.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+        after = conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+
+        self.assertEqual((before, during, after), (0, 0, 1))
+
+    def test_invalid_pragma_value(self):
+        with self.assertRaises(ValueError):
+            StorageEngine('x.db', synchronous='sometimes')
+
+class TestInteractionWriter(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def test_batches_are_bounded_by_size(self):
+        writer = InteractionWriter(self.batches.append, batch_size=3, flush_interval=0.05)
+        for i in range(7):
+            writer.put(i)
+        writer.start()
+        writer.stop()
+
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3, 1])
+        self.assertEqual([row for batch in self.batches for row in batch], list(range(7)))
+        self.assertEqual(writer.stats()['flushed'], 7)
+        self.assertEqual(writer.stats()['queue_depth'], 0)
+
+    def test_partial_batch_is_flushed_after_interval(self):
+        writer = InteractionWriter(self.batches.append, batch_size=500, flush_interval=0.05)
+        writer.start()
+        writer.put('row')
+        deadline = time.monotonic() + 2
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.stop()
+
+        self.assertEqual(self.batches, [['row']])
+
+    def test_drop_newest_overflow(self):
+        writer = InteractionWriter(self.batches.append, max_queue=2, overflow='drop_newest')
+        self.assertEqual([writer.put(i) for i in range(4)], [True, True, False, False])
+        writer.stop()
+
+        self.assertEqual(self.batches, [[0, 1]])
+        self.assertEqual(writer.stats()['dropped'], 2)
+
+    def test_drop_oldest_overflow(self):
+        writer = InteractionWriter(self.batches.append, max_queue=2, overflow='drop_oldest')
+        for i in range(4):
+            writer.put(i)
+        writer.stop()
+
+        self.assertEqual(self.batches, [[2, 3]])
+        self.assertEqual(writer.stats()['dropped'], 2)
+
+    def test_failed_flush_is_counted(self):
+        def failing_flush(batch):
+            raise sqlite3.OperationalError('disk I/O error')
+
+        writer = InteractionWriter(failing_flush)
+        writer.put('row')
+        writer.stop()
+
+        self.assertEqual(writer.stats()['failed'], 1)
+        self.assertEqual(writer.stats()['flushed'], 0)
+
+    def test_dropped_records_are_counted(self):
+        writer = InteractionWriter(lambda batch: 1)
+        writer.put_many(['good', 'bad', 'good'])
+        writer.stop()
+
+        self.assertEqual(writer.stats()['failed'], 1)
+        self.assertEqual(writer.stats()['flushed'], 2)
 
-        # Check that the function returns the expected result
-        self.assertEqual(result, mock_df)
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            InteractionWriter(self.batches.append, overflow='ignore')
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import datetime
+import os
+import sys
+import unittest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from pop3.generator import GeneratedMailbox, MessageCache, Template
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), '../var/no_ai/email*_raw_response.txt')
+NOW = datetime.datetime(2024, 6, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+class TestTemplate(unittest.TestCase):
+    def test_greeting_closing_and_signature_are_dropped(self):
+        template = Template.parse('Subject: Quarterly review \n\nDear Team,\n\nFirst paragraph.\n\n'
+                                  '1. Item\n2. Item\n\nBest Regards,\n\nJohn Doe\nManager\nexample.com')
+        self.assertEqual(template.subject, b'Quarterly review')
+        self.assertEqual(template.body, b'First paragraph.\r\n\r\n1. Item\r\n2. Item\r\n')
+
+    def test_closing_and_signature_in_one_block(self):
+        template = Template.parse('Hello,\nThanks for writing.\n\nRegards,\nJane\nexample.com\n')
+        self.assertEqual(template.subject, b'No Subject')
+        self.assertEqual(template.body, b'Thanks for writing.\r\n')
+        self.assertIsNone(Template.parse('Subject: empty\n\n'))
+
+    def test_sample_emails_are_loaded(self):
+        templates = Template.load([TEMPLATES, 'missing/*.txt'])
+        self.assertEqual(len(templates), 3)
+        for template in templates:
+            self.assertNotIn(b'Best Regards', template.body)
+            self.assertTrue(template.body.endswith(b'\r\n'))
+
+class TestGeneratedMailbox(unittest.TestCase):
+    def setUp(self):
+        self.templates = Template.load([TEMPLATES])
+        self.cache = MessageCache(4)
+        self.mailbox = GeneratedMailbox(self.templates, 2000, bytes(32), 'bob', 'bankers.gov', now=NOW,
+                                        cache=self.cache)
+
+    def test_sizes_are_known_without_rendering(self):
+        self.assertEqual(len(self.mailbox), 2000)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.mailbox.total_octets, sum(self.mailbox.octets))
+        for number in range(1, 2001, 37):
+            self.assertEqual(len(self.mailbox.message(number)), self.mailbox.size(number))
+        self.assertEqual(len(self.cache), 4)
+
+    def test_messages_are_varied_and_plausible(self):
+        messages = [self.mailbox.message(number) for number in range(1, 101)]
+        headers = [dict(line.split(b': ', 1) for line in message.split(b'\r\n\r\n')[0].split(b'\r\n'))
+                   for message in messages]
+        self.assertGreater(len({h[b'From'] for h in headers}), 50)
+        self.assertGreater(len({h[b'Subject'] for h in headers}), 5)
+        self.assertEqual({h[b'To'] for h in headers}, {b'bob@bankers.gov'})
+        self.assertEqual(len({message.rsplit(b'\r\n\r\n', 1)[1] for message in messages}), len(messages))
+        # Oldest first, the newest a few hours before now
+        dates = [datetime.datetime.strptime(h[b'Date'].decode(), '%a, %d %b %Y %H:%M:%S %z') for h in headers]
+        self.assertEqual(dates, sorted(dates))
+        last = datetime.datetime.strptime(self.mailbox.message(2000).split(b'Date: ')[1].split(b'\r\n')[0].decode(),
+                                          '%a, %d %b %Y %H:%M:%S %z')
+        self.assertTrue(NOW - datetime.timedelta(days=1) < last < NOW)
+        self.assertGreater(NOW - dates[0], datetime.timedelta(days=300))
+
+    def test_the_same_seed_gives_the_same_mailbox(self):
+        other = GeneratedMailbox(self.templates, 2000, bytes(32), 'bob', 'bankers.gov', now=NOW)
+        self.assertEqual(other.message(7), self.mailbox.message(7))
+        self.assertEqual(other.uid_listing, self.mailbox.uid_listing)
+        different = GeneratedMailbox.for_account(self.templates, 'alice', 'bankers.gov', 2000, now=NOW)
+        self.assertTrue(1600 <= len(different) <= 2000)
+        self.assertNotEqual(different.message(7), self.mailbox.message(7))
+        self.assertEqual(len(set(self.mailbox.uid(n) for n in range(1, 2001))), 2000)
+
+    def test_top_and_chunks(self):
+        message = self.mailbox.message(3)
+        headers_end = message.index(b'\r\n\r\n') + 4
+        self.assertEqual(self.mailbox.top_size(3, 0), headers_end)
+        self.assertEqual(message[headers_end:self.mailbox.top_size(3, 2)].count(b'\r\n'), 2)
+        self.assertEqual(self.mailbox.top_size(3, 10000), len(message))
+        self.assertEqual(b''.join(self.mailbox.chunks(3, 100)), message)
+        self.assertEqual(b''.join(self.mailbox.chunks(3, 100, 250)), message[:250])
+
+    def test_sessions_use_the_running_totals(self):
+        session = self.mailbox.session()
+        self.assertEqual(session.headers(1), b'')
+        self.assertTrue(session.delete(2))
+        self.assertEqual(session.stat(), (1999, self.mailbox.total_octets - self.mailbox.size(2)))
+        self.assertNotIn('\r\n2 ', session.listing())
+        self.assertTrue(self.mailbox.listing.startswith(f'1 {self.mailbox.size(1)}\r\n2 '))
+
+    def test_cache_is_bounded_and_counts_hits(self):
+        for number in (1, 2, 1, 3, 4, 5, 1):
+            self.mailbox.message(number)
+        self.assertEqual(self.cache.stats(), {'cached': 4, 'hits': 2, 'misses': 5})
+        self.assertNotIn((bytes(32), 2), self.cache.messages)
+
+    def test_templates_are_required(self):
+        with self.assertRaises(ValueError):
+            GeneratedMailbox([], 10, bytes(32))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from pop3.mailbox import Mailbox, to_crlf
+from pop3.pop3_utils import SessionHeaders
+
+class TestMailbox(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'pop3', 'mailbox.pack')
+        self.bodies = [b'Subject: one\r\n\r\nfirst\r\n', b'', 'Subject: caf\xe9\n\nsecond\n'.encode('utf-8')]
+        self.mailbox = Mailbox.pack(self.bodies, self.path)
+
+    def tearDown(self):
+        self.mailbox.close()
+        self.tmpdir.cleanup()
+
+    def test_messages_are_read_from_the_packed_file(self):
+        self.assertEqual(len(self.mailbox), 3)
+        self.assertEqual(os.path.getsize(self.path), sum(map(len, self.bodies)))
+        self.assertEqual([self.mailbox.message(n) for n in (1, 2, 3)], self.bodies)
+        self.assertEqual([self.mailbox.size(n) for n in (1, 2, 3)], [len(body) for body in self.bodies])
+        self.assertNotIn(0, self.mailbox)
+        self.assertNotIn(4, self.mailbox)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.path))], ['mailbox.pack'])
+
+    def test_sessions_only_differ_in_their_deleted_messages(self):
+        first, second = self.mailbox.session(), self.mailbox.session()
+        self.assertTrue(first.delete(1))
+        self.assertFalse(first.delete(1))
+        self.assertFalse(first.delete(9))
+        self.assertNotIn(1, first)
+        self.assertIn(1, second)
+        self.assertEqual(first.stat(), (2, len(self.bodies[2])))
+        self.assertEqual(list(first.messages()), [(2, 0), (3, len(self.bodies[2]))])
+        self.assertEqual(second.stat(), (3, self.mailbox.total_octets))
+        first.reset()
+        self.assertEqual(first.stat(), second.stat())
+
+    def test_missing_files_are_skipped(self):
+        source = os.path.join(self.tmpdir.name, 'email_1.txt')
+        with open(source, 'wb') as f:
+            f.write(b'.body\nend')
+        mailbox = Mailbox.from_files([source, os.path.join(self.tmpdir.name, 'missing.txt')], self.path + '.2')
+        self.assertEqual((len(mailbox), mailbox.message(1)), (1, b'.body\r\nend\r\n'))
+        mailbox.close()
+
+        empty = Mailbox.from_files([], os.path.join(self.tmpdir.name, 'empty.pack'))
+        self.assertEqual(empty.session().stat(), (0, 0))
+        self.assertFalse(os.path.exists(empty.path))
+
+    def test_session_headers_are_stable_and_counted(self):
+        headers = SessionHeaders('mail.example.com')
+        mailbox = Mailbox.pack([b'one\r\n', b'.two\r\n'], self.path + '.3', headers)
+        first, second = mailbox.session(), mailbox.session()
+        self.assertEqual(first.message(1), first.message(1))
+        self.assertNotEqual(first.message(1), second.message(1))
+        self.assertTrue(first.message(2).endswith(b'\r\n\r\n.two\r\n'))
+        for session in (first, second):
+            for number in (1, 2):
+                self.assertEqual(len(session.message(number)), session.size(number))
+        self.assertEqual(first.stat(), (2, 2 * headers.size + 11))
+        first.delete(2)
+        self.assertEqual(first.stat(), (1, headers.size + 5))
+        self.assertEqual(first.listing(), f"1 {headers.size + 5}\r\n")
+        mailbox.close()
+
+    def test_index_holds_unique_ids_and_line_offsets(self):
+        mailbox = Mailbox.pack([b'a\r\nbb\r\nccc', b'a\r\nbb\r\nccc', b''], self.path + '.4')
+        self.assertEqual(len(set(mailbox.uids)), 3)
+        self.assertTrue(mailbox.uid(2).startswith(mailbox.uid(1)))
+        self.assertEqual([mailbox.top_size(1, lines) for lines in range(5)], [0, 3, 7, 10, 10])
+        self.assertEqual(list(mailbox.chunks(1, 2, mailbox.top_size(1, 2))), [b'a\r', b'\nb', b'b\r', b'\n'])
+        self.assertEqual(mailbox.top_size(3, 1), 0)
+        mailbox.close()
+
+    def test_wire_form_and_chunks(self):
+        self.assertEqual(to_crlf(b'a\nb\r\nc'), b'a\r\nb\r\nc\r\n')
+        self.assertEqual(list(self.mailbox.chunks(1, 10)), [b'Subject: o', b'ne\r\n\r\nfirs', b't\r\n'])
+        self.assertEqual(list(self.mailbox.chunks(2, 10)), [])
+
+if __name__ == '__main__':
+    unittest.main()
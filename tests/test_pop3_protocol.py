@@ -0,0 +1,250 @@
+import os
+import sys
+import tempfile
+import unittest
+from twisted.internet.address import IPv4Address
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import sinks
+from pop3 import pop3_protocol, pop3_utils
+from pop3.pop3_protocol import POP3Factory
+from pop3.mailbox import Mailbox
+from pop3.pop3_utils import SessionHeaders
+from tests.helpers import RecordingSink
+
+class PausingTransport(StringTransport):
+    """A transport that pauses its streaming producer whenever 4096 bytes are waiting."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pending = 0
+
+    def write(self, data):
+        super().write(data)
+        self.pending += len(data)
+        if self.producer is not None and self.pending >= 4096:
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.pending = 0
+        self.producer.resumeProducing()
+
+class TestPOP3Protocol(unittest.TestCase):
+    def setUp(self):
+        self.sink = RecordingSink()
+        sinks.set_sinks([self.sink])
+        self.factory = POP3Factory()
+        # Serve the packed mailbox the tests install rather than generated ones
+        self.factory.generated_messages = 0
+        self.protocol = self.factory.buildProtocol(None)
+        self.transport = StringTransport(peerAddress=IPv4Address('TCP', '10.0.0.1', 40000))
+        self.protocol.makeConnection(self.transport)
+
+    def tearDown(self):
+        sinks.shutdown_sinks()
+
+    def send(self, data):
+        self.transport.clear()
+        self.protocol.dataReceived(data)
+        return self.transport.value()
+
+    def test_connections_share_the_factory_tables(self):
+        other = self.factory.buildProtocol(None)
+        self.assertIs(other.responses, self.protocol.responses)
+        self.assertIs(other.maildrop.mailbox, self.protocol.maildrop.mailbox)
+        self.assertIsNot(other.maildrop, self.protocol.maildrop)
+        self.assertIn(self.factory.banner, self.factory.wire)
+
+    def test_config_is_read_from_etc_whatever_the_working_directory(self):
+        expected = os.path.abspath(os.path.join(os.path.dirname(__file__), '../etc/config.ini'))
+        self.assertEqual(pop3_protocol.config_file_path, expected)
+        self.assertEqual(pop3_utils.config_file_path, expected)
+
+    def test_replies_are_sent_in_wire_format(self):
+        self.assertEqual(self.sink.interactions[0], ('WELCOME', self.factory.banner))
+        self.assertEqual(self.send(b'USER bob\r\n'), b'+OK User accepted\r\n')
+        self.assertEqual(self.send(b'PASS secret\r\n'), b'+OK Password accepted\r\n')
+        self.assertEqual(self.send(b'QUIT\r\n'), b'+OK Goodbye\r\n')
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(self.sink.interactions[-1], ('QUIT', '+OK Goodbye'))
+
+    def test_sessions_share_the_mapped_mailbox(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            headers = SessionHeaders('mail.example.com')
+            self.factory.mailbox = Mailbox.pack([b'one\r\n', b'.second\r\n'], os.path.join(tmpdir, 'mailbox.pack'),
+                                                headers)
+            self.protocol = self.factory.buildProtocol(None)
+            self.protocol.makeConnection(self.transport)
+            self.send(b'USER bob\r\nPASS secret\r\n')
+            self.assertEqual(self.send(b'STAT\r\n'), b'+OK 2 %d\r\n' % (2 * headers.size + 14))
+            self.assertEqual(self.send(b'DELE 1\r\n'), b'+OK message 1 deleted\r\n')
+            self.assertEqual(self.send(b'DELE 1\r\n'), b'-ERR no such message\r\n')
+            size = headers.size + 9
+            self.assertEqual(self.send(b'LIST\r\n'), b'+OK maildrop follows\r\n2 %d\r\n.\r\n' % size)
+
+            # RETR announces the octets it sends, dot-stuffed and terminated, and logs only the status line
+            reply = self.send(b'RETR 2\r\n')
+            status, _, message = reply.partition(b'\r\n')
+            self.assertEqual(status, b'+OK %d octets' % size)
+            self.assertTrue(message.endswith(b'\r\n..second\r\n.\r\n'))
+            self.assertEqual(len(message.replace(b'\r\n..', b'\r\n.')) - 3, size)
+            self.assertEqual(self.send(b'RETR 2\r\n'), reply)
+            self.assertEqual(self.sink.interactions[-1], ('RETR 2', '+OK %d octets' % size))
+            self.assertEqual(self.factory.buildProtocol(None).maildrop.stat(), (2, 2 * headers.size + 14))
+            self.factory.mailbox.close()
+
+    def test_pipelined_commands_wait_for_a_streamed_message(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            body = b''.join(b'line %d\r\n' % i for i in range(2000))
+            self.factory.mailbox = Mailbox.pack([body, b'a\r\n.b\r\nc\r\n'], os.path.join(tmpdir, 'mailbox.pack'))
+            self.factory.chunk_size = 1000
+            self.protocol = self.factory.buildProtocol(None)
+            self.transport = PausingTransport(peerAddress=IPv4Address('TCP', '10.0.0.1', 40000))
+            self.protocol.makeConnection(self.transport)
+            self.send(b'USER bob\r\nPASS secret\r\n')
+
+            self.send(b'RETR 1\r\nTOP 2 2\r\nSTAT\r\n')
+            self.assertLess(len(self.transport.value()), 5000)
+            self.assertIsNotNone(self.transport.producer)
+            while self.transport.producer is not None:
+                self.transport.drain()
+            self.assertEqual(self.transport.value(),
+                             b'+OK %d octets\r\n' % len(body) + body + b'.\r\n'
+                             b'+OK top of message follows\r\na\r\n..b\r\n.\r\n'
+                             b'+OK 2 %d\r\n' % (len(body) + 10))
+            self.assertEqual(self.send(b'TOP 2\r\nTOP 3 1\r\n'),
+                             b'-ERR syntax: TOP <msg> <lines>\r\n-ERR no such message\r\n')
+            self.factory.mailbox.close()
+
+    def test_timeouts_never_write_into_a_streamed_message(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            body = b''.join(b'line %d\r\n' % i for i in range(2000))
+            self.factory.mailbox = Mailbox.pack([body], os.path.join(tmpdir, 'mailbox.pack'))
+            self.factory.chunk_size = 1000
+            self.factory.admission.session_timeout = 0
+            clock = Clock()
+            self.protocol = self.factory.buildProtocol(None)
+            self.protocol.callLater = clock.callLater
+            self.transport = PausingTransport(peerAddress=IPv4Address('TCP', '10.0.0.1', 40000))
+            self.protocol.makeConnection(self.transport)
+            self.send(b'USER bob\r\nPASS secret\r\nRETR 1\r\n')
+
+            # A reader draining the message slowly is not idle
+            clock.advance(self.factory.admission.idle_timeout * 2)
+            self.assertFalse(self.transport.disconnecting)
+            while self.transport.producer is not None:
+                self.transport.drain()
+            self.assertTrue(self.transport.value().endswith(body + b'.\r\n'))
+            clock.advance(self.factory.admission.idle_timeout)
+            self.assertTrue(self.transport.value().endswith(b'.\r\n-ERR Timeout, closing connection\r\n'))
+
+            # The session limit still applies, but cuts the stream instead of writing into it
+            self.factory.admission.session_timeout = 60
+            self.protocol = self.factory.buildProtocol(None)
+            self.protocol.callLater = clock.callLater
+            self.transport = PausingTransport(peerAddress=IPv4Address('TCP', '10.0.0.2', 40000))
+            self.protocol.makeConnection(self.transport)
+            self.send(b'USER bob\r\nPASS secret\r\nRETR 1\r\n')
+            clock.advance(60)
+            self.assertTrue(self.transport.disconnecting)
+            self.assertIsNone(self.transport.producer)
+            self.assertNotIn(b'-ERR', self.transport.value())
+            self.factory.mailbox.close()
+
+    def test_full_command_set(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.factory.mailbox = Mailbox.pack([b'one\r\ntwo\r\n', b'one\r\ntwo\r\n', b'x\r\n'],
+                                                os.path.join(tmpdir, 'mailbox.pack'))
+            mailbox = self.factory.mailbox
+            self.protocol = self.factory.buildProtocol(None)
+            self.protocol.makeConnection(self.transport)
+
+            self.assertTrue(self.send(b'CAPA\r\n').startswith(b'+OK Capability list follows\r\nTOP\r\n'))
+            self.assertEqual(self.send(b'STAT\r\n'), b'-ERR Command not allowed in this state\r\n')
+            self.assertEqual(self.send(b'XYZZY\r\n'), b'-ERR Unrecognized command\r\n')
+            self.send(b'USER bob\r\nPASS secret\r\n')
+            self.assertEqual(self.send(b'USER bob\r\n'), b'-ERR Command not allowed in this state\r\n')
+
+            self.assertEqual(self.send(b'NOOP\r\n'), b'+OK\r\n')
+            self.assertEqual(self.send(b'LIST 3\r\nLIST 4\r\nLIST x\r\n'),
+                             b'+OK 3 3\r\n-ERR no such message\r\n-ERR no such message\r\n')
+            uids = mailbox.uids
+            self.assertEqual(len(set(uids)), 3)
+            self.assertEqual(self.send(b'UIDL\r\n'),
+                             b'+OK unique-id listing follows\r\n' + mailbox.uid_listing.encode() + b'.\r\n')
+            self.assertEqual(self.send(b'UIDL 2\r\n'), b'+OK 2 %s\r\n' % uids[1].encode())
+            self.assertEqual(self.send(b'TOP 1 1\r\n'), b'+OK top of message follows\r\none\r\n.\r\n')
+            self.assertEqual(self.send(b'TOP 1 0\r\n'), b'+OK top of message follows\r\n.\r\n')
+
+            self.send(b'DELE 2\r\n')
+            self.assertEqual(self.send(b'UIDL\r\n'), b'+OK unique-id listing follows\r\n1 %s\r\n3 %s\r\n.\r\n'
+                             % (uids[0].encode(), uids[2].encode()))
+            self.assertEqual(self.send(b'UIDL 2\r\nLIST 2\r\n'), b'-ERR no such message\r\n' * 2)
+            self.assertEqual(self.send(b'RSET\r\n'), b'+OK maildrop has 3 messages (23 octets)\r\n')
+            self.assertEqual(self.send(b'QUIT\r\n'), b'+OK Goodbye\r\n')
+            self.assertTrue(self.transport.disconnecting)
+            mailbox.close()
+
+    def test_accounts_get_their_own_generated_mailbox(self):
+        self.factory.generated_messages = 1000
+        self.factory.max_mailboxes = 1
+        self.send(b'USER bob\r\nPASS secret\r\n')
+        mailbox = self.protocol.maildrop.mailbox
+        self.assertIsNot(mailbox, self.factory.mailbox)
+        self.assertIs(self.factory.mailbox_for('bob'), mailbox)
+        self.assertTrue(800 <= len(mailbox) <= 1000)
+        self.assertEqual(self.send(b'STAT\r\n'), b'+OK %d %d\r\n' % (len(mailbox), mailbox.total_octets))
+
+        reply = self.send(b'RETR %d\r\n' % len(mailbox))
+        status, _, message = reply.partition(b'\r\n')
+        self.assertEqual(status, b'+OK %d octets' % mailbox.size(len(mailbox)))
+        self.assertIn(b'\r\nTo: bob@', message)
+        self.assertEqual(len(self.factory.message_cache), 1)
+        top = self.send(b'TOP 1 0\r\n')
+        self.assertTrue(top.endswith(b'\r\n\r\n.\r\n'))
+        self.assertIn(b'\r\nSubject: ', top)
+
+        # Evicted mailboxes are rebuilt identical, so other sessions of the account agree
+        self.factory.mailbox_for('alice')
+        self.assertIsNot(self.factory.mailbox_for('bob'), mailbox)
+        self.assertEqual(self.factory.mailbox_for('bob').listing, mailbox.listing)
+        self.assertNotEqual(self.factory.mailbox_for('alice').uid(1), mailbox.uid(1))
+
+    def test_arguments_keep_their_case_and_bytes(self):
+        self.send(b'user Bob\r\n')
+        self.send(b'PASS Hunter 2\xff\r\n')
+        self.assertEqual((self.protocol.user, self.protocol.passwd.encode('utf-8', 'surrogateescape')),
+                         ('bob', b'Hunter 2\xff'))
+        self.assertEqual(self.sink.interactions[-1], (b'PASS Hunter 2\xff', '+OK Password accepted'))
+        self.assertEqual(self.send(b'retr 9\r\n'), b'-ERR no such message\r\n')
+
+    def test_overlong_lines_close_the_connection(self):
+        self.assertEqual(self.send(b'\x00' * 2000), b'-ERR Line too long\r\n')
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(self.sink.interactions[-1], ('\x00' * 2000, '-ERR Line too long'))
+
+    def test_admission_control_and_idle_timeout(self):
+        clock = Clock()
+        self.factory.admission.max_per_ip = 1
+        refused = self.factory.buildProtocol(None)
+        transport = StringTransport(peerAddress=IPv4Address('TCP', '10.0.0.1', 40001))
+        refused.makeConnection(transport)
+        self.assertEqual(transport.value(), b'-ERR [SYS/TEMP] Too many connections from your address\r\n')
+        refused.connectionLost(None)
+
+        other = self.factory.buildProtocol(None)
+        other.callLater = clock.callLater
+        transport = StringTransport(peerAddress=IPv4Address('TCP', '10.0.0.2', 40000))
+        other.makeConnection(transport)
+        clock.advance(self.factory.admission.idle_timeout)
+        self.assertTrue(transport.value().endswith(b'-ERR Timeout, closing connection\r\n'))
+        other.connectionLost(None)
+        self.assertEqual(self.factory.admission.stats()['active'], 1)
+        self.assertEqual(self.factory.admission.stats()['timed_out_idle'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from smtp.rate_limiter import RateLimiter
+from tests.helpers import FakeClock
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_tokens_refill_over_the_period(self):
+        limiter = RateLimiter(3, period=60, clock=self.clock)
+        self.assertEqual([limiter.allow_connection('10.0.0.1') for _ in range(4)], [True, True, True, False])
+        self.assertTrue(limiter.allow_connection('10.0.0.2'))
+
+        self.clock.now += 19
+        self.assertFalse(limiter.allow_connection('10.0.0.1'))
+        self.clock.now += 1
+        self.assertTrue(limiter.allow_connection('10.0.0.1'))
+        self.assertFalse(limiter.allow_connection('10.0.0.1'))
+
+        # An idle source is back to a full bucket without any timer having run
+        self.clock.now += 3600
+        self.assertEqual([limiter.allow_connection('10.0.0.1') for _ in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.stats(), {'allowed': 8, 'rejected': 4, 'evicted': 0, 'tracked': 2})
+
+    def test_least_recently_seen_sources_are_evicted(self):
+        limiter = RateLimiter(1, max_tracked=2, clock=self.clock)
+        limiter.allow_connection('10.0.0.1')
+        limiter.allow_connection('10.0.0.2')
+        self.assertFalse(limiter.allow_connection('10.0.0.1'))
+        limiter.allow_connection('10.0.0.3')
+
+        self.assertEqual(list(limiter.buckets), ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(limiter.evicted, 1)
+        self.assertFalse(limiter.allow_connection('10.0.0.1'))
+
+    def test_sources_can_share_a_network_bucket(self):
+        limiter = RateLimiter(2, prefix_v4=24, prefix_v6=64, clock=self.clock)
+        self.assertTrue(limiter.allow_connection('192.0.2.1'))
+        self.assertTrue(limiter.allow_connection('192.0.2.200'))
+        self.assertFalse(limiter.allow_connection('::ffff:192.0.2.7'))
+        self.assertTrue(limiter.allow_connection('192.0.3.1'))
+
+        self.assertTrue(limiter.allow_connection('2001:db8::1'))
+        self.assertTrue(limiter.allow_connection('2001:db8::ffff:1'))
+        self.assertFalse(limiter.allow_connection('2001:db8:0:0:1::1'))
+        self.assertTrue(limiter.allow_connection('2001:db8:0:1::1'))
+        self.assertEqual(limiter.tracked, 4)
+
+    def test_zero_disables_the_limit(self):
+        limiter = RateLimiter(0, clock=self.clock)
+        self.assertTrue(all(limiter.allow_connection('10.0.0.1') for _ in range(100)))
+        self.assertEqual(limiter.tracked, 0)
+
+    def test_invalid_prefixes_are_rejected(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(5, prefix_v4=33)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import sys
+import gzip
+import json
+import glob
+import tempfile
+import unittest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import sinks
+import database
+from sinks.base import EventSink
+from sinks.jsonl_sink import JSONLSink
+from sinks.sqlite_sink import SQLiteSink
+from tests.helpers import RecordingSink
+
+class FailingSink(EventSink):
+    name = 'failing'
+
+    def log_interaction(self, record):
+        raise RuntimeError('disk full')
+
+class TestDispatcher(unittest.TestCase):
+    def tearDown(self):
+        sinks.shutdown_sinks()
+
+    def test_events_reach_every_sink(self):
+        first, second = RecordingSink(), RecordingSink()
+        sinks.set_sinks([FailingSink(), first, second])
+
+        session = sinks.open_session('smtp', '10.0.0.1', 40000)
+        sinks.log_interaction('10.0.0.1', sinks.WELCOME, '220 ready', session=session)
+        sinks.log_batch('10.0.0.1', [('EHLO x', '250 OK'), ('QUIT', '221 Bye')], session=session)
+        sinks.close_session(session)
+        sinks.close_session(session)
+
+        self.assertEqual(first.events, second.events)
+        self.assertEqual(first.events, [
+            ('open', session.id),
+            ('interaction', session.id, 1, 'smtp', 'WELCOME', '220 ready'),
+            ('interaction', session.id, 2, 'smtp', 'EHLO x', '250 OK'),
+            ('interaction', session.id, 3, 'smtp', 'QUIT', '221 Bye'),
+            ('close', session.id, 2),
+        ])
+
+    def test_session_ids_without_sqlite_come_from_the_clock(self):
+        sinks.set_sinks([RecordingSink()])
+        first = sinks.open_session('pop3', '10.0.0.1')
+        second = sinks.open_session('pop3', '10.0.0.1')
+        self.assertGreater(first.id, 1_600_000_000_000)
+        self.assertEqual(second.id, first.id + 1)
+
+    def test_sinks_are_not_rebuilt_after_shutdown(self):
+        sink = RecordingSink()
+        sinks.set_sinks([sink])
+        session = sinks.open_session('smtp', '10.0.0.1')
+        sinks.shutdown_sinks()
+
+        with self.assertRaises(RuntimeError):
+            sinks.close_session(session)
+        self.assertIsNone(sinks._sinks)
+        sinks.set_sinks([sink])
+        sinks.log_interaction('10.0.0.1', 'QUIT', '221 Bye')
+        self.assertEqual(sink.events[-1], ('interaction', None, 0, None, 'QUIT', '221 Bye'))
+
+    def test_sqlite_sink_writes_through_the_database_layer(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database.open_storage(os.path.join(tmpdir, 'test.db'))
+            database.setup_database()
+            sinks.set_sinks([SQLiteSink()])
+
+            session = sinks.open_session('smtp', '10.0.0.1')
+            sinks.log_batch('10.0.0.1', [('HELO x', '250 OK'), ('QUIT', '221 Bye')], session=session)
+            sinks.close_session(session)
+            sinks.shutdown_sinks()
+
+            data = database.collect_honeypot_data(columns=['command', 'response'])
+            self.assertEqual(list(data['command']), ['HELO x', 'QUIT'])
+            database.shutdown_database()
+
+class TestJSONLSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'logs', 'interactions.jsonl')
+
+    def tearDown(self):
+        sinks.shutdown_sinks()
+        self.tmpdir.cleanup()
+
+    def read(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_events_are_written_as_json_lines(self):
+        sinks.set_sinks([JSONLSink(self.path, fsync_interval=0)])
+        session = sinks.open_session('pop3', '10.0.0.1', 50000)
+        sinks.log_interaction('10.0.0.1', 'USER bob', '+OK', session=session)
+        sinks.log_interaction('10.0.0.1', b'\xff\xfe', '-ERR', session=session)
+        sinks.close_session(session)
+        sinks.shutdown_sinks()
+
+        events = self.read(self.path)
+        self.assertEqual([event['event'] for event in events], ['open', 'interaction', 'interaction', 'close'])
+        self.assertEqual(events[0]['port'], 50000)
+        self.assertEqual(events[1]['command'], 'USER bob')
+        self.assertEqual(events[2]['command'].encode('utf-8', 'surrogateescape'), b'\xff\xfe')
+        self.assertEqual(events[3]['commands'], 2)
+
+    def test_files_are_rotated_and_compressed(self):
+        sink = JSONLSink(self.path, max_bytes=200, batch_size=1)
+        sinks.set_sinks([sink])
+        for i in range(10):
+            sinks.log_interaction('10.0.0.1', f'NOOP {i}', '250 OK')
+        sinks.shutdown_sinks()
+
+        rotated = sorted(glob.glob(os.path.join(self.tmpdir.name, 'logs', 'interactions-*.jsonl.gz')))
+        self.assertEqual(len(rotated), sink.rotations)
+        self.assertGreater(sink.rotations, 1)
+        self.assertEqual(glob.glob(os.path.join(self.tmpdir.name, 'logs', 'interactions-*.jsonl')), [])
+        commands = [event['command'] for path in rotated + [self.path] for event in self.read(path)]
+        self.assertEqual(sorted(commands), sorted(f'NOOP {i}' for i in range(10)))
+
+if __name__ == '__main__':
+    unittest.main()
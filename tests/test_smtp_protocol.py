@@ -0,0 +1,525 @@
+import os
+import sys
+import json
+import glob
+import base64
+import hashlib
+import tempfile
+import textwrap
+import subprocess
+import unittest
+from twisted.internet.address import IPv4Address
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import tls
+import sinks
+import database
+from sinks.base import EventSink
+from smtp_protocol import SMTPFactory
+from smtp.response_manager import ResponseManager
+from smtp.spool import MessageStore
+from smtp.credentials import CredentialStore
+from smtp.smtp_banner import SMTPBanner
+
+class BatchSink(EventSink):
+    name = 'batch'
+
+    def __init__(self):
+        self.batches = []
+
+    def log_interaction(self, record):
+        self.batches.append([record[5:]])
+
+    def log_batch(self, records):
+        self.batches.append([record[5:] for record in records])
+
+class CountingTransport(StringTransport):
+    def __init__(self):
+        super().__init__(peerAddress=IPv4Address('TCP', '10.0.0.1', 40000))
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        super().write(data)
+
+    def writeSequence(self, seq):
+        self.writes += 1
+        super().write(b''.join(seq))
+
+class TLSTransport(CountingTransport):
+    def __init__(self):
+        super().__init__()
+        self.tls = None
+        self.plaintext = None
+
+    def startTLS(self, options):
+        self.tls = options
+        self.plaintext = self.value()
+
+class TestSMTPProtocol(unittest.TestCase):
+    def setUp(self):
+        self.sink = BatchSink()
+        sinks.set_sinks([self.sink])
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Received messages are still recorded in the catalog without the MIME pipeline
+        database.open_storage(os.path.join(self.tmpdir.name, 'test.db'))
+        database.setup_database()
+        self.factory = SMTPFactory()
+        self.factory.message_store = MessageStore(os.path.join(self.tmpdir.name, 'messages'))
+        self.factory.pipeline = None
+        self.credentials = []
+        self.factory.credentials = CredentialStore(self.credentials.extend, clock=lambda: 'ts')
+        self.protocol = self.factory.buildProtocol(None)
+        self.transport = CountingTransport()
+        self.protocol.makeConnection(self.transport)
+        self.transport.clear()
+        self.transport.writes = 0
+
+    def tearDown(self):
+        sinks.shutdown_sinks()
+        database.shutdown_database()
+        self.tmpdir.cleanup()
+
+    def send(self, data):
+        self.transport.clear()
+        self.protocol.dataReceived(data)
+        return self.transport.value().decode('utf-8').split('\r\n')[:-1]
+
+    def test_pipelined_commands_are_answered_in_one_write(self):
+        lines = self.send(b'EHLO bot\r\nMAIL FROM:<a@b.c>\r\nRCPT TO:<x@y.z>\r\nRCPT TO:<w@y.z>\r\nDATA\r\n')
+
+        self.assertEqual(self.transport.writes, 1)
+        self.assertIn('250 SMTPUTF8', lines)
+        self.assertEqual(lines[-4:], ['250 2.1.0 Ok', '250 2.1.5 Ok', '250 2.1.5 Ok',
+                                      '354 End data with <CR><LF>.<CR><LF>'])
+        self.assertEqual([command for command, _ in self.sink.batches[-1]],
+                         ['EHLO bot', 'MAIL FROM:<a@b.c>', 'RCPT TO:<x@y.z>', 'RCPT TO:<w@y.z>', 'DATA'])
+        self.assertEqual(self.protocol.recipients, ['<x@y.z>', '<w@y.z>'])
+
+        self.send(b'Subject: hi\r\n..dot\r\n.\r\nQUIT\r\nNOOP\r\n')
+        self.assertEqual(self.sink.batches[-1], [('.', '250 OK: Queued'), ('QUIT', '221 2.0.0 Bye')])
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_commands_out_of_sequence(self):
+        self.assertEqual(self.send(b'MAIL FROM:<a@b.c>\r\n'), ['503 5.5.1 Error: send HELO/EHLO first'])
+        self.send(b'HELO bot\r\n')
+        self.assertEqual(self.send(b'RCPT TO:<x@y.z>\r\n'), ['503 5.5.1 Error: need MAIL command'])
+        self.assertEqual(self.send(b'DATA\r\n'), ['503 5.5.1 Error: need RCPT command'])
+        self.assertEqual(self.send(b'MAIL TO:<a@b.c>\r\n'), ['501 5.5.4 Syntax: MAIL FROM:<address>'])
+        self.send(b'MAIL FROM:<a@b.c>\r\n')
+        self.assertEqual(self.send(b'MAIL FROM:<a@b.c>\r\n'), ['503 5.5.1 Error: nested MAIL command'])
+        self.assertEqual(self.send(b'RSET\r\nNOOP\r\nFOO\r\n'), ['250 2.0.0 Ok', '250 2.0.0 Ok',
+                                                               '500 5.5.2 Command unrecognized'])
+        self.assertEqual(self.protocol.state, 'GREETED')
+
+    def test_auth_login_is_always_rejected(self):
+        self.send(b'EHLO bot\r\n')
+        self.assertEqual(self.send(b'AUTH LOGIN\r\n'), ['334 VXNlcm5hbWU6'])
+        self.assertEqual(self.send(base64.b64encode(b'admin') + b'\r\n'), ['334 UGFzc3dvcmQ6'])
+        self.assertEqual(self.send(base64.b64encode(b'hunter2') + b'\r\n'),
+                         ['535 5.7.8 Authentication credentials invalid'])
+        self.assertEqual((self.protocol.auth_username, self.protocol.auth_password), ('admin', 'hunter2'))
+        self.assertEqual(self.protocol.state, 'GREETED')
+
+        plain = base64.b64encode(b'\0root\0toor')
+        self.assertEqual(self.send(b'AUTH PLAIN ' + plain + b'\r\n'), ['535 5.7.8 Authentication credentials invalid'])
+        self.assertEqual((self.protocol.auth_username, self.protocol.auth_password), ('root', 'toor'))
+        self.assertEqual(self.send(b'AUTH CRAM-MD5\r\n'), ['504 5.5.4 Unrecognized authentication type'])
+
+        # A repeated pair is only counted until the next flush
+        self.send(b'AUTH PLAIN ' + plain + b'\r\n')
+        self.send(b'AUTH PLAIN ' + base64.b64encode(b'\0root\0\xff') + b'\r\n')
+        self.assertEqual(self.credentials, [('admin', 'hunter2', 'LOGIN', '10.0.0.1', 1, 'ts', 'ts'),
+                                            ('root', 'toor', 'PLAIN', '10.0.0.1', 1, 'ts', 'ts'),
+                                            ('root', b'\xff', 'PLAIN', '10.0.0.1', 1, 'ts', 'ts')])
+        self.factory.credentials.flush()
+        self.assertEqual(self.credentials[-1], ('root', 'toor', 'PLAIN', '10.0.0.1', 1, 'ts', 'ts'))
+
+    def test_raw_command_bytes_are_logged_verbatim(self):
+        self.send(b'HELO bot\r\n')
+        self.assertEqual(self.send(b'\xff\xfb\x01\r\nMAIL FROM:<\xe9t\xe9@b.c>\r\n'),
+                         ['500 5.5.2 Command unrecognized', '250 2.1.0 Ok'])
+        self.assertEqual([command for command, _ in self.sink.batches[-1]],
+                         [b'\xff\xfb\x01', b'MAIL FROM:<\xe9t\xe9@b.c>'])
+        self.assertEqual(self.protocol.mail_from.encode('utf-8', 'surrogateescape'), b'<\xe9t\xe9@b.c>')
+
+    def test_overlong_lines_close_the_connection(self):
+        self.factory.max_line_length = 64
+        self.send(b'HELO bot\r\nMAIL FROM:<a@b.c>\r\nRCPT TO:<x@y.z>\r\nDATA\r\n')
+        # Message lines may be as long as the in-memory spool
+        self.assertEqual(self.send(b'x' * 1000 + b'\r\n.\r\n'), ['250 OK: Queued'])
+        self.assertEqual(self.protocol.MAX_LENGTH, 64)
+
+        junk = b'A' * 65
+        self.assertEqual(self.send(junk + b'\r\nNOOP\r\n'), ['500 5.5.0 Error: line too long'])
+        self.assertEqual(self.sink.batches[-1], [('A' * 65 + '\r\nNOOP\r\n', '500 5.5.0 Error: line too long')])
+        self.assertTrue(self.transport.disconnecting)
+
+    def stored_messages(self):
+        return sorted(glob.glob(os.path.join(self.factory.message_store.directory, '*', '*.eml')))
+
+    def test_messages_are_stored_once_by_digest(self):
+        body = b'Subject: spam\r\n..leading dot\r\n\xff\xfe raw\r\n'
+        for _ in range(2):
+            self.send(b'HELO bot\r\nMAIL FROM:<a@b.c>\r\nRCPT TO:<x@y.z>\r\nDATA\r\n')
+            self.assertEqual(self.send(body + b'.\r\n'), ['250 OK: Queued'])
+
+        expected = body.replace(b'\n..', b'\n.')
+        digest = hashlib.sha256(expected).hexdigest()
+        self.assertEqual(self.stored_messages(), [self.factory.message_store.path_for(digest)])
+        with open(self.stored_messages()[0], 'rb') as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual(self.factory.message_store.stats, {'stored': 1, 'duplicates': 1})
+
+    def test_large_messages_are_spooled_to_disk(self):
+        self.factory.spool_memory = 1024
+        self.send(b'HELO bot\r\nMAIL FROM:<a@b.c>\r\nRCPT TO:<x@y.z>\r\nDATA\r\n')
+        self.send(b'x' * 100 + b'\r\n')
+        self.send((b'y' * 998 + b'\r\n') * 5)
+        self.assertFalse(self.protocol.spool.in_memory)
+        self.assertEqual(self.send(b'.\r\n'), ['250 OK: Queued'])
+        self.assertEqual(os.path.getsize(self.stored_messages()[0]), 102 + 5 * 1000)
+        self.assertEqual(os.listdir(self.factory.message_store.spool_dir), [])
+
+    def test_messages_over_the_size_limit_are_rejected(self):
+        self.factory.max_message_size = 1000
+        self.assertIn('250-SIZE 1000', self.send(b'EHLO bot\r\n'))
+        self.assertEqual(self.send(b'MAIL FROM:<a@b.c> SIZE=1001\r\n'),
+                         ['552 5.3.4 Message size exceeds fixed maximum message size'])
+        self.send(b'MAIL FROM:<a@b.c> SIZE=900\r\nRCPT TO:<x@y.z>\r\nDATA\r\n')
+        self.assertEqual(self.protocol.mail_from, '<a@b.c>')
+        self.assertEqual(self.send((b'z' * 98 + b'\r\n') * 20), [])
+        self.assertEqual(self.send(b'.\r\n'), ['552 5.3.4 Message size exceeds fixed maximum message size'])
+        self.assertEqual(self.protocol.state, 'GREETED')
+        self.assertEqual(self.stored_messages(), [])
+
+    def test_replies_come_from_the_precompiled_table(self):
+        wire = self.factory.responses.wire
+        self.assertIn('250 2.1.0 Ok', wire)
+        self.assertIs(wire.get('250 2.1.0 Ok'), wire.get('250 2.1.0 Ok'))
+
+        lines = self.send(b'EHLO bot\r\n')
+        self.assertTrue(lines[0].endswith('Hello [10.0.0.1]'))
+        self.assertEqual(lines[-1], '250 SMTPUTF8')
+        self.assertEqual(self.sink.batches[-1][0][1], '\r\n'.join(lines))
+        self.assertEqual(self.factory.ehlo_capabilities(), self.factory.ehlo_capabilities())
+
+@unittest.skipUnless(tls.available(), 'pyOpenSSL is not installed')
+class TestSTARTTLS(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.cert = os.path.join(cls.tmpdir.name, 'tls', 'test.crt')
+        cls.key = os.path.join(cls.tmpdir.name, 'tls', 'test.key')
+        cls.options = tls.server_options(cls.cert, cls.key, 'mail.example.com')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        sinks.set_sinks([BatchSink()])
+        self.factory = SMTPFactory(tls=self.options)
+        self.factory.pipeline = None
+        self.protocol = self.factory.buildProtocol(None)
+        self.transport = TLSTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def tearDown(self):
+        sinks.shutdown_sinks()
+
+    def test_certificate_is_generated_once_with_a_cached_context(self):
+        self.assertEqual(os.stat(self.key).st_mode & 0o777, 0o600)
+        with open(self.cert, 'rb') as f:
+            pem = f.read()
+        tls.server_options(self.cert, self.key)
+        with open(self.cert, 'rb') as f:
+            self.assertEqual(f.read(), pem)
+        self.assertIs(self.options.getContext(), self.options.getContext())
+        self.assertTrue(self.options.enableSessions)
+        self.assertTrue(self.options.enableSessionTickets)
+
+    def test_starttls_upgrades_the_connection_and_resets_the_session(self):
+        self.transport.clear()
+        self.protocol.dataReceived(b'EHLO bot\r\n')
+        self.assertIn(b'250-STARTTLS\r\n', self.transport.value())
+
+        self.transport.clear()
+        self.protocol.dataReceived(b'MAIL FROM:<a@b.c>\r\nSTARTTLS\r\nRCPT TO:<injected@x.y>\r\n')
+        self.assertIs(self.transport.tls, self.options)
+        self.assertEqual(self.transport.plaintext, b'250 2.1.0 Ok\r\n220 2.0.0 Ready to start TLS\r\n')
+        self.assertEqual((self.protocol.state, self.protocol.recipients), ('INITIAL', []))
+        self.assertTrue(self.protocol.tls_active)
+
+        self.transport.clear()
+        self.protocol.dataReceived(b'EHLO bot\r\nSTARTTLS\r\n')
+        self.assertNotIn(b'STARTTLS\r\n250', self.transport.value())
+        self.assertTrue(self.transport.value().endswith(b'554 5.5.1 Error: TLS already active\r\n'))
+
+    def test_starttls_without_tls_options(self):
+        self.factory.tls = None
+        self.transport.clear()
+        self.protocol.dataReceived(b'EHLO bot\r\nSTARTTLS\r\n')
+        self.assertNotIn(b'STARTTLS', self.transport.value())
+        self.assertTrue(self.transport.value().endswith(b'454 4.7.0 TLS not available due to temporary reason\r\n'))
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        sinks.set_sinks([BatchSink()])
+        self.clock = Clock()
+        self.factory = SMTPFactory()
+        self.factory.pipeline = None
+        self.admission = self.factory.admission
+        self.admission.max_sessions, self.admission.max_per_ip = 3, 2
+        self.admission.idle_timeout, self.admission.session_timeout = 300, 1800
+
+    def tearDown(self):
+        sinks.shutdown_sinks()
+
+    def connect(self, ip):
+        protocol = self.factory.buildProtocol(None)
+        protocol.callLater = self.clock.callLater
+        transport = StringTransport(peerAddress=IPv4Address('TCP', ip, 40000))
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def disconnect(self, protocol):
+        protocol.connectionLost(None)
+
+    def test_sessions_are_capped_per_ip_and_in_total(self):
+        first, _ = self.connect('10.0.0.1')
+        self.connect('10.0.0.1')
+        refused, transport = self.connect('10.0.0.1')
+        self.assertEqual(transport.value(), b'421 4.7.0 Too many connections from your host\r\n')
+        self.assertTrue(transport.disconnecting)
+        self.disconnect(refused)
+
+        self.connect('10.0.0.2')
+        _, transport = self.connect('10.0.0.3')
+        self.assertEqual(transport.value(), b'421 4.3.2 Too many connections, try again later\r\n')
+
+        self.disconnect(first)
+        _, transport = self.connect('10.0.0.3')
+        self.assertTrue(transport.value().startswith(b'220 '))
+        self.assertEqual(self.admission.stats(), {
+            'active': 3, 'peak_active': 3, 'ips': 3, 'admitted': 4, 'rejected_global': 1, 'rejected_per_ip': 1,
+            'timed_out_idle': 0, 'timed_out_session': 0})
+
+    def test_idle_and_long_sessions_time_out(self):
+        idle, idle_transport = self.connect('10.0.0.1')
+        busy, busy_transport = self.connect('10.0.0.2')
+        for _ in range(6):
+            self.clock.advance(299)
+            busy.dataReceived(b'NOOP\r\n')
+        self.disconnect(idle)
+        self.assertTrue(idle_transport.value().endswith(b'421 4.4.2 Error: timeout exceeded\r\n'))
+        self.assertFalse(busy_transport.disconnecting)
+
+        self.clock.advance(1800 - 6 * 299)
+        self.assertTrue(busy_transport.value().endswith(b'421 4.4.2 Error: timeout exceeded\r\n'))
+        self.assertTrue(busy_transport.disconnecting)
+        self.disconnect(busy)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        stats = self.admission.stats()
+        self.assertEqual((stats['active'], stats['timed_out_idle'], stats['timed_out_session']), (0, 1, 1))
+
+class TestSMTPBanner(unittest.TestCase):
+    def test_exchange_banner_is_rebuilt_once_per_second(self):
+        now = [1700000000.2]
+        banner = SMTPBanner('mail.example.com', 'exchange', clock=lambda: now[0])
+        first = banner.render()
+        now[0] += 0.5
+        self.assertIs(banner.render(), first)
+        now[0] += 0.5
+        second = banner.render()
+        self.assertIsNot(second, first)
+        self.assertTrue(second[0].startswith('220 mail.example.com Microsoft ESMTP MAIL Service ready at '))
+        self.assertEqual(second[1], second[0].encode('utf-8') + b'\r\n')
+
+    def test_generic_banner_is_static(self):
+        banner = SMTPBanner('mail.example.com', 'generic')
+        self.assertEqual(banner.render(), ('220 mail.example.com ESMTP', b'220 mail.example.com ESMTP\r\n'))
+        self.assertEqual(banner.get_banner(), '220 mail.example.com ESMTP')
+
+MULTIPART = b'''From: Bot <bot@spam.example>\r
+To: victim@example.com\r
+Subject: =?utf-8?q?Invoice_=E2=82=AC?=\r
+Message-ID: <1@spam.example>\r
+MIME-Version: 1.0\r
+Content-Type: multipart/mixed; boundary="b"\r
+\r
+--b\r
+Content-Type: text/plain\r
+\r
+Please pay.\r
+--b\r
+Content-Type: application/octet-stream\r
+Content-Disposition: attachment; filename="invoice.exe"\r
+Content-Transfer-Encoding: base64\r
+\r
+TVqQAAMAAAAEAAAA\r
+--b--\r
+'''
+
+class TestMessagePipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'test.db')
+        database.open_storage(self.path)
+        database.setup_database()
+        sinks.set_sinks([BatchSink()])
+        self.factory = SMTPFactory()
+        self.factory.message_store = MessageStore(os.path.join(self.tmpdir.name, 'messages'))
+        self.attachments = os.path.join(self.tmpdir.name, 'attachments')
+        self.factory.pipeline.attachment_dir = self.attachments
+
+    def tearDown(self):
+        if self.factory.pipeline is not None:
+            self.factory.pipeline.stop()
+        sinks.shutdown_sinks()
+        database.shutdown_database()
+        self.tmpdir.cleanup()
+
+    def deliver(self, body):
+        protocol = self.factory.buildProtocol(None)
+        protocol.makeConnection(CountingTransport())
+        protocol.dataReceived(b'HELO bot\r\nMAIL FROM:<bot@spam.example>\r\nRCPT TO:<victim@example.com>\r\n'
+                              b'DATA\r\n' + body + b'.\r\nQUIT\r\n')
+        protocol.connectionLost(None)
+
+    def query(self, sql):
+        # Reopening flushes the writer and lets the parse results still due be recorded
+        database.open_storage(self.path)
+        return database.get_engine().connection().execute(sql).fetchall()
+
+    def test_messages_are_parsed_in_worker_processes(self):
+        self.deliver(MULTIPART)
+        self.deliver(MULTIPART)
+        self.factory.pipeline.stop()
+
+        messages = self.query('SELECT status, seen_count, rcpt_to, subject, from_header, message_id, part_count '
+                              'FROM messages')
+        self.assertEqual(messages, [('parsed', 2, '<victim@example.com>', 'Invoice €',
+                                     'Bot <bot@spam.example>', '<1@spam.example>', 3)])
+        payload = base64.b64decode(b'TVqQAAMAAAAEAAAA')
+        digest = hashlib.sha256(payload).hexdigest()
+        self.assertEqual(self.query('SELECT part, digest, filename, content_type, size FROM attachments'),
+                         [(2, digest, 'invoice.exe', 'application/octet-stream', len(payload))])
+        with open(os.path.join(self.attachments, digest[:2], digest), 'rb') as f:
+            self.assertEqual(f.read(), payload)
+        stats = self.factory.pipeline.stats()
+        self.assertEqual((stats['submitted'], stats['parsed'], stats['pending']), (1, 1, 0))
+        self.assertGreater(stats['latency_p99_ms'], 0)
+
+    def test_a_full_pipeline_leaves_messages_for_a_later_sweep(self):
+        self.factory.pipeline.max_pending = 0
+        self.deliver(b'Subject: later\r\n\r\nbody\r\n')
+        self.assertEqual(self.factory.pipeline.stats()['deferred'], 1)
+        self.assertEqual(self.query('SELECT status FROM messages'), [('pending',)])
+
+        self.factory.pipeline.max_pending = 4
+        self.assertEqual(self.factory.pipeline.sweep(), 1)
+        self.factory.pipeline.stop()
+        self.assertEqual(self.query('SELECT status, subject, part_count FROM messages'), [('parsed', 'later', 1)])
+
+    def test_messages_are_recorded_with_parsing_disabled(self):
+        self.factory.pipeline.stop()
+        self.factory.pipeline = None
+        self.deliver(b'Subject: unparsed\r\n\r\nbody\r\n')
+        self.deliver(b'Subject: unparsed\r\n\r\nbody\r\n')
+        self.assertEqual(self.query('SELECT status, seen_count FROM messages'), [('pending', 2)])
+
+class TestResponseManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'smtp_response.txt')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, codes, mtime):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'SMTP_Response_Codes': codes}, f)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_table_is_swapped_when_the_file_changes(self):
+        self.write({'221': 'Bye'}, 1000)
+        manager = ResponseManager(self.path)
+        table = manager.responses
+        self.assertEqual(manager.get_response('221'), '221 Bye')
+        with self.assertRaises(TypeError):
+            table['221'] = 'changed'
+
+        self.assertFalse(manager.reload())
+        self.write({'221': 'See you'}, 2000)
+        self.assertTrue(manager.reload())
+        self.assertEqual(manager.get_response('221'), '221 See you')
+        self.assertEqual(table['221'], '221 Bye')
+
+    def test_protocols_share_the_factory_table(self):
+        factory = SMTPFactory()
+        first, second = factory.buildProtocol(None), factory.buildProtocol(None)
+        self.assertIs(first.responses, factory.responses)
+        self.assertIs(second.responses, factory.responses)
+
+# A reactor cannot be restarted, so the shutdown test runs one in a child process with
+# the triggers registered by bin/genaipot.py
+SHUTDOWN_SCRIPT = textwrap.dedent('''
+    import base64, json, sqlite3, sys, threading
+    sys.path.insert(0, sys.argv[1])
+    from twisted.internet import protocol, reactor
+    from twisted.protocols.basic import LineReceiver
+    import database, sinks
+    from sinks.sqlite_sink import SQLiteSink
+    from smtp_protocol import SMTPFactory
+
+    database.open_storage(sys.argv[2])
+    database.setup_database()
+    sinks.set_sinks([SQLiteSink()])
+    port = reactor.listenTCP(0, SMTPFactory(), interface='127.0.0.1')
+    reactor.addSystemEventTrigger('after', 'shutdown', sinks.shutdown_sinks)
+    reactor.addSystemEventTrigger('after', 'shutdown', database.shutdown_database)
+
+    class Client(LineReceiver):
+        refused = 0
+
+        def connectionMade(self):
+            auth = b'AUTH PLAIN ' + base64.b64encode(b'\\0root\\0toor') + b'\\r\\n'
+            self.transport.write(b'EHLO bot\\r\\n' + auth + auth)
+
+        def lineReceived(self, line):
+            self.refused += line.startswith(b'535')
+            if self.refused == 2:
+                # Stop with the session still open and the attempts still counted in memory
+                reactor.stop()
+
+    protocol.ClientCreator(reactor, Client).connectTCP('127.0.0.1', port.getHost().port)
+    reactor.callLater(20, reactor.stop)
+    reactor.run()
+
+    conn = sqlite3.connect(sys.argv[2])
+    print(json.dumps({
+        'credentials': conn.execute('SELECT username, password, count FROM credentials').fetchall(),
+        'closed': conn.execute('SELECT end_ts IS NOT NULL FROM sessions').fetchall(),
+        'threads': [thread.name for thread in threading.enumerate() if thread.is_alive()],
+    }))
+''')
+
+class TestShutdown(unittest.TestCase):
+    def test_reactor_shutdown_writes_the_last_session_and_credentials(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+            result = subprocess.run([sys.executable, '-c', SHUTDOWN_SCRIPT, src, os.path.join(tmpdir, 'test.db')],
+                                    cwd=tmpdir, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        state = json.loads(result.stdout.splitlines()[-1])
+        self.assertEqual(state['credentials'], [['root', 'toor', 2]])
+        self.assertEqual(state['closed'], [[1]])
+        self.assertNotIn('interaction-writer', state['threads'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+from twisted.internet.testing import StringTransport
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from pop3.streaming import DotStuffer, MessageProducer
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class PausingTransport(StringTransport):
+    """A transport whose write buffer pauses the producer every buffer_size bytes."""
+
+    def __init__(self, buffer_size):
+        super().__init__()
+        self.buffer_size = buffer_size
+        self.pending = 0
+        self.pauses = 0
+
+    def write(self, data):
+        super().write(data)
+        self.pending += len(data)
+        if self.producer is not None and self.pending >= self.buffer_size:
+            self.pauses += 1
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.pending = 0
+        self.producer.resumeProducing()
+
+class TestDotStuffer(unittest.TestCase):
+    def test_stuffing_is_independent_of_chunk_boundaries(self):
+        data = b'.first\r\nplain\r\n..two dots\r\nmid.dot\r\n.\r\nend\r\n'
+        expected = b'..first\r\nplain\r\n...two dots\r\nmid.dot\r\n..\r\nend\r\n'
+        for size in range(1, len(data) + 1):
+            stuffer = DotStuffer()
+            self.assertEqual(b''.join(stuffer.feed(chunk) for chunk in split(data, size)), expected, size)
+            self.assertTrue(stuffer.line_start)
+
+class TestMessageProducer(unittest.TestCase):
+    def test_writes_stop_while_the_transport_is_paused(self):
+        body = b'x' * 1000 + b'\r\n.dot\r\n' + b'y' * 1000
+        transport = PausingTransport(buffer_size=300)
+        results = []
+        producer = MessageProducer(transport, split(body, 100))
+        producer.start().addCallback(results.append)
+
+        self.assertEqual(transport.value(), body[:300])
+        self.assertIs(transport.producer, producer)
+        while transport.producer is not None:
+            transport.drain()
+        self.assertEqual(transport.value(), body.replace(b'\n.', b'\n..') + b'\r\n.\r\n')
+        self.assertEqual(results, [len(body) + 1])
+        self.assertGreater(transport.pauses, 5)
+
+    def test_lost_connection_fails_the_response(self):
+        transport = PausingTransport(buffer_size=10)
+        failures = []
+        producer = MessageProducer(transport, split(b'z' * 100, 10))
+        producer.start().addErrback(failures.append)
+        producer.stopProducing()
+        self.assertEqual(len(failures), 1)
+        self.assertIsNone(transport.producer)
+        self.assertEqual(transport.value(), b'z' * 10)
+
+if __name__ == '__main__':
+    unittest.main()